@@ -1,31 +1,64 @@
+import asyncio
 import io
 import logging
 import base64
 import pathlib
+from typing import Optional
 
 from PIL import Image
 from briq_api.api.theme import get_booklet_id_from_token_id, get_booklet_token_id_from_id
 from briq_api.config import ENV
 
 from datetime import datetime
-from briq_api.memory_cache import CacheData
+from briq_api.memory_cache import CacheData, shared_memory_cache
 
 from briq_api.set_identifier import SetRID
 from briq_api.stores import genesis_storage, file_storage
+from briq_api.storage.file.file_client import FileData, FileInfo, FileStream
 from briq_api.indexer.storage import mongo_storage
 from briq_api.api.boxes import BoxRID, get_booklet_metadata
-from briq_api.mesh.briq import BriqData
+from briq_api.model_executor import (
+    LOD_MODEL_KINDS, QueueFullException, model_executor, render_model, render_preview, render_small_preview
+)
 
 logger = logging.getLogger(__name__)
 
 
-@CacheData.memory_cache(lambda rid: f"{rid.chain_id},{rid.token_id}", timeout=5 * 60)
-def cached_set_metadata(rid: SetRID):
-    return file_storage.load_set_metadata(rid)
+@CacheData.memory_cache(lambda rid: f"{rid.chain_id},{rid.token_id}", timeout=5 * 60, single_flight=True, shared=True)
+async def cached_set_metadata(rid: SetRID):
+    return await file_storage.aload_set_metadata(rid)
+
+
+async def has_set(rid: SetRID) -> bool:
+    return await file_storage.ahas_set_metadata(rid)
 
 
 async def get_metadata(rid: SetRID):
-    data = cached_set_metadata(rid)
+    return await add_dynamic_metadata(rid, await cached_set_metadata(rid))
+
+
+async def get_metadata_many(chain_id: str, token_ids: list[str]):
+    """
+    Same as get_metadata for many sets, with whatever isn't cached fetched from storage concurrently.
+    Returns (token_id, metadata) pairs, sets without metadata are left out.
+    """
+    rids = [SetRID(chain_id=chain_id, token_id=token_id) for token_id in token_ids]
+    datas = [cached_set_metadata.peek(rid) for rid in rids]
+    missing = [i for i, data in enumerate(datas) if data is None]
+    if missing:
+        for i, data in zip(missing, await file_storage.aload_set_metadata_many(chain_id, [token_ids[i] for i in missing])):
+            if data is not None:
+                cached_set_metadata.prime(data, rids[i])
+            datas[i] = data
+    found = [(token_id, data) for token_id, data in zip(token_ids, datas) if data is not None]
+    metadatas = await asyncio.gather(*[
+        add_dynamic_metadata(SetRID(chain_id=chain_id, token_id=token_id), data) for token_id, data in found
+    ])
+    return [(token_id, metadata) for (token_id, _), metadata in zip(found, metadatas)]
+
+
+async def add_dynamic_metadata(rid: SetRID, data: dict):
+    """Completes the stored metadata with attributes coming from the chain."""
     data['created_at'] = await mongo_storage.get_mint_date(rid.chain_id, 'set', int(rid.token_id, 16))
     data['attributes'] = [{
         "trait_type": "Number of briqs",
@@ -76,8 +109,9 @@ async def get_metadata(rid: SetRID):
     else:
         booklets = await mongo_storage.get_user_nfts(rid.chain_id, rid.token_id, 'booklet')
         if len(booklets.nfts):
-            data['booklet_id'] = get_booklet_id_from_token_id(rid.chain_id, booklets.nfts[0])
-            booklet_meta = get_booklet_metadata(BoxRID(rid.chain_id, data['booklet_id'].split("/")[0], data['booklet_id'].split("/")[1]))
+            data['booklet_id'] = await get_booklet_id_from_token_id(rid.chain_id, booklets.nfts[0])
+            theme_id, box_id = data['booklet_id'].split("/")[:2]
+            booklet_meta = await get_booklet_metadata(BoxRID(rid.chain_id, theme_id, box_id))
             data['attributes'] += booklet_meta['attributes']
             for prop in booklet_meta['properties']:
                 if not (prop in data['properties']):
@@ -85,77 +119,85 @@ async def get_metadata(rid: SetRID):
     return data
 
 
-def get_preview(rid: SetRID):
+async def get_preview_stream(rid: SetRID, start: int = 0, end: Optional[int] = None) -> FileStream:
+    return await file_storage.aopen_set_preview_stream(rid, start, end)
+
+
+async def get_preview_info(rid: SetRID) -> FileInfo:
+    return await file_storage.aget_set_preview_info(rid)
+
+
+async def get_preview(rid: SetRID):
     try:
-        return file_storage.load_set_preview(rid)
+        return await file_storage.aload_set_preview(rid)
     except Exception:
         pass
     # Try to generate a default image, and if that fails store something anyways to avoid DOS.
     try:
-        data = file_storage.load_set_metadata(rid)
-        image_data_stream = io.BytesIO()
-        BriqData().load(data).to_png().save(image_data_stream, format='PNG')
-        image_data = image_data_stream.getvalue()
-        file_storage.store_set_preview(rid, image_data)
+        data = await file_storage.aload_set_metadata(rid)
+        image_data = await model_executor.run(f"preview_{rid.chain_id}_{rid.token_id}", render_preview, data)
+        await file_storage.astore_set_preview(rid, image_data)
         return image_data
+    except QueueFullException:
+        # Not the set's fault, don't store the default image.
+        raise
     except Exception:
         image_data = open(pathlib.Path(__file__).parent.resolve() / "No_Preview_image_2.png", 'rb').read()
-        file_storage.store_set_preview(rid, image_data)
+        await file_storage.astore_set_preview(rid, image_data)
         return image_data
 
 
-in_mem_thumbnails: dict[str, bytes] = {}
+# Kept as FileData, so that their ETag isn't computed on every request.
+in_mem_thumbnails = shared_memory_cache.namespace('set_small_previews', max_bytes=64 * 1024 * 1024, shared=True)
 
 
-def get_small_preview(rid: SetRID):
-    global in_mem_thumbnails
-    if f'{rid.chain_id}_{rid.token_id}' in in_mem_thumbnails:
-        return in_mem_thumbnails[f'{rid.chain_id}_{rid.token_id}']
+async def get_small_preview(rid: SetRID) -> FileData:
+    thumbnail = in_mem_thumbnails.get(f'{rid.chain_id}_{rid.token_id}')
+    if thumbnail is not None:
+        return thumbnail
     try:
-        image = file_storage.load_set_preview(rid)
-        # Load the image
-        loaded_image = Image.open(io.BytesIO(image))
-        # Resize the image
-        resized_image = loaded_image.resize((375, 375)).convert('RGB')
-        # Save as JPG byte stream
-        image_data_stream = io.BytesIO()
-        resized_image.save(image_data_stream, format='jpeg', quality=80)
-        image_data = image_data_stream.getvalue()
+        try:
+            # Rendered ahead of time for sets that went through the set indexer's render queue.
+            image_data = await file_storage.aload_set_small_preview(rid)
+        except Exception:
+            image_data = render_small_preview(await file_storage.aload_set_preview(rid))
         # Save in memory
-        in_mem_thumbnails[f'{rid.chain_id}_{rid.token_id}'] = image_data
-        return image_data
+        thumbnail = in_mem_thumbnails[f'{rid.chain_id}_{rid.token_id}'] = FileData.of(image_data)
+        return thumbnail
     except Exception as e:
         logger.error(e)
         pass
     # Return default image, don't store anything.
     image_data = open(pathlib.Path(__file__).parent.resolve() / "No_Preview_image_2.png", 'rb').read()
-    return image_data
+    return FileData.of(image_data)
 
 
-def get_model(rid: SetRID, kind: str) -> bytes:
-    return file_storage.load_set_model(rid, kind)
+async def get_model(rid: SetRID, kind: str) -> bytes:
+    return await file_storage.aload_set_model(rid, kind)
 
 
-def create_model(metadata: dict, kind: str) -> bytes:
-    briqData = BriqData().load(metadata)
-    if kind == "glb" or kind == "gltf":
-        return b''.join(briqData.to_gltf().save_to_bytes())
-    elif kind == "vox":
-        return briqData.to_vox("").to_bytes()
-    else:
-        raise Exception("Unknown model type " + kind)
+async def get_model_stream(rid: SetRID, kind: str, start: int = 0, end: Optional[int] = None) -> FileStream:
+    return await file_storage.aopen_set_model_stream(rid, kind, start, end)
+
+
+async def get_model_info(rid: SetRID, kind: str) -> FileInfo:
+    return await file_storage.aget_set_model_info(rid, kind)
 
 
-def store_model(rid: SetRID, kind: str, model_data: bytes):
+async def create_model(rid: SetRID, metadata: dict, kind: str) -> bytes:
+    return await model_executor.run(f"model_{rid.chain_id}_{rid.token_id}_{kind}", render_model, metadata, kind)
+
+
+async def store_model(rid: SetRID, kind: str, model_data: bytes):
     if kind == "glb" or kind == "gltf":
-        file_storage.store_set_model(rid, "glb", model_data)
-    elif kind == "vox":
-        file_storage.store_set_model(rid, "vox", model_data)
+        await file_storage.astore_set_model(rid, "glb", model_data)
+    elif kind == "vox" or kind in LOD_MODEL_KINDS:
+        await file_storage.astore_set_model(rid, kind, model_data)
     else:
         raise Exception("Unknown model type " + kind)
 
 
-def store_preview_image(rid: SetRID, image_base64: bytes):
+async def store_preview_image(rid: SetRID, image_base64: bytes):
     HEADER = b'data:image/png;base64,'
     if image_base64[0:len(HEADER)] != HEADER:
         raise Exception("Only base-64 encoded PNGs are accepted.")
@@ -168,7 +210,7 @@ def store_preview_image(rid: SetRID, image_base64: bytes):
     if image.width > 2000 or image.height > 2000 or image.width < 10 or image.height < 10:
         raise Exception("Image is too large, acceptable size range from 10x10 to 2000x2000")
 
-    file_storage.store_set_preview(rid, png_data)
+    await file_storage.astore_set_preview(rid, png_data)
 
 
 async def store_set(rid: SetRID, setData: dict, image_base64: bytes):
@@ -176,11 +218,19 @@ async def store_set(rid: SetRID, setData: dict, image_base64: bytes):
     # This can happen if a first mint fails for some reason but the 'hint' went through,
     # or if a set happens to have the same token ID as an earlier one.
     # This is intended to prevent hostile replacement of data.
-    if file_storage.has_set_metadata(rid):
+    if await file_storage.ahas_set_metadata(rid):
         return
     if len(image_base64) > 0:
-        store_preview_image(rid, image_base64)
-    file_storage.store_set_metadata(rid, setData)
+        await store_preview_image(rid, image_base64)
+    else:
+        # Clients may leave the preview to us rather than uploading it.
+        try:
+            image_data = await model_executor.run(f"preview_{rid.chain_id}_{rid.token_id}", render_preview, setData)
+            await file_storage.astore_set_preview(rid, image_data)
+        except Exception as e:
+            # get_preview will try again on demand.
+            logger.warning("Could not render preview for %(rid)s", {"rid": rid.json()}, exc_info=e)
+    await file_storage.astore_set_metadata(rid, setData)
 
 
 async def get_user_bids(chain_id: str, user_id: str):
@@ -236,7 +286,7 @@ async def get_item_activity(item_type: str, chain_id: str, item: str):
             async for item in data
         ]
     if item_type == 'booklet':
-        token_id = int(get_booklet_token_id_from_id(chain_id, item), 16)
+        token_id = int(await get_booklet_token_id_from_id(chain_id, item), 16)
         data = mongo_storage.get_backend(chain_id).async_db["booklet_transfers"].find({"token_id": token_id.to_bytes(32, "big")})
         return [
             {
@@ -10,7 +10,7 @@ logger = logging.getLogger(__name__)
 
 async def get_theme_auction_data(chain_id: str, theme_id: str):
     if theme_id == 'ducks_everywhere':
-        ducks_data = get_auction_json_data(chain_id, theme_id)
+        ducks_data = await get_auction_json_data(chain_id, theme_id)
         bid_data = mongo_storage.get_backend(chain_id).async_db['highest_bids_ducks'].find({
             "_chain.valid_to": None,
         })
@@ -1,11 +1,13 @@
 from dataclasses import dataclass
 from itertools import chain
 import logging
+from typing import Optional
 from briq_api.api.theme import get_booklet_token_id_from_id
 from briq_api.config import ENV
-from briq_api.storage.file.backends.file_storage import FileStorage
+from briq_api.memory_cache import CacheNamespace, shared_memory_cache
 import time
 
+from briq_api.storage.file.file_client import FileData
 from briq_api.storage.multi_backend_client import StorageClient
 from briq_api.stores import genesis_storage, file_storage
 from briq_api.indexer.storage import mongo_storage
@@ -20,128 +22,170 @@ class BoxRID:
     box_id: str
 
 
-def memory_cache(cache_path):
+def memory_cache(cache_path, cache: str = 'cache'):
     def wrapper2(f):
-        def wrapper(self, *args, **kwargs):
+        async def wrapper(self, *args, **kwargs):
             c_p = cache_path(*args)
+            _cache = getattr(self, cache)
             try:
-                return self.cache[c_p]
+                return _cache[c_p]
             except Exception:
-                data = f(self, *args, **kwargs)
-                self.cache[c_p] = data
+                data = await f(self, *args, **kwargs)
+                _cache[c_p] = data
                 return data
         return wrapper
     return wrapper2
 
 
+def metadata_box_cache_key(rid: BoxRID):
+    return f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}_metadata_box'
+
+
 class BoxStorage:
     storage: StorageClient
-    cache: FileStorage
+    cache: CacheNamespace
+    file_cache: CacheNamespace
     PREFIX = "genesis_themes"
 
     def __init__(self, storage: StorageClient) -> None:
         self.storage = storage
-        self.cache = {}
+        self.cache = shared_memory_cache.namespace('box_storage', shared=True)
+        # Textures and GLBs can be hefty, so they get their own quota within the shared budget.
+        # They are kept as FileData, so that their ETag isn't computed on every request.
+        self.file_cache = shared_memory_cache.namespace('box_files', max_bytes=256 * 1024 * 1024, shared=True)
 
     def box_path(self, rid: BoxRID):
         return f"{BoxStorage.PREFIX}/{rid.theme_id}/{rid.box_id}"
 
-    @memory_cache(lambda args: f'{args.chain_id}_{args.theme_id}_{args.box_id}_metadata_box')
-    def load_metadata_box(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_json(f"{self.box_path(rid)}/metadata_box.json")
+    @memory_cache(metadata_box_cache_key)
+    async def load_metadata_box(self, rid: BoxRID):
+        return await self.storage.get_backend(rid.chain_id).aload_json(f"{self.box_path(rid)}/metadata_box.json")
+
+    async def load_metadata_boxes(self, chain_id: str, rids: list[BoxRID]):
+        """
+        Batch version of load_metadata_box, fetching whatever isn't cached in one go.
+        Returns None for the boxes that have no metadata.
+        """
+        out = [self.cache.get(metadata_box_cache_key(rid)) for rid in rids]
+        missing = [i for i, data in enumerate(out) if data is None]
+        if missing:
+            paths = [f"{self.box_path(rids[i])}/metadata_box.json" for i in missing]
+            for i, data in zip(missing, await self.storage.get_backend(chain_id).aload_json_many(paths)):
+                if data is not None:
+                    self.cache[metadata_box_cache_key(rids[i])] = data
+                out[i] = data
+        return out
 
     @memory_cache(lambda args: f'{args.chain_id}_{args.theme_id}_{args.box_id}_metadata_booklet')
-    def load_metadata_booklet(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_json(f"{self.box_path(rid)}/metadata_booklet.json")
+    async def load_metadata_booklet(self, rid: BoxRID):
+        return await self.storage.get_backend(rid.chain_id).aload_json(f"{self.box_path(rid)}/metadata_booklet.json")
+
+    async def _load_file(self, chain_id: str, path: str) -> FileData:
+        return FileData.of(await self.storage.get_backend(chain_id).aload_bytes(path))
+
+    @memory_cache(lambda rid, file: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}_file_{file}', cache='file_cache')
+    async def load_box_file(self, rid: BoxRID, file: str):
+        return await self._load_file(rid.chain_id, f"{self.box_path(rid)}/{file}")
 
-    def step_image_path(self, rid: BoxRID, step: int):
-        return f"{self.box_path(rid)}/step_{step}.png"
+    async def box_file_info(self, rid: BoxRID, file: str):
+        return await self.storage.get_backend(rid.chain_id).aget_info(f"{self.box_path(rid)}/{file}")
 
-    @memory_cache(lambda rid, file: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}_file_{file}')
-    def load_box_file(self, rid: BoxRID, file: str):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/{file}")
+    async def load_step_image(self, rid: BoxRID, step: int):
+        return await self.load_box_file(rid, f"step_{step}.png")
 
-    def load_step_image(self, rid: BoxRID, step: int):
-        return self.storage.get_backend(rid.chain_id).load_bytes(self.step_image_path(rid, step))
+    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}_cover.png', cache='file_cache')
+    async def load_cover_item(self, rid: BoxRID):
+        return await self._load_file(rid.chain_id, f"{self.box_path(rid)}/cover.png")
 
-    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}_cover.png')
-    def load_cover_item(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/cover.png")
+    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}_cover.jpg', cache='file_cache')
+    async def load_cover_item_jpg(self, rid: BoxRID):
+        return await self._load_file(rid.chain_id, f"{self.box_path(rid)}/cover.jpg")
 
-    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}_cover.jpg')
-    def load_cover_item_jpg(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/cover.jpg")
+    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}booklet_cover.png', cache='file_cache')
+    async def load_cover_booklet(self, rid: BoxRID):
+        return await self._load_file(rid.chain_id, f"{self.box_path(rid)}/booklet_cover.png")
 
-    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}booklet_cover.png')
-    def load_cover_booklet(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/booklet_cover.png")
+    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}booklet_cover.jpg', cache='file_cache')
+    async def load_cover_booklet_jpg(self, rid: BoxRID):
+        return await self._load_file(rid.chain_id, f"{self.box_path(rid)}/booklet_cover.jpg")
 
-    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}booklet_cover.jpg')
-    def load_cover_booklet_jpg(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/booklet_cover.jpg")
+    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}box_cover.png', cache='file_cache')
+    async def load_cover_box(self, rid: BoxRID):
+        return await self._load_file(rid.chain_id, f"{self.box_path(rid)}/box_cover.png")
 
-    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}box_cover.png')
-    def load_cover_box(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/box_cover.png")
+    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}box_cover.jpg', cache='file_cache')
+    async def load_cover_box_jpg(self, rid: BoxRID):
+        return await self._load_file(rid.chain_id, f"{self.box_path(rid)}/box_cover.jpg")
 
-    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}box_cover.jpg')
-    def load_cover_box_jpg(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/box_cover.jpg")
+    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}box_tex.png', cache='file_cache')
+    async def load_box_texture(self, rid: BoxRID):
+        return await self._load_file(rid.chain_id, f"{self.box_path(rid)}/box_tex.png")
 
-    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}box_tex.png')
-    def load_box_texture(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/box_tex.png")
+    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}booklet_cover_tex.png', cache='file_cache')
+    async def load_booklet_texture(self, rid: BoxRID):
+        return await self._load_file(rid.chain_id, f"{self.box_path(rid)}/booklet_cover_tex.png")
 
-    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}booklet_cover_tex.png')
-    def load_booklet_texture(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/booklet_cover_tex.png")
+    async def open_booklet_pdf_stream(self, rid: BoxRID, start: int = 0, end: Optional[int] = None):
+        # PDFs are too large to be worth keeping in memory, they get streamed instead.
+        return await self.storage.get_backend(rid.chain_id).aopen_stream(f"{self.box_path(rid)}/booklet.pdf", start=start, end=end)
 
-    @memory_cache(lambda rid: f'{rid.chain_id}_{rid.theme_id}_{rid.box_id}_booklet.pdf')
-    def load_booklet_pdf(self, rid: BoxRID):
-        return self.storage.get_backend(rid.chain_id).load_bytes(f"{self.box_path(rid)}/booklet.pdf")
+    async def booklet_pdf_info(self, rid: BoxRID):
+        return await self.storage.get_backend(rid.chain_id).aget_info(f"{self.box_path(rid)}/booklet.pdf")
 
     # Themes
 
-    def list_themes(self, chain_id: str):
-        return self.storage.get_backend(chain_id).list_paths(f"{BoxStorage.PREFIX}/")
+    async def list_themes(self, chain_id: str):
+        return await self.storage.get_backend(chain_id).alist_paths(f"{BoxStorage.PREFIX}/")
 
-    def list_boxes_of_theme(self, chain_id: str, theme_id: str):
-        return [x for x in self.storage.get_backend(chain_id).list_paths(f"{BoxStorage.PREFIX}/{theme_id}/") if not ('.' in x)]
+    async def list_boxes_of_theme(self, chain_id: str, theme_id: str):
+        return [x for x in await self.storage.get_backend(chain_id).alist_paths(f"{BoxStorage.PREFIX}/{theme_id}/") if not ('.' in x)]
 
-    def get_theme_data(self, chain_id: str, theme_id: str):
-        return self.storage.get_backend(chain_id).load_json(f"{BoxStorage.PREFIX}/{theme_id}/data.json")
+    async def get_theme_data(self, chain_id: str, theme_id: str):
+        return await self.storage.get_backend(chain_id).aload_json(f"{BoxStorage.PREFIX}/{theme_id}/data.json")
 
-    @memory_cache(lambda chain_id, theme_id, quality: f'{chain_id}_{theme_id}_{quality}_cover_prelaunch')
-    def theme_cover_prelaunch(self, chain_id: str, theme_id: str, quality: str):
+    async def theme_file_info(self, chain_id: str, theme_id: str, file: str):
+        return await self.storage.get_backend(chain_id).aget_info(f"{BoxStorage.PREFIX}/{theme_id}/{file}")
+
+    @memory_cache(lambda chain_id, theme_id, quality: f'{chain_id}_{theme_id}_{quality}_cover_prelaunch', cache='file_cache')
+    async def theme_cover_prelaunch(self, chain_id: str, theme_id: str, quality: str):
         if quality != 'high' and quality != 'low':
             raise Exception('Quality should be high or low')
-        return self.storage.get_backend(chain_id).load_bytes(f"{BoxStorage.PREFIX}/{theme_id}/cover_prelaunch_{quality}.jpg")
+        return await self._load_file(chain_id, f"{BoxStorage.PREFIX}/{theme_id}/cover_prelaunch_{quality}.jpg")
 
-    @memory_cache(lambda chain_id, theme_id, quality: f'{chain_id}_{theme_id}_{quality}_cover_postlaunch')
-    def theme_cover_postlaunch(self, chain_id: str, theme_id: str, quality: str):
+    @memory_cache(lambda chain_id, theme_id, quality: f'{chain_id}_{theme_id}_{quality}_cover_postlaunch', cache='file_cache')
+    async def theme_cover_postlaunch(self, chain_id: str, theme_id: str, quality: str):
         if quality != 'high' and quality != 'low':
             raise Exception('Quality should be high or low')
-        return self.storage.get_backend(chain_id).load_bytes(f"{BoxStorage.PREFIX}/{theme_id}/cover_postlaunch_{quality}.jpg")
+        return await self._load_file(chain_id, f"{BoxStorage.PREFIX}/{theme_id}/cover_postlaunch_{quality}.jpg")
 
-    @memory_cache(lambda chain_id, theme_id, quality: f'{chain_id}_{theme_id}_{quality}_logo')
-    def theme_logo(self, chain_id: str, theme_id: str, quality: str):
+    @memory_cache(lambda chain_id, theme_id, quality: f'{chain_id}_{theme_id}_{quality}_logo', cache='file_cache')
+    async def theme_logo(self, chain_id: str, theme_id: str, quality: str):
         if quality != 'high' and quality != 'low':
             raise Exception('Quality should be high or low')
         # TODO -> for now it's always high quality, too small a file to matter.
-        return self.storage.get_backend(chain_id).load_bytes(f"{BoxStorage.PREFIX}/{theme_id}/logo.png")
+        return await self._load_file(chain_id, f"{BoxStorage.PREFIX}/{theme_id}/logo.png")
 
-    @memory_cache(lambda chain_id, theme_id, quality: f'{chain_id}_{theme_id}_{quality}_splash.pdf')
-    def theme_splash(self, chain_id: str, theme_id: str, quality: str):
+    @memory_cache(lambda chain_id, theme_id, quality: f'{chain_id}_{theme_id}_{quality}_splash.pdf', cache='file_cache')
+    async def theme_splash(self, chain_id: str, theme_id: str, quality: str):
         if quality != 'high' and quality != 'low':
             raise Exception('Quality should be high or low')
-        return self.storage.get_backend(chain_id).load_bytes(f"{BoxStorage.PREFIX}/{theme_id}/splash_{quality}.jpg")
+        return await self._load_file(chain_id, f"{BoxStorage.PREFIX}/{theme_id}/splash_{quality}.jpg")
 
 
 box_storage = BoxStorage(file_storage)
 
 
-def get_box_metadata(rid: BoxRID):
-    metadata = box_storage.load_metadata_box(rid)
+async def get_box_metadata(rid: BoxRID):
+    return add_box_token_data(rid, await box_storage.load_metadata_box(rid))
+
+
+async def get_boxes_metadata(chain_id: str, rids: list[BoxRID]):
+    """Same as get_box_metadata for many boxes, boxes without metadata are left out."""
+    metadatas = await box_storage.load_metadata_boxes(chain_id, rids)
+    return [(rid, add_box_token_data(rid, metadata)) for rid, metadata in zip(rids, metadatas) if metadata is not None]
+
+
+def add_box_token_data(rid: BoxRID, metadata: dict):
     auction_data = genesis_storage.get_auction_static_data(rid.chain_id, f'{rid.theme_id}/{rid.box_id}')
     if auction_data is not None and auction_data['auction_start'] > time.time():
         raise FileNotFoundError
@@ -150,22 +194,22 @@ def get_box_metadata(rid: BoxRID):
     return metadata
 
 
-def get_booklet_metadata(rid: BoxRID):
-    metadata = box_storage.load_metadata_booklet(rid)
-    metadata['token_id'] = get_booklet_token_id_from_id(rid.chain_id, f'{rid.theme_id}/{rid.box_id}')
+async def get_booklet_metadata(rid: BoxRID):
+    metadata = await box_storage.load_metadata_booklet(rid)
+    metadata['token_id'] = await get_booklet_token_id_from_id(rid.chain_id, f'{rid.theme_id}/{rid.box_id}')
     # Parse the number because javascript can't
     metadata['serial_number'] = int(metadata['token_id'], 16) // 2**192
     return metadata
 
 
-def list_themes(chain_id: str):
+async def list_themes(chain_id: str):
     if ENV != 'dev':
         return ['starknet_planet', 'ducks_everywhere']
-    return box_storage.list_themes(chain_id)
+    return await box_storage.list_themes(chain_id)
 
 
-def list_boxes_of_theme(chain_id: str, theme_id: str):
-    potentials = [f"{theme_id}/{box}" for box in box_storage.list_boxes_of_theme(chain_id, theme_id)]
+async def list_boxes_of_theme(chain_id: str, theme_id: str):
+    potentials = [f"{theme_id}/{box}" for box in await box_storage.list_boxes_of_theme(chain_id, theme_id)]
     ret = []
     for box in potentials:
         auction_data = genesis_storage.get_auction_static_data(chain_id, f'{box}')
@@ -174,8 +218,8 @@ def list_boxes_of_theme(chain_id: str, theme_id: str):
     return ret
 
 
-def get_theme_data(chain_id: str, theme_id: str):
-    data = box_storage.get_theme_data(chain_id, theme_id)
+async def get_theme_data(chain_id: str, theme_id: str):
+    data = await box_storage.get_theme_data(chain_id, theme_id)
     return data
 
 
@@ -198,48 +242,58 @@ async def get_box_saledata(rid: BoxRID):
     return auction_data
 
 
-def get_booklet_pdf(rid: BoxRID):
-    return box_storage.load_booklet_pdf(rid)
+async def get_booklet_pdf_stream(rid: BoxRID, start: int = 0, end: Optional[int] = None):
+    return await box_storage.open_booklet_pdf_stream(rid, start, end)
+
+
+async def get_booklet_pdf_info(rid: BoxRID):
+    return await box_storage.booklet_pdf_info(rid)
+
+
+async def get_box_step_image(rid: BoxRID, step: int):
+    return await box_storage.load_step_image(rid, step)
+
+
+async def get_box_cover_item(rid: BoxRID):
+    return await box_storage.load_cover_item(rid)
 
 
-def get_box_step_image(rid: BoxRID, step: int):
-    return box_storage.load_step_image(rid, step)
+async def get_box_cover_item_jpg(rid: BoxRID):
+    return await box_storage.load_cover_item_jpg(rid)
 
 
-def get_box_cover_item(rid: BoxRID):
-    return box_storage.load_cover_item(rid)
+async def get_box_cover_booklet(rid: BoxRID):
+    return await box_storage.load_cover_booklet(rid)
 
 
-def get_box_cover_item_jpg(rid: BoxRID):
-    return box_storage.load_cover_item_jpg(rid)
+async def get_box_cover_booklet_jpg(rid: BoxRID):
+    return await box_storage.load_cover_booklet_jpg(rid)
 
 
-def get_box_cover_booklet(rid: BoxRID):
-    return box_storage.load_cover_booklet(rid)
+async def get_box_cover_box(rid: BoxRID):
+    return await box_storage.load_cover_box(rid)
 
 
-def get_box_cover_booklet_jpg(rid: BoxRID):
-    return box_storage.load_cover_booklet_jpg(rid)
+async def get_box_cover_box_jpg(rid: BoxRID):
+    return await box_storage.load_cover_box_jpg(rid)
 
 
-def get_box_cover_box(rid: BoxRID):
-    return box_storage.load_cover_box(rid)
+async def get_box_texture(rid: BoxRID):
+    return await box_storage.load_box_texture(rid)
 
 
-def get_box_cover_box_jpg(rid: BoxRID):
-    return box_storage.load_cover_box_jpg(rid)
+async def get_booklet_texture(rid: BoxRID):
+    return await box_storage.load_booklet_texture(rid)
 
 
-def get_box_texture(rid: BoxRID):
-    return box_storage.load_box_texture(rid)
+async def get_box_file(rid: BoxRID, file: str):
+    return await box_storage.load_box_file(rid, file)
 
 
-def get_booklet_texture(rid: BoxRID):
-    return box_storage.load_booklet_texture(rid)
+async def get_box_file_info(rid: BoxRID, file: str):
+    """Size and ETag of a file of the box, e.g. to answer HEAD requests without loading it."""
+    return await box_storage.box_file_info(rid, file)
 
 
-def get_booklet_step_glb(rid: BoxRID, step: int):
-    return [
-        box_storage.load_box_file(rid, f'step_{step}.glb'),
-        box_storage.load_box_file(rid, f'step_level_{step}.glb')
-    ]
+async def get_theme_file_info(chain_id: str, theme_id: str, file: str):
+    return await box_storage.theme_file_info(chain_id, theme_id, file)
@@ -25,7 +25,7 @@ app = APIRouter()
 @app.get("/store_get/{token_id}")
 async def store_get(token_id: str):
     try:
-        data = file_storage.load_set_metadata(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id))
+        data = await file_storage.aload_set_metadata(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id))
     except FileNotFoundError:
         raise HTTPException(status_code=500, detail="File not found")
     except Exception as e:
@@ -56,7 +56,7 @@ async def store_get(token_id: str):
 @app.get("/preview/{token_id}.png")
 async def get_preview(token_id: str):
     try:
-        data = file_storage.load_set_preview(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id))
+        data = await file_storage.aload_set_preview(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id))
         return StreamingResponse(io.BytesIO(data), media_type="image/png", headers={
             "Cache-Control": f"public,max-age={3600 * 24}"
         })
@@ -72,24 +72,23 @@ async def get_model(kind: str, token_id: str):
         "vox": "application/octet-stream",
     }
     try:
-        data = file_storage.load_set_model(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id), kind=kind)
+        data = await file_storage.aload_set_model(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id), kind=kind)
         return StreamingResponse(io.BytesIO(data), media_type=mime_type[kind], headers={
             "Cache-Control": f"public,max-age={3600 * 24}"
         })
     except (NotFoundException, OSError):
         try:
-            data = file_storage.load_set_metadata(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id))
+            data = await file_storage.aload_set_metadata(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id))
             briqData = BriqData().load(data)
             output = None
             if kind == "glb":
                 # Run this in a separate process, it can take a while and we need to not block.
-                data = await to_process.run_sync(briqData.to_gltf)
-                output = b''.join(data.save_to_bytes())
-                file_storage.store_set_model(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id), kind='glb', data=output)
+                output = await to_process.run_sync(briqData.to_glb)
+                await file_storage.astore_set_model(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id), kind='glb', data=output)
             elif kind == "vox":
                 data = await to_process.run_sync(briqData.to_vox, token_id)
                 output = data.to_bytes()
-                file_storage.store_set_model(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id), kind='vox', data=output)
+                await file_storage.astore_set_model(rid=SetRID(chain_id=TESTNET_LEGACY.id, token_id=token_id), kind='vox', data=output)
             else:
                 raise Exception("Unknown model type " + kind)
             logger.info("Created %(type)s model for %(set)s on the fly.", {"type": kind, "set": token_id})
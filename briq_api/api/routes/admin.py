@@ -5,6 +5,7 @@ import os
 import re
 import tempfile
 import concurrent.futures
+import itertools
 import asyncio
 from dataclasses import dataclass
 from datetime import datetime
@@ -12,14 +13,18 @@ from fastapi import APIRouter, HTTPException
 from pathlib import Path
 from PIL import Image
 from pydantic import BaseModel
-from typing import Any, List, Optional, Tuple
+from typing import Any, Optional, Tuple
 
 from briq_api.api.theme import list_booklets_of_theme
 from briq_api.chain.networks import get_gateway_client, get_network_metadata
 from briq_api.set_identifier import SetRID
 from briq_api.set_indexer.create_set_metadata import create_booklet_metadata, create_set_metadata
 from briq_api.stores import file_storage, theme_storage
+from briq_api.api.api import cached_set_metadata
 from briq_api.mesh.briq import BriqData
+from briq_api.config import MODEL_WORKERS
+from briq_api.mesh.layers import split_levels
+from briq_api.model_executor import model_executor, render_layered_glbs, render_levels
 
 from starknet_py.contract import Contract
 from starknet_py.utils.typed_data import TypedData
@@ -96,14 +101,18 @@ async def mint_new_nft(set: NewNFTRequest, chain_id: str, auction_theme: str):
     data = await generate_data(set, chain_id, auction_theme)
     serial, booklet_metadata, metadata = data.serial, data.booklet_metadata, data.metadata
 
+    PATH = f"genesis_themes/{auction_theme}/{set.data['name']}"
+    # Render the steps before storing anything: if the model executor is busy, the mint can just be retried.
+    step_glbs, level_glbs = await generate_layered_glb(f"{chain_id}_{PATH}", BriqData().load(metadata))
+
     # This doesn't reuse the API function because it skips the validation.
     rid = SetRID(chain_id=chain_id, token_id=set.token_id)
-    file_storage.store_set_metadata(rid, metadata)
+    await file_storage.astore_set_metadata(rid, metadata)
+    cached_set_metadata.invalidate(rid)
 
-    PATH = f"genesis_themes/{auction_theme}/{set.data['name']}"
-    file_storage.get_backend(chain_id).store_json(PATH + "/metadata_booklet.json", booklet_metadata)
-    file_storage.get_backend(chain_id).store_bytes(PATH + "/cover.png", decode_base64(set.preview_base64))
-    file_storage.get_backend(chain_id).store_bytes(PATH + "/booklet_cover.png", decode_base64(set.booklet_base64))
+    await file_storage.get_backend(chain_id).astore_json(PATH + "/metadata_booklet.json", booklet_metadata)
+    await file_storage.get_backend(chain_id).astore_bytes(PATH + "/cover.png", decode_base64(set.preview_base64))
+    await file_storage.get_backend(chain_id).astore_bytes(PATH + "/booklet_cover.png", decode_base64(set.booklet_base64))
 
     # No existence check for those, subsumed by the HQ ones.
     image = Image.open(io.BytesIO(decode_base64(set.preview_base64)))
@@ -117,8 +126,8 @@ async def mint_new_nft(set: NewNFTRequest, chain_id: str, auction_theme: str):
     output = io.BytesIO()
     bg.convert('RGB').save(output, format='JPEG', quality=60)
     preview_bytes = output.getvalue()
-    file_storage.get_backend(chain_id).store_bytes(PATH + "/cover.jpg", preview_bytes)
-    file_storage.store_set_preview(rid, preview_bytes)
+    await file_storage.get_backend(chain_id).astore_bytes(PATH + "/cover.jpg", preview_bytes)
+    await file_storage.astore_set_preview(rid, preview_bytes)
 
     image = Image.open(io.BytesIO(decode_base64(set.booklet_base64)))
     # If there is a background color, presumably the image is not transparent,
@@ -130,35 +139,25 @@ async def mint_new_nft(set: NewNFTRequest, chain_id: str, auction_theme: str):
         bg.paste(image)
     output = io.BytesIO()
     bg.convert('RGB').save(output, format='JPEG', quality=50)
-    file_storage.get_backend(chain_id).store_bytes(PATH + "/booklet_cover.jpg", output.getvalue())
-
-    data = BriqData()
-    data.load(metadata)
-    briq_by_level, current_briqs = generate_layered_glb(data)
+    await file_storage.get_backend(chain_id).astore_bytes(PATH + "/booklet_cover.jpg", output.getvalue())
 
-    i = 0
-    for lev in briq_by_level:
-        data.briqs = lev
-        file_storage.get_backend(chain_id).store_bytes(f"{PATH}/step_{i}.glb", b''.join(data.to_gltf(separate_any_color=True).save_to_bytes()))
-        i += 1
+    for i, glb in enumerate(step_glbs):
+        await file_storage.get_backend(chain_id).astore_bytes(f"{PATH}/step_{i}.glb", glb)
 
-    i = 0
-    for lev in current_briqs:
-        data.briqs = lev
-        file_storage.get_backend(chain_id).store_bytes(f"{PATH}/step_level_{i}.glb", b''.join(data.to_gltf(separate_any_color=True).save_to_bytes()))
-        i += 1
+    for i, glb in enumerate(level_glbs):
+        await file_storage.get_backend(chain_id).astore_bytes(f"{PATH}/step_level_{i}.glb", glb)
 
     # Update booklet spec
-    booklet_spec = theme_storage.get_booklet_spec(chain_id)
+    booklet_spec = await theme_storage.aload_booklet_spec(chain_id)
     # Backup the file
-    theme_storage.get_backend(chain_id).backup_file(theme_storage.booklet_path())
+    await theme_storage.get_backend(chain_id).abackup_file(theme_storage.booklet_path())
 
     duck_collection_id = 3
     booklet_spec[f"{auction_theme}/{set.data['name']}"] = hex(duck_collection_id + 2**192 * serial)
     # TODO check properly serial
-    theme_storage.get_backend(chain_id).store_json(theme_storage.booklet_path(), booklet_spec)
+    await theme_storage.get_backend(chain_id).astore_json(theme_storage.booklet_path(), booklet_spec)
     # Reset the cache, otherwise for some time the old file keeps being used (it's cached)
-    # NB -> if there are several instances of the API, this won't clear all of them.
+    # NB -> this only reaches other instances of the API if the cache invalidation bus is configured.
     theme_storage.reset_cache()
 
 
@@ -280,9 +279,9 @@ async def generate_data(set: NewNFTRequest, chain_id: str, auction_theme: str):
 
     data = BriqData()
     data.load(metadata)
-    briq_by_level, current_briqs = generate_layered_glb(data)
+    step_sizes = list(itertools.accumulate(len(level.added) for level in split_levels(data)))
 
-    booklets = list_booklets_of_theme(chain_id, auction_theme)
+    booklets = await list_booklets_of_theme(chain_id, auction_theme)
 
     booklet_metadata = create_booklet_metadata(
         theme_id=auction_theme,
@@ -294,13 +293,13 @@ async def generate_data(set: NewNFTRequest, chain_id: str, auction_theme: str):
         description=set.data["description"],
         network=chain_id,
         briqs=set.data["briqs"],
-        nb_steps=len(briq_by_level),
-        step_progress_data=[len(level) for level in briq_by_level],
+        nb_steps=len(step_sizes),
+        step_progress_data=step_sizes,
     )
 
     serial = len(booklets) + 1
 
-    run_validation(set, chain_id, auction_theme)
+    await run_validation(set, chain_id, auction_theme)
 
     @dataclass
     class Output:
@@ -311,21 +310,21 @@ async def generate_data(set: NewNFTRequest, chain_id: str, auction_theme: str):
     return Output(metadata=metadata, booklet_metadata=booklet_metadata, serial=serial)
 
 
-def run_validation(set: NewNFTRequest, chain_id: str, auction_theme: str):
+async def run_validation(set: NewNFTRequest, chain_id: str, auction_theme: str):
     # TODO move to validate
-    booklet_spec = theme_storage.get_booklet_spec(chain_id)
+    booklet_spec = await theme_storage.aload_booklet_spec(chain_id)
     if f"{auction_theme}/{set.data['name']}" in booklet_spec:
         raise HTTPException(status_code=400, detail="Booklet already exists")
 
-    if file_storage.get_backend(chain_id).has_path(f"sets/{chain_id}/{set.token_id}_metadata.json"):
+    if await file_storage.get_backend(chain_id).ahas_path(f"sets/{chain_id}/{set.token_id}_metadata.json"):
         raise HTTPException(status_code=400, detail="Set JSON already exists")
 
     PATH = f"genesis_themes/{auction_theme}/{set.data['name']}"
-    if file_storage.get_backend(chain_id).has_path(PATH + "/metadata_booklet.json"):
+    if await file_storage.get_backend(chain_id).ahas_path(PATH + "/metadata_booklet.json"):
         raise HTTPException(status_code=400, detail="Booklet already exists")
-    if file_storage.get_backend(chain_id).has_path(PATH + "/cover.png"):
+    if await file_storage.get_backend(chain_id).ahas_path(PATH + "/cover.png"):
         raise HTTPException(status_code=400, detail="Cover already exists")
-    if file_storage.get_backend(chain_id).has_path(PATH + "/booklet_cover.png"):
+    if await file_storage.get_backend(chain_id).ahas_path(PATH + "/booklet_cover.png"):
         raise HTTPException(status_code=400, detail="Booklet cover already exists")
 
 
@@ -381,26 +380,14 @@ def decode_base64(image_base64: bytes):
     return png_data
 
 
-# Print a layer-by-layer set of GLB files.
-def generate_layered_glb(data: BriqData):
-    total_briqs = data.briqs
-
-    briq_by_level: List[List[dict[str, Any]]] = []
-    current_briqs: List[List[dict[str, Any]]] = []
-    i = 0
-    while True:
-        briq_by_level.append([])
-        current_briqs.append([])
-        found = False
-        for briq in total_briqs:
-            if briq['pos'][1] == i:
-                found = True
-                current_briqs[-1].append(briq)
-            if briq['pos'][1] <= i:
-                briq_by_level[-1].append(briq)
-        i += 1
-        if not found:
-            briq_by_level.pop()
-            break
-
-    return briq_by_level, current_briqs
+# Print a layer-by-layer set of GLB files: the steps, and each level on its own.
+async def generate_layered_glb(key: str, data: BriqData):
+    levels = split_levels(data)
+    # Levels are meshed in parallel, one batch per process.
+    batch_size = max(1, -(-len(levels) // MODEL_WORKERS))
+    batches = await asyncio.gather(*[
+        model_executor.run(f"levels_{key}_{start}", render_levels, levels[start:start + batch_size])
+        for start in range(0, len(levels), batch_size)
+    ])
+    meshes = [mesh for batch in batches for mesh in batch]
+    return await model_executor.run(f"layers_{key}", render_layered_glbs, meshes)
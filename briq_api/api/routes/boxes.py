@@ -1,13 +1,12 @@
-import io
 import logging
 
-from starlette.responses import JSONResponse, StreamingResponse
-from fastapi import APIRouter
+from starlette.responses import JSONResponse
+from fastapi import APIRouter, Request
 
 from .. import boxes
 from ..boxes import BoxRID
 
-from .common import ExceptionWrapperRoute
+from .common import ExceptionWrapperRoute, bytes_response, info_head_response, stream_response
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +19,7 @@ router = APIRouter(route_class=ExceptionWrapperRoute(logger))
 @router.get("/booklet/data/{chain_id}/{theme_id}/{booklet_id}.json")
 async def booklet_data(chain_id: str, theme_id: str, booklet_id: str):
     rid = BoxRID(chain_id, theme_id, booklet_id)
-    output = boxes.get_booklet_metadata(rid)
+    output = await boxes.get_booklet_metadata(rid)
     return JSONResponse(output, headers={
         "Cache-Control": f"public,max-age={3600}"
     })
@@ -28,132 +27,146 @@ async def booklet_data(chain_id: str, theme_id: str, booklet_id: str):
 
 @router.head("/booklet/pdf/{chain_id}/{theme_id}/{box_id}.pdf")
 @router.get("/booklet/pdf/{chain_id}/{theme_id}/{box_id}.pdf")
-async def booklet_pdf(chain_id: str, theme_id: str, box_id: str):
+async def booklet_pdf(request: Request, chain_id: str, theme_id: str, box_id: str):
     rid = BoxRID(chain_id, theme_id, box_id)
-    pdf = boxes.get_booklet_pdf(rid)
-    return StreamingResponse(io.BytesIO(pdf), media_type="application/pdf", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    return await stream_response(
+        request,
+        lambda start, end: boxes.get_booklet_pdf_stream(rid, start, end),
+        lambda: boxes.get_booklet_pdf_info(rid),
+        "application/pdf",
+        {"Cache-Control": f"public,max-age={3600 * 24}"}
+    )
 
 
 @router.head("/booklet/texture/{chain_id}/{theme_id}/{box_id}")
 @router.head("/booklet/texture/{chain_id}/{theme_id}/{box_id}.png")
 @router.get("/booklet/texture/{chain_id}/{theme_id}/{box_id}")
 @router.get("/booklet/texture/{chain_id}/{theme_id}/{box_id}.png")
-async def booklet_texture(chain_id: str, theme_id: str, box_id: str):
+async def booklet_texture(request: Request, chain_id: str, theme_id: str, box_id: str):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_booklet_texture(rid)
-    return StreamingResponse(io.BytesIO(image), media_type="image/png", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, "booklet_cover_tex.png"), "image/png", headers)
+    file = await boxes.get_booklet_texture(rid)
+    return bytes_response(request, file.data, "image/png", headers, file.etag)
 
 @router.head("/box/texture/{chain_id}/{theme_id}/{box_id}")
 @router.head("/box/texture/{chain_id}/{theme_id}/{box_id}.png")
 @router.get("/box/texture/{chain_id}/{theme_id}/{box_id}")
 @router.get("/box/texture/{chain_id}/{theme_id}/{box_id}.png")
-async def box_texture(chain_id: str, theme_id: str, box_id: str):
+async def box_texture(request: Request, chain_id: str, theme_id: str, box_id: str):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_box_texture(rid)
-    return StreamingResponse(io.BytesIO(image), media_type="image/png", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, "box_tex.png"), "image/png", headers)
+    file = await boxes.get_box_texture(rid)
+    return bytes_response(request, file.data, "image/png", headers, file.etag)
 
 
 @router.head("/box/cover_item/{chain_id}/{theme_id}/{box_id}.png")
 @router.get("/box/cover_item/{chain_id}/{theme_id}/{box_id}.png")
-async def box_cover_item(chain_id: str, theme_id: str, box_id: str):
+async def box_cover_item(request: Request, chain_id: str, theme_id: str, box_id: str):
     """Used as the preview of the NFT inside the box / when minting from the booklet"""
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_box_cover_item(rid)
-    return StreamingResponse(io.BytesIO(image), media_type="image/png", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, "cover.png"), "image/png", headers)
+    file = await boxes.get_box_cover_item(rid)
+    return bytes_response(request, file.data, "image/png", headers, file.etag)
 
 
 @router.head("/box/cover_item/{chain_id}/{theme_id}/{box_id}.jpg")
 @router.get("/box/cover_item/{chain_id}/{theme_id}/{box_id}.jpg")
-async def box_cover_item_jpg(chain_id: str, theme_id: str, box_id: str):
+async def box_cover_item_jpg(request: Request, chain_id: str, theme_id: str, box_id: str):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_box_cover_item_jpg(rid)
-    return StreamingResponse(io.BytesIO(image), media_type="image/jpeg", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, "cover.jpg"), "image/jpeg", headers)
+    file = await boxes.get_box_cover_item_jpg(rid)
+    return bytes_response(request, file.data, "image/jpeg", headers, file.etag)
 
 
 @router.head("/box/cover_box/{chain_id}/{theme_id}/{box_id}.png")
 @router.get("/box/cover_box/{chain_id}/{theme_id}/{box_id}.png")
-async def box_cover_box(chain_id: str, theme_id: str, box_id: str):
+async def box_cover_box(request: Request, chain_id: str, theme_id: str, box_id: str):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_box_cover_box(rid)
-    return StreamingResponse(io.BytesIO(image), media_type="image/png", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, "box_cover.png"), "image/png", headers)
+    file = await boxes.get_box_cover_box(rid)
+    return bytes_response(request, file.data, "image/png", headers, file.etag)
 
 
 @router.head("/box/cover_box/{chain_id}/{theme_id}/{box_id}.jpg")
 @router.get("/box/cover_box/{chain_id}/{theme_id}/{box_id}.jpg")
-async def box_cover_box_jpg(chain_id: str, theme_id: str, box_id: str):
+async def box_cover_box_jpg(request: Request, chain_id: str, theme_id: str, box_id: str):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_box_cover_box_jpg(rid)
-    return StreamingResponse(io.BytesIO(image), media_type="image/jpeg", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, "box_cover.jpg"), "image/jpeg", headers)
+    file = await boxes.get_box_cover_box_jpg(rid)
+    return bytes_response(request, file.data, "image/jpeg", headers, file.etag)
 
 
 @router.head("/box/cover_booklet/{chain_id}/{theme_id}/{box_id}.png")
 @router.get("/box/cover_booklet/{chain_id}/{theme_id}/{box_id}.png")
-async def box_cover_booklet(chain_id: str, theme_id: str, box_id: str):
+async def box_cover_booklet(request: Request, chain_id: str, theme_id: str, box_id: str):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_box_cover_booklet(rid)
-    return StreamingResponse(io.BytesIO(image), media_type="image/png", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, "booklet_cover.png"), "image/png", headers)
+    file = await boxes.get_box_cover_booklet(rid)
+    return bytes_response(request, file.data, "image/png", headers, file.etag)
 
 
 @router.head("/box/cover_booklet/{chain_id}/{theme_id}/{box_id}.jpg")
 @router.get("/box/cover_booklet/{chain_id}/{theme_id}/{box_id}.jpg")
-async def box_cover_booklet_jpg(chain_id: str, theme_id: str, box_id: str):
+async def box_cover_booklet_jpg(request: Request, chain_id: str, theme_id: str, box_id: str):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_box_cover_booklet_jpg(rid)
-    return StreamingResponse(io.BytesIO(image), media_type="image/jpeg", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, "booklet_cover.jpg"), "image/jpeg", headers)
+    file = await boxes.get_box_cover_booklet_jpg(rid)
+    return bytes_response(request, file.data, "image/jpeg", headers, file.etag)
 
 
 @router.head("/box/step_image/{chain_id}/{theme_id}/{box_id}/{step}")
 @router.head("/box/step_image/{chain_id}/{theme_id}/{box_id}/{step}.png")
 @router.get("/box/step_image/{chain_id}/{theme_id}/{box_id}/{step}")
 @router.get("/box/step_image/{chain_id}/{theme_id}/{box_id}/{step}.png")
-async def box_step_image(chain_id: str, theme_id: str, box_id: str, step: int):
+async def box_step_image(request: Request, chain_id: str, theme_id: str, box_id: str, step: int):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_box_step_image(rid, step)
-    return StreamingResponse(io.BytesIO(image), media_type="image/png", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, f"step_{step}.png"), "image/png", headers)
+    file = await boxes.get_box_step_image(rid, step)
+    return bytes_response(request, file.data, "image/png", headers, file.etag)
 
 
 @router.head("/box/step_glb/{chain_id}/{theme_id}/{box_id}/{step}")
 @router.head("/box/step_glb/{chain_id}/{theme_id}/{box_id}/{step}.glb")
 @router.get("/box/step_glb/{chain_id}/{theme_id}/{box_id}/{step}")
 @router.get("/box/step_glb/{chain_id}/{theme_id}/{box_id}/{step}.glb")
-async def box_step_glb(chain_id: str, theme_id: str, box_id: str, step: int):
+async def box_step_glb(request: Request, chain_id: str, theme_id: str, box_id: str, step: int):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_booklet_step_glb(rid, step)[0]
-    return StreamingResponse(io.BytesIO(image), media_type="model/gltf-binary", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, f"step_{step}.glb"), "model/gltf-binary", headers)
+    file = await boxes.get_box_file(rid, f"step_{step}.glb")
+    return bytes_response(request, file.data, "model/gltf-binary", headers, file.etag)
 
 
 @router.head("/box/step_glb_level/{chain_id}/{theme_id}/{box_id}/{step}")
 @router.head("/box/step_glb_level/{chain_id}/{theme_id}/{box_id}/{step}.glb")
 @router.get("/box/step_glb_level/{chain_id}/{theme_id}/{box_id}/{step}")
 @router.get("/box/step_glb_level/{chain_id}/{theme_id}/{box_id}/{step}.glb")
-async def box_step_glb_level(chain_id: str, theme_id: str, box_id: str, step: int):
+async def box_step_glb_level(request: Request, chain_id: str, theme_id: str, box_id: str, step: int):
     rid = BoxRID(chain_id, theme_id, box_id)
-    image = boxes.get_booklet_step_glb(rid, step)[1]
-    return StreamingResponse(io.BytesIO(image), media_type="model/gltf-binary", headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    headers = {"Cache-Control": f"public,max-age={3600 * 24}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_box_file_info(rid, f"step_level_{step}.glb"), "model/gltf-binary", headers)
+    file = await boxes.get_box_file(rid, f"step_level_{step}.glb")
+    return bytes_response(request, file.data, "model/gltf-binary", headers, file.etag)
 
 
 @router.head("/box/data/{chain_id}/{theme_id}/{box_id}")
@@ -162,7 +175,7 @@ async def box_step_glb_level(chain_id: str, theme_id: str, box_id: str, step: in
 @router.get("/box/data/{chain_id}/{theme_id}/{box_id}.json")
 async def box_data(chain_id: str, theme_id: str, box_id: str):
     rid = BoxRID(chain_id, theme_id, box_id)
-    output = boxes.get_box_metadata(rid)
+    output = await boxes.get_box_metadata(rid)
     return JSONResponse(output, headers={
         "Cache-Control": f"public,max-age={24 * 3600}"
     })
@@ -1,8 +1,11 @@
-from typing import Callable
+from typing import Awaitable, Callable, Optional
 
 from fastapi import HTTPException, Request, Response
 from fastapi.routing import APIRoute
+from starlette.responses import StreamingResponse
 
+from briq_api.model_executor import QueueFullException
+from briq_api.storage.file.file_client import FileInfo, FileStream, content_md5
 from briq_api.storage.multi_backend_client import NoBackendException
 
 
@@ -13,11 +16,14 @@ def ExceptionWrapperRoute(logger):
 
             async def custom_route_handler(request: Request) -> Response:
                 try:
-                    return await original_route_handler(request)
+                    return conditional_response(request, await original_route_handler(request))
                 except NoBackendException as e:
                     logger.warning("No backend found for network %(network)s", {"network": e.chain_id}, exc_info=e, extra={"request_url": str(request.url)})
                 except FileNotFoundError as e:
                     logger.warning("File not found", exc_info=e, extra={"request_url": str(request.url)})
+                except QueueFullException as e:
+                    logger.warning(e, extra={"request_url": str(request.url)})
+                    raise HTTPException(status_code=503, detail="Server busy, try again later.", headers={"Retry-After": "10"})
                 except HTTPException as e:
                     logger.error(e, exc_info=e, extra={"request_url": str(request.url)})
                     raise e
@@ -26,3 +32,133 @@ def ExceptionWrapperRoute(logger):
                 raise HTTPException(status_code=500, detail="Data could not be returned.")
             return custom_route_handler
     return ExceptionWrapperRoute_
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the client already has this version, as per If-None-Match (which uses weak comparison)."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+def not_modified(headers) -> Response:
+    return Response(status_code=304, headers={
+        key: value for key, value in headers.items() if key.lower() in ("etag", "cache-control", "accept-ranges")
+    })
+
+
+def conditional_response(request: Request, response: Response) -> Response:
+    """
+    Adds an ETag to successful responses that have none, hashing the body,
+    and turns them into a 304 if the client already has that version.
+    Streamed responses can't be hashed, they need to set their own ETag.
+    """
+    if request.method not in ("GET", "HEAD") or response.status_code not in (200, 206):
+        return response
+    if "etag" not in response.headers:
+        # Empty bodies are answers to HEAD requests that didn't generate the content.
+        if response.status_code != 200 or isinstance(response, StreamingResponse) or not response.body:
+            return response
+        response.headers["etag"] = f'"{content_md5(response.body)}"'
+    if etag_matches(request, response.headers["etag"]):
+        return not_modified(response.headers)
+    return response
+
+
+def head_response(media_type: str, headers: dict[str, str]) -> Response:
+    """Answer to a HEAD request for content that exists but would only be generated by the GET."""
+    response = Response(media_type=media_type, headers=headers)
+    # We don't know the size, and it certainly isn't 0.
+    del response.headers["content-length"]
+    return response
+
+
+def info_head_response(request: Request, info: FileInfo, media_type: str, headers: dict[str, str]) -> Response:
+    """Answer to a HEAD request for a stored file from its info, without loading it."""
+    headers = {**headers, "Accept-Ranges": "bytes", "ETag": f'"{info.etag}"'}
+    if etag_matches(request, headers["ETag"]):
+        return not_modified(headers)
+    headers["Content-Length"] = str(info.size)
+    return Response(media_type=media_type, headers=headers)
+
+
+def parse_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Parse a single 'bytes=start-end' range into (start, end), end excluded.
+    Returns None for anything we don't support (e.g. multiple ranges), in which case the whole file is sent.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            # Suffix range, i.e. the last N bytes.
+            start = max(size - int(last), 0)
+            end = size if int(last) > 0 else 0
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def bytes_response(request: Request, data: bytes, media_type: str, headers: dict[str, str], etag: Optional[str] = None) -> Response:
+    """
+    Response for a file we have in memory, honoring range requests.
+    Pass the ETag if it's known (see FileData), rather than hashing the data on every request.
+    """
+    # Set here as the body of partial responses isn't the whole file.
+    headers = {**headers, "Accept-Ranges": "bytes", "ETag": f'"{etag or content_md5(data)}"'}
+    byte_range = parse_range(request.headers["range"], len(data)) if "range" in request.headers else None
+    if byte_range is None:
+        return Response(data, media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{len(data)}"
+    return Response(data[start:end], status_code=206, media_type=media_type, headers=headers)
+
+
+async def stream_response(
+    request: Request,
+    open_stream: Callable[[int, Optional[int]], Awaitable[FileStream]],
+    get_info: Callable[[], Awaitable[FileInfo]],
+    media_type: str,
+    headers: dict[str, str]
+) -> Response:
+    """
+    Response streaming a file from storage, honoring range and conditional requests.
+    open_stream is called with the start and end (excluded) of the bytes to send.
+    The size and ETag sent are those of the version of the file that is streamed.
+    """
+    headers = {**headers, "Accept-Ranges": "bytes"}
+    if request.method == "HEAD" or "if-none-match" in request.headers or "range" in request.headers:
+        # Check the file's metadata first, we might not need to fetch the content at all.
+        info = await get_info()
+        headers["ETag"] = f'"{info.etag}"'
+        if etag_matches(request, headers["ETag"]):
+            return not_modified(headers)
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(info.size)
+            return Response(media_type=media_type, headers=headers)
+        byte_range = parse_range(request.headers["range"], info.size) if "range" in request.headers else None
+        if byte_range is not None:
+            start, end = byte_range
+            stream = await open_stream(start, end)
+            if stream.info.etag == info.etag:
+                headers["Content-Range"] = f"bytes {start}-{end - 1}/{info.size}"
+                headers["Content-Length"] = str(end - start)
+                return StreamingResponse(stream, status_code=206, media_type=media_type, headers=headers)
+            # The file changed since we looked at it, the range may not make sense anymore: send all of it.
+            stream.close()
+    stream = await open_stream(0, None)
+    headers["ETag"] = f'"{stream.info.etag}"'
+    headers["Content-Length"] = str(stream.info.size)
+    return StreamingResponse(stream, media_type=media_type, headers=headers)
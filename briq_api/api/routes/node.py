@@ -20,19 +20,19 @@ alchemy_endpoint = {
 }
 
 
-@CacheData.memory_cache(lambda chain_id, _, tx_hash: f'{chain_id}_{tx_hash}_rpc_tx_data', timeout=30)
+@CacheData.memory_cache(lambda chain_id, _, tx_hash: f'{chain_id}_{tx_hash}_rpc_tx_data', timeout=30, single_flight=True)
 async def get_rpc_tx_data(chain_id: str, data, tx_hash: str):
     async with alchemy_session.post(alchemy_endpoint[chain_id], data=data) as response:
         return await response.json()
 
 
-@CacheData.memory_cache(lambda chain_id, _: f'{chain_id}_rpc_chain_id', timeout=3600)
+@CacheData.memory_cache(lambda chain_id, _: f'{chain_id}_rpc_chain_id', timeout=3600, single_flight=True, shared=True)
 async def get_rpc_chain_id(chain_id: str, data):
     async with alchemy_session.post(alchemy_endpoint[chain_id], data=data) as response:
         return await response.json()
 
 
-@CacheData.memory_cache(lambda chain_id, _, entrypoint: f'{chain_id}_{entrypoint}_rpc_factory', timeout=60)
+@CacheData.memory_cache(lambda chain_id, _, entrypoint: f'{chain_id}_{entrypoint}_rpc_factory', timeout=60, single_flight=True)
 async def get_rpc_call_factory(chain_id: str, data, entrypoint: str):
     async with alchemy_session.post(alchemy_endpoint[chain_id], data=data) as response:
         return await response.json()
@@ -1,16 +1,17 @@
-import io
 import json
 import logging
+import re
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-from starlette.responses import StreamingResponse
+from starlette.responses import Response
 
+from briq_api.model_executor import LOD_MODEL_KINDS
 from briq_api.set_identifier import SetRID
 from briq_api.storage.file.backends.cloud_storage import NotFoundException
 
-from .common import ExceptionWrapperRoute
+from .common import ExceptionWrapperRoute, bytes_response, head_response, stream_response
 
 from .. import api
 
@@ -40,11 +41,8 @@ async def metadata(chain_id: str, token_id: str):
     # Don't cache data if the set has no creation date, which means we haven't indexed it yet.
     cache_time = (24 * 3600) if output['created_at'] != -1 else 10
 
-    # Stream the data because files can get fairly hefty.
-    out = io.StringIO()
-    json.dump(output, out)
-    out.seek(0)
-    return StreamingResponse(out, media_type="application/json", headers={
+    # Not streamed, so the route wrapper can hash it into an ETag.
+    return Response(json.dumps(output), media_type="application/json", headers={
         "Cache-Control": f"public,max-age={cache_time}"
     })
 
@@ -53,37 +51,56 @@ async def metadata(chain_id: str, token_id: str):
 @router.head("/preview/{chain_id}/{token_id}.png")
 @router.get("/preview/{chain_id}/{token_id}")
 @router.get("/preview/{chain_id}/{token_id}.png")
-async def preview(chain_id: str, token_id: str):
+async def preview(request: Request, chain_id: str, token_id: str):
     if token_id in hidden_sets:
         raise HTTPException(status_code=404, detail="Not found")
 
     rid = SetRID(chain_id=chain_id, token_id=token_id)
-
-    preview = api.get_preview(rid)
-
-    return StreamingResponse(io.BytesIO(preview), media_type="image/png", headers={
+    headers = {
         "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    }
+
+    try:
+        return await stream_response(
+            request,
+            lambda start, end: api.get_preview_stream(rid, start, end),
+            lambda: api.get_preview_info(rid),
+            "image/png",
+            headers
+        )
+    except HTTPException:
+        raise
+    except Exception:
+        if request.method == "HEAD":
+            # There always is an image, worst case the default one.
+            return head_response("image/png", headers)
+        # No preview stored, get_preview falls back to generating one.
+        return bytes_response(request, await api.get_preview(rid), "image/png", headers)
 
 
 @router.head("/set/{chain_id}/{token_id}/small_preview.jpg")
 @router.get("/set/{chain_id}/{token_id}/small_preview.jpg")
-async def get_small_preview(chain_id: str, token_id: str):
+async def get_small_preview(request: Request, chain_id: str, token_id: str):
     if token_id in hidden_sets:
         raise HTTPException(status_code=404, detail="Not found")
 
     rid = SetRID(chain_id=chain_id, token_id=token_id)
 
-    preview = api.get_small_preview(rid)
+    preview = await api.get_small_preview(rid)
 
-    return StreamingResponse(io.BytesIO(preview), media_type="image/png", headers={
+    return bytes_response(request, preview.data, "image/png", {
         "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+    }, preview.etag)
 
 
 @router.head("/model/{chain_id}/{token_id}.{kind}")
 @router.get("/model/{chain_id}/{token_id}.{kind}")
-async def model(chain_id: str, token_id: str, kind: str):
+async def model(request: Request, chain_id: str, token_id: str, kind: str, lod: int = 0):
+    # Coarser versions of the model are requested either as {token_id}.lod1.glb or with ?lod=1.
+    lod_suffix = re.fullmatch(r"(.+)\.lod(\d+)", token_id)
+    if lod_suffix:
+        token_id, lod = lod_suffix[1], int(lod_suffix[2])
+
     if token_id in hidden_sets:
         raise HTTPException(status_code=404, detail="Not found")
 
@@ -94,19 +111,35 @@ async def model(chain_id: str, token_id: str, kind: str):
     }
     if kind not in mime_type:
         raise HTTPException(status_code=400, detail=f"Model kind {kind} is not supported")
+    content_type = mime_type[kind]
+    if lod:
+        if kind not in ("glb", "gltf") or f"lod{lod}.glb" not in LOD_MODEL_KINDS:
+            raise HTTPException(status_code=400, detail=f"Level of detail {lod} is not supported for {kind} models")
+        kind = f"lod{lod}.glb"
 
     rid = SetRID(chain_id=chain_id, token_id=token_id)
+    headers = {
+        "Cache-Control": f"public,max-age={3600 * 24}"
+    }
     try:
-        data = api.get_model(rid, kind)
+        return await stream_response(
+            request,
+            lambda start, end: api.get_model_stream(rid, kind, start, end),
+            lambda: api.get_model_info(rid, kind),
+            content_type,
+            headers
+        )
     except (NotFoundException, OSError):
+        if request.method == "HEAD":
+            # Don't generate the model just for that, it will be on GET as long as the set exists.
+            if not await api.has_set(rid):
+                raise HTTPException(status_code=404, detail="Not found")
+            return head_response(content_type, headers)
         metadata = await api.get_metadata(rid)
-        data = api.create_model(metadata, kind)
-        api.store_model(rid, kind, data)
+        data = await api.create_model(rid, metadata, kind)
+        await api.store_model(rid, kind, data)
         logger.info("Created %(type)s model for %(rid)s on the fly.", {"type": kind, "rid": rid.json()})
-
-    return StreamingResponse(io.BytesIO(data), media_type=mime_type[kind], headers={
-        "Cache-Control": f"public,max-age={3600 * 24}"
-    })
+        return bytes_response(request, data, content_type, headers)
 
 
 class StoreSetRequest(BaseModel):
@@ -1,20 +1,18 @@
-import io
 import logging
 import time
 
-from starlette.responses import JSONResponse, StreamingResponse
-from fastapi import APIRouter
-from briq_api.api.api import get_metadata
+from starlette.responses import JSONResponse
+from fastapi import APIRouter, Request
+from briq_api.api.api import get_metadata_many
 
 from briq_api.api.theme import list_sets_of_theme
 from briq_api.indexer.events.common import encode_int_as_bytes
-from briq_api.set_identifier import SetRID
 from briq_api.indexer.storage import mongo_storage
 
 from .. import boxes
 from ..boxes import BoxRID
 
-from .common import ExceptionWrapperRoute
+from .common import ExceptionWrapperRoute, bytes_response, info_head_response
 
 logger = logging.getLogger(__name__)
 
@@ -23,41 +21,46 @@ router = APIRouter(route_class=ExceptionWrapperRoute(logger))
 
 @router.head("/{chain_id}/{theme_id}/{quality}/cover.jpg")
 @router.get("/{chain_id}/{theme_id}/{quality}/cover.jpg")
-async def get_theme_cover(chain_id: str, theme_id: str, quality: str):
-    data = boxes.get_theme_data(chain_id, theme_id)
+async def get_theme_cover(request: Request, chain_id: str, theme_id: str, quality: str):
+    data = await boxes.get_theme_data(chain_id, theme_id)
     is_post_launch = data['sale_start'] is None or data['sale_start'] > time.time()
+    headers = {"Cache-Control": f"public,max-age={60 * (60 * 24 * 7 if is_post_launch else 5)}"}
+    if request.method == "HEAD":
+        file = f"cover_{'postlaunch' if is_post_launch else 'prelaunch'}_{quality}.jpg"
+        return info_head_response(request, await boxes.get_theme_file_info(chain_id, theme_id, file), "image/jpeg", headers)
     if not is_post_launch:
-        output = boxes.box_storage.theme_cover_prelaunch(chain_id, theme_id, quality)
+        output = await boxes.box_storage.theme_cover_prelaunch(chain_id, theme_id, quality)
     else:
-        output = boxes.box_storage.theme_cover_postlaunch(chain_id, theme_id, quality)
-    return StreamingResponse(io.BytesIO(output), media_type="image/jpeg", headers={
-        "Cache-Control": f"public,max-age={60 * (60 * 24 * 7 if is_post_launch else 5)}"
-    })
+        output = await boxes.box_storage.theme_cover_postlaunch(chain_id, theme_id, quality)
+    return bytes_response(request, output.data, "image/jpeg", headers, output.etag)
 
 
 @router.head("/{chain_id}/{theme_id}/{quality}/logo.png")
 @router.get("/{chain_id}/{theme_id}/{quality}/logo.png")
-async def get_theme_logo(chain_id: str, theme_id: str, quality: str):
+async def get_theme_logo(request: Request, chain_id: str, theme_id: str, quality: str):
+    headers = {"Cache-Control": f"public,max-age={60 * 60 * 24 * 7}"}
+    if request.method == "HEAD":
+        return info_head_response(request, await boxes.get_theme_file_info(chain_id, theme_id, "logo.png"), "image/png", headers)
     # Only in high quality, too cheap
-    output = boxes.box_storage.theme_logo(chain_id, theme_id, 'high')
-    return StreamingResponse(io.BytesIO(output), media_type="image/png", headers={
-        "Cache-Control": f"public,max-age={60 * 60 * 24 * 7}"
-    })
+    output = await boxes.box_storage.theme_logo(chain_id, theme_id, 'high')
+    return bytes_response(request, output.data, "image/png", headers, output.etag)
 
 
 @router.head("/{chain_id}/{theme_id}/{quality}/splash.jpg")
 @router.get("/{chain_id}/{theme_id}/{quality}/splash.jpg")
-async def get_theme_splash(chain_id: str, theme_id: str, quality: str):
-    output = boxes.box_storage.theme_splash(chain_id, theme_id, quality)
-    return StreamingResponse(io.BytesIO(output), media_type="image/jpeg", headers={
-        "Cache-Control": f"public,max-age={60 * 60 * 24 * 7}"
-    })
+async def get_theme_splash(request: Request, chain_id: str, theme_id: str, quality: str):
+    headers = {"Cache-Control": f"public,max-age={60 * 60 * 24 * 7}"}
+    if request.method == "HEAD":
+        info = await boxes.get_theme_file_info(chain_id, theme_id, f"splash_{quality}.jpg")
+        return info_head_response(request, info, "image/jpeg", headers)
+    output = await boxes.box_storage.theme_splash(chain_id, theme_id, quality)
+    return bytes_response(request, output.data, "image/jpeg", headers, output.etag)
 
 
 @router.head("/box_themes/list/{chain_id}")
 @router.get("/box_themes/list/{chain_id}")
 async def list_themes(chain_id: str):
-    output = boxes.list_themes(chain_id)
+    output = await boxes.list_themes(chain_id)
     return JSONResponse(output, headers={
         "Cache-Control": f"public,max-age={60}"
     })
@@ -65,7 +68,7 @@ async def list_themes(chain_id: str):
 @router.head("/{chain_id}/{theme_id}/data")
 @router.get("/{chain_id}/{theme_id}/data")
 async def get_theme_data(chain_id: str, theme_id: str):
-    output = boxes.get_theme_data(chain_id, theme_id)
+    output = await boxes.get_theme_data(chain_id, theme_id)
     # Low cache for fast turnaround time but some minor CDN benefit
     return JSONResponse(output, headers={
         "Cache-Control": f"public,max-age={60}"
@@ -75,11 +78,11 @@ async def get_theme_data(chain_id: str, theme_id: str):
 @router.head("/{chain_id}/{theme_id}/boxes")
 @router.get("/{chain_id}/{theme_id}/boxes")
 async def list_boxes_of_theme(chain_id: str, theme_id: str):
-    data = boxes.get_theme_data(chain_id, theme_id)
+    data = await boxes.get_theme_data(chain_id, theme_id)
     if data['sale_start'] is None or data['sale_start'] > time.time():
         output = []
     else:
-        output = boxes.list_boxes_of_theme(chain_id, theme_id)
+        output = await boxes.list_boxes_of_theme(chain_id, theme_id)
     # Turn off the caching client-side - this must update when the waves become active
     return output
 
@@ -88,8 +91,8 @@ async def list_boxes_of_theme(chain_id: str, theme_id: str):
 @router.head("/{chain_id}/{theme_id}/saledata")
 @router.get("/{chain_id}/{theme_id}/saledata")
 async def get_box_saledata(chain_id: str, theme_id: str):
-    theme_data = boxes.get_theme_data(chain_id, theme_id)
-    box_list = boxes.list_boxes_of_theme(chain_id, theme_id)
+    theme_data = await boxes.get_theme_data(chain_id, theme_id)
+    box_list = await boxes.list_boxes_of_theme(chain_id, theme_id)
     if theme_data['sale_start'] is None or theme_data['sale_start'] > time.time():
         return {}
     ret = {}
@@ -102,13 +105,14 @@ async def get_box_saledata(chain_id: str, theme_id: str):
 @router.head("/box/data_all/{chain_id}/{theme_id}")
 @router.get("/box/data_all/{chain_id}/{theme_id}")
 async def get_all_boxes_data(chain_id: str, theme_id: str):
-    theme_data = boxes.get_theme_data(chain_id, theme_id)
-    box_list = boxes.list_boxes_of_theme(chain_id, theme_id)
+    theme_data = await boxes.get_theme_data(chain_id, theme_id)
+    box_list = await boxes.list_boxes_of_theme(chain_id, theme_id)
     if theme_data['sale_start'] is None or theme_data['sale_start'] > time.time():
         return {}
+    rids = [BoxRID(chain_id, theme_id, box.split('/')[1]) for box in box_list]
     ret = {}
-    for box in box_list:
-        ret[box] = boxes.get_box_metadata(rid=BoxRID(chain_id, theme_id, box.split('/')[1]))
+    for rid, metadata in await boxes.get_boxes_metadata(chain_id, rids):
+        ret[f"{rid.theme_id}/{rid.box_id}"] = metadata
     # Turn off the caching client-side - this must update when the waves become active
     return ret
 
@@ -122,9 +126,7 @@ async def get_data_for_all_sets(chain_id: str, theme_id: str):
     """
     sets = await list_sets_of_theme(chain_id, theme_id)
     out = {}
-    for token_id in sets:
-        rid = SetRID(chain_id=chain_id, token_id=token_id)
-        set_data = await get_metadata(rid)
+    for token_id, set_data in await get_metadata_many(chain_id, sets):
         out[token_id] = {
             x: set_data[x] for x in ['id', 'name', 'description', 'image', 'created_at', 'booklet_id', 'background_color'] if x in set_data
         }
@@ -22,7 +22,7 @@ async def uri_box(chain_id: str, token_id: str):
         Note that token_id can be base 10 or base 16 (done for convenience on-chain).
     """
     try:
-        output = uri_api.box_uri(chain_id, token_id)
+        output = await uri_api.box_uri(chain_id, token_id)
     except Exception as e:
         logger.error(e, exc_info=e)
         raise HTTPException(status_code=500, detail="File not found")
@@ -43,7 +43,7 @@ async def uri_booklet(chain_id: str, token_id: str):
         Note that token_id can be base 10 or base 16 (done for convenience on-chain).
     """
     try:
-        output = uri_api.booklet_uri(chain_id, token_id)
+        output = await uri_api.booklet_uri(chain_id, token_id)
     except Exception as e:
         logger.error(e, exc_info=e)
         raise HTTPException(status_code=500, detail="File not found")
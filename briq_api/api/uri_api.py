@@ -11,20 +11,20 @@ from briq_api.api.api import get_metadata
 logger = logging.getLogger(__name__)
 
 
-def box_uri(chain_id: str, token_id: str):
+async def box_uri(chain_id: str, token_id: str):
     if '0x' in token_id or '0X' in token_id:
         box_id = genesis_storage.get_box_id(chain_id, token_id).split('/')
     else:
         box_id = genesis_storage.get_box_id(chain_id, hex(int(token_id))).split('/')
-    return get_box_metadata(BoxRID(chain_id, *box_id))
+    return await get_box_metadata(BoxRID(chain_id, *box_id))
 
 
-def booklet_uri(chain_id: str, token_id: str):
+async def booklet_uri(chain_id: str, token_id: str):
     if '0x' in token_id or '0X' in token_id:
-        box_id = get_booklet_id_from_token_id(chain_id, token_id).split('/')
+        box_id = (await get_booklet_id_from_token_id(chain_id, token_id)).split('/')
     else:
-        box_id = get_booklet_id_from_token_id(chain_id, hex(int(token_id))).split('/')
-    return get_booklet_metadata(BoxRID(chain_id, *box_id))
+        box_id = (await get_booklet_id_from_token_id(chain_id, hex(int(token_id)))).split('/')
+    return await get_booklet_metadata(BoxRID(chain_id, *box_id))
 
 
 async def set_uri(chain_id: str, token_id: str):
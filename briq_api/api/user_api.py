@@ -21,7 +21,7 @@ async def get_user_items(chain_id: str, user_id: str):
     sets = await mongo_storage.get_user_nfts(chain_id, user_id, 'set')
     return {
         "box_token_ids": [genesis_storage.get_box_id(chain_id, box) for box in boxes.nfts],
-        "booklets": [get_booklet_id_from_token_id(chain_id, booklet) for booklet in booklets.nfts],
+        "booklets": [await get_booklet_id_from_token_id(chain_id, booklet) for booklet in booklets.nfts],
         "sets": sets.nfts,
         "last_block": max(boxes.last_block, booklets.last_block, sets.last_block),
     }
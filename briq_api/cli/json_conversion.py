@@ -13,8 +13,7 @@ args = parser.parse_args()
 try:
     briqData = BriqData().load_file(args.file)
     with open(args.file.replace(".json", ".glb"), "wb") as f:
-        data = briqData.to_gltf()
-        f.write(b''.join(data.save_to_bytes()))
+        f.write(briqData.to_glb())
     with open(args.file.replace(".json", ".vox"), "wb") as f:
         data = briqData.to_vox(args.file)
         f.write(data.to_bytes())
@@ -6,3 +6,35 @@ ENV_VAR = Literal["dev", "test", "prod"]
 ENV: ENV_VAR
 ENV = cast(ENV_VAR, os.getenv("ENV")) or "dev"
 assert ENV in ["dev", "test", "prod"]
+
+# Budget of the in-memory caches of each worker (see briq_api.memory_cache).
+MEMORY_CACHE_MAX_BYTES = int(os.getenv("MEMORY_CACHE_MAX_BYTES") or 512 * 1024 * 1024)
+MEMORY_CACHE_MAX_ENTRIES = int(os.getenv("MEMORY_CACHE_MAX_ENTRIES") or 100_000)
+
+# Optional cache tier shared by the workers of a node, e.g. /dev/shm/briq-api (see briq_api.shared_cache).
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH")
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES") or 1024 * 1024 * 1024)
+
+# Optional local disk cache in front of cloud storage for immutable assets (see CachingStorage).
+DISK_CACHE_PATH = os.getenv("DISK_CACHE_PATH")
+DISK_CACHE_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES") or 10 * 1024 * 1024 * 1024)
+
+# Backend of the cache invalidation bus: "mongo", "socket" or unset (see briq_api.invalidation).
+CACHE_INVALIDATION_BACKEND = os.getenv("CACHE_INVALIDATION_BACKEND")
+CACHE_INVALIDATION_SOCKET_PATH = os.getenv("CACHE_INVALIDATION_SOCKET_PATH") or "/tmp/briq-api-invalidation"
+
+# Store models with int16 positions (KHR_mesh_quantization), about half the size but not supported by every viewer.
+QUANTIZE_MODELS = (os.getenv("QUANTIZE_MODELS") or "0") == "1"
+
+# Processes generating models and previews, and how many more jobs may wait for them (see briq_api.model_executor).
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS") or 2)
+MODEL_QUEUE_SIZE = int(os.getenv("MODEL_QUEUE_SIZE") or 16)
+
+# Processes of the set indexer rendering new sets ahead of time (0 to disable), and how many sets may wait for them.
+PRERENDER_WORKERS = int(os.getenv("PRERENDER_WORKERS") or 1)
+PRERENDER_QUEUE_SIZE = int(os.getenv("PRERENDER_QUEUE_SIZE") or 1000)
+
+# Threads used to run blocking storage calls from async code (see FileStorageBackend).
+STORAGE_IO_THREADS = int(os.getenv("STORAGE_IO_THREADS") or 64)
+# How many files a single batch load (load_json_many & co) fetches at once.
+STORAGE_BATCH_CONCURRENCY = int(os.getenv("STORAGE_BATCH_CONCURRENCY") or 16)
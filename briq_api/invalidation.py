@@ -0,0 +1,167 @@
+"""
+Cluster-wide cache invalidation.
+
+In-memory caches live in each worker of each pod, so clearing one after a write only fixes that worker.
+The invalidation bus broadcasts "namespace (and optionally key) is stale" messages to every subscriber,
+through a pluggable backend: a Mongo capped collection (cluster-wide) or unix sockets (workers of one node).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Union
+from uuid import uuid4
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+# Called with the namespace and the key (None meaning the whole namespace).
+InvalidationCallback = Callable[[str, Union[str, None]], None]
+
+
+class InvalidationBackend(ABC):
+
+    @abstractmethod
+    def publish(self, message: dict):
+        pass
+
+    @abstractmethod
+    async def listen(self, on_message: Callable[[dict], None]):
+        """Runs forever, calling on_message for every message published (by anyone) after it started."""
+        pass
+
+
+class MongoInvalidationBackend(InvalidationBackend):
+    COLLECTION = "cache_invalidations"
+
+    def __init__(self, mongo_backend) -> None:
+        self.db = mongo_backend.db
+        self.async_db = mongo_backend.async_db
+        try:
+            # Capped, so it never grows, and so it can be tailed.
+            self.db.create_collection(self.COLLECTION, capped=True, size=1024 * 1024, max=1000)
+        except CollectionInvalid:
+            pass
+
+    def publish(self, message: dict):
+        self.db[self.COLLECTION].insert_one(dict(message))
+
+    async def listen(self, on_message: Callable[[dict], None]):
+        collection = self.async_db[self.COLLECTION]
+        last = await collection.find_one(sort=[('$natural', -1)])
+        query = {'_id': {'$gt': last['_id']}} if last else {}
+        while True:
+            try:
+                cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for message in cursor:
+                        query = {'_id': {'$gt': message['_id']}}
+                        on_message(message)
+                    await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Lost the cache invalidation cursor, retrying.", exc_info=e)
+            await asyncio.sleep(5)
+
+
+class LocalSocketInvalidationBackend(InvalidationBackend):
+    """
+    Each process binds a unix datagram socket in a common folder, and publishing sends to all of them.
+    Only reaches the workers of the same node.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        self.socket_path = os.path.join(self.path, f"{os.getpid()}.sock")
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.socket_path)
+        self.socket.setblocking(False)
+
+    def publish(self, message: dict):
+        data = json.dumps(message).encode()
+        for name in os.listdir(self.path):
+            if not name.endswith(".sock"):
+                continue
+            try:
+                self.socket.sendto(data, os.path.join(self.path, name))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # That process is gone, clean up after it.
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                logger.warning("Invalidation queue of %(socket)s is full, dropping message.", {"socket": name})
+
+    async def listen(self, on_message: Callable[[dict], None]):
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[bytes] = asyncio.Queue()
+
+        def on_readable():
+            try:
+                while True:
+                    queue.put_nowait(self.socket.recv(65536))
+            except BlockingIOError:
+                pass
+
+        loop.add_reader(self.socket.fileno(), on_readable)
+        try:
+            while True:
+                on_message(json.loads(await queue.get()))
+        finally:
+            loop.remove_reader(self.socket.fileno())
+
+
+class InvalidationBus:
+    def __init__(self) -> None:
+        self.backend: Optional[InvalidationBackend] = None
+        # Lets us ignore our own messages, as we have already invalidated locally.
+        self.origin = uuid4().hex
+        self.subscribers: list[InvalidationCallback] = []
+        self._listener: Optional[asyncio.Task] = None
+
+    def connect(self, backend: Optional[InvalidationBackend]):
+        self.backend = backend
+
+    def subscribe(self, callback: InvalidationCallback):
+        self.subscribers.append(callback)
+
+    def publish(self, namespace: str, key: Union[str, None] = None):
+        if self.backend is None:
+            return
+        try:
+            self.backend.publish({"origin": self.origin, "namespace": namespace, "key": key})
+        except Exception as e:
+            logger.error("Could not publish cache invalidation for %(namespace)s", {"namespace": namespace}, exc_info=e)
+
+    def start(self):
+        """Start listening in the background, must be called from within the event loop."""
+        if self.backend is None or self._listener is not None:
+            return
+        self._listener = asyncio.ensure_future(self.backend.listen(self._on_message))
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+    def _on_message(self, message: dict):
+        if message.get("origin") == self.origin:
+            return
+        logger.debug("Invalidating cache %(namespace)s/%(key)s", {"namespace": message["namespace"], "key": message["key"]})
+        for callback in self.subscribers:
+            try:
+                callback(message["namespace"], message["key"])
+            except Exception as e:
+                logger.error("Error while invalidating %(namespace)s", {"namespace": message["namespace"]}, exc_info=e)
+
+
+invalidation_bus = InvalidationBus()
@@ -1,52 +1,409 @@
 import asyncio
 import logging
-from dataclasses import dataclass
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import Future
+from dataclasses import dataclass, fields, is_dataclass
 from time import time
-from typing import Callable, TypeVar, Generic, Union
+from typing import Any, Callable, Iterator, Optional, TypeVar, Generic, Union
+
+from briq_api.config import MEMORY_CACHE_MAX_BYTES, MEMORY_CACHE_MAX_ENTRIES, SHARED_CACHE_MAX_BYTES, SHARED_CACHE_PATH
+from briq_api.shared_cache import SharedCache
 
 logger = logging.getLogger(__name__)
 
 T = TypeVar('T')
 
 
+# Containers with more items than this are sized from an evenly spread sample of them.
+SIZE_SAMPLE = 32
+
+
+def approximate_size(value: Any) -> int:
+    """
+    Rough size in bytes of a cached value. Only meant to be in the right ballpark for budgeting.
+    Big containers are extrapolated from a sample of their items, so that sizing a large set doesn't walk all of it.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview, str)):
+        return len(value)
+    if isinstance(value, CacheData):
+        return approximate_size(value.data)
+    if is_dataclass(value):
+        return 56 + sum(approximate_size(getattr(value, field.name)) + 8 for field in fields(value))
+    if isinstance(value, dict):
+        items = value.items() if len(value) <= SIZE_SAMPLE else list(value.items())[::len(value) // SIZE_SAMPLE][:SIZE_SAMPLE]
+        return 64 + _extrapolate(len(value), [approximate_size(k) + approximate_size(v) + 16 for k, v in items])
+    if isinstance(value, (list, tuple)):
+        items = value if len(value) <= SIZE_SAMPLE else value[::len(value) // SIZE_SAMPLE][:SIZE_SAMPLE]
+        return 56 + _extrapolate(len(value), [approximate_size(v) + 8 for v in items])
+    return sys.getsizeof(value)
+
+
+def _extrapolate(count: int, sample_sizes: list[int]) -> int:
+    if not sample_sizes:
+        return 0
+    return sum(sample_sizes) * count // len(sample_sizes)
+
+
+@dataclass
+class _LRUEntry:
+    value: Any
+    size: int
+    tick: int
+    expires_at: Optional[float]
+
+
+class CacheNamespace(MutableMapping):
+    """
+    A dict-like view of one namespace of an LRUCache.
+    Entries are evicted when the namespace goes over its own quota, or when the parent cache goes over budget.
+    If the namespace is shared, local misses fall through to the cross-worker tier, and writes go to both.
+    """
+    def __init__(
+        self,
+        lru: 'LRUCache',
+        name: str,
+        max_entries: Optional[int],
+        max_bytes: Optional[int],
+        ttl: Optional[int],
+        shared: Optional[SharedCache],
+    ):
+        self.lru = lru
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared = shared
+        self.bytes = 0
+        self._entries: OrderedDict[str, _LRUEntry] = OrderedDict()
+
+    def __getitem__(self, key: str):
+        try:
+            return self._get_local(key)
+        except KeyError:
+            pass
+        value = self.get_shared(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get_shared(self, key: str):
+        """
+        The value from the cross-worker tier (which then replaces the local one), or None if there is none.
+        For when the local value is too old: another worker may have refreshed it already.
+        """
+        if self.shared is None:
+            return None
+        value = self.shared.get(self.name, key)
+        if value is not None:
+            self._set_local(key, value)
+        return value
+
+    def __setitem__(self, key: str, value):
+        self._set_local(key, value)
+        if self.shared is not None:
+            self.shared.set(self.name, key, value, self.ttl)
+
+    def _get_local(self, key: str):
+        with self.lru._lock:
+            entry = self._entries[key]
+            if entry.expires_at is not None and entry.expires_at <= time():
+                self._remove(key)
+                raise KeyError(key)
+            entry.tick = self.lru._next_tick()
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def _set_local(self, key: str, value):
+        size = approximate_size(value)
+        with self.lru._lock:
+            if key in self._entries:
+                self._remove(key)
+            if (self.max_bytes is not None and size > self.max_bytes) or size > self.lru.max_bytes:
+                logger.debug("Not caching %(key)s in %(ns)s, %(size)s bytes is over budget.", {"key": key, "ns": self.name, "size": size})
+                return
+            self._entries[key] = _LRUEntry(
+                value=value,
+                size=size,
+                tick=self.lru._next_tick(),
+                expires_at=time() + self.ttl if self.ttl is not None else None
+            )
+            self.bytes += size
+            self.lru.bytes += size
+            self.lru.entries += 1
+            while self._over_quota():
+                self._remove(next(iter(self._entries)))
+            self.lru._evict()
+
+    def __delitem__(self, key: str):
+        if self.shared is not None:
+            self.shared.delete(self.name, key)
+        with self.lru._lock:
+            self._remove(key)
+
+    def discard(self, key: str):
+        """Drop the key if it's there. Unlike pop(), this doesn't read the value back from the shared tier first."""
+        if self.shared is not None:
+            self.shared.delete(self.name, key)
+        with self.lru._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def __iter__(self) -> Iterator[str]:
+        with self.lru._lock:
+            return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        if self.shared is not None:
+            self.shared.clear(self.name)
+        with self.lru._lock:
+            self.lru.bytes -= self.bytes
+            self.lru.entries -= len(self._entries)
+            self.bytes = 0
+            self._entries.clear()
+
+    def invalidate(self, key: Optional[str] = None):
+        """Drop the key (or everything), here and, through the invalidation bus, in every other worker."""
+        if key is None:
+            self.clear()
+        else:
+            self.discard(key)
+        if self.lru.invalidation_bus is not None:
+            self.lru.invalidation_bus.publish(self.name, key)
+
+    def _over_quota(self) -> bool:
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        self.lru.bytes -= entry.size
+        self.lru.entries -= 1
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU storage shared by the in-memory caches of a worker.
+    Each user gets its own namespace (with optional quotas and TTL), and all namespaces share the global budget:
+    when it's exceeded, the least recently used entry across all namespaces is evicted.
+    Namespaces can opt into the `shared` cross-worker tier, if there is one.
+    """
+    def __init__(self, max_entries: int, max_bytes: int, shared: Optional[SharedCache] = None):
+        self.shared = shared
+        self.invalidation_bus = None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = 0
+        self._tick = 0
+        self._lock = threading.RLock()
+        self._namespaces: dict[str, CacheNamespace] = {}
+
+    def namespace(
+        self, name: str, max_entries: Optional[int] = None, max_bytes: Optional[int] = None, ttl: Optional[int] = None, shared: bool = False
+    ) -> CacheNamespace:
+        with self._lock:
+            if name not in self._namespaces:
+                self._namespaces[name] = CacheNamespace(self, name, max_entries, max_bytes, ttl, self.shared if shared else None)
+            return self._namespaces[name]
+
+    def clear(self):
+        with self._lock:
+            for namespace in self._namespaces.values():
+                namespace.clear()
+
+    def connect_invalidation(self, bus):
+        """Subscribe to invalidations from other workers, and publish our own (see briq_api.invalidation)."""
+        self.invalidation_bus = bus
+        bus.subscribe(self._on_invalidation)
+
+    def _on_invalidation(self, namespace: str, key: Optional[str]):
+        if namespace not in self._namespaces:
+            return
+        if key is None:
+            self._namespaces[namespace].clear()
+        else:
+            self._namespaces[namespace].discard(key)
+
+    def _next_tick(self) -> int:
+        self._tick += 1
+        return self._tick
+
+    def _evict(self):
+        while self.entries > self.max_entries or self.bytes > self.max_bytes:
+            # Namespaces are each in LRU order, so the globally oldest entry is the oldest of their heads.
+            oldest = min(
+                (ns for ns in self._namespaces.values() if len(ns._entries)),
+                key=lambda ns: next(iter(ns._entries.values())).tick
+            )
+            oldest._remove(next(iter(oldest._entries)))
+
+
+shared_memory_cache = LRUCache(
+    max_entries=MEMORY_CACHE_MAX_ENTRIES,
+    max_bytes=MEMORY_CACHE_MAX_BYTES,
+    shared=SharedCache(SHARED_CACHE_PATH, max_bytes=SHARED_CACHE_MAX_BYTES, max_age=24 * 3600) if SHARED_CACHE_PATH else None,
+)
+
+
 @dataclass
 class CacheData(Generic[T]):
     data: T
     timeout: int
 
     @staticmethod
-    def memory_cache(cache_path: Callable[..., str], timeout: int, memcache=None) -> Callable[[Callable[..., T]], Callable[..., T]]:
-        if memcache is None:
-            _memcache: dict[str, CacheData[T]] = {}
-        else:
-            _memcache = memcache
+    def memory_cache(
+        cache_path: Callable[..., str],
+        timeout: int,
+        memcache=None,
+        single_flight: bool = False,
+        stale_ttl: int = 0,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        shared: bool = False,
+    ) -> Callable[[Callable[..., T]], Callable[..., T]]:
+        """
+        Cache the result of the wrapped function in memory for `timeout` seconds.
+        With `single_flight`, concurrent misses on the same key are coalesced:
+        the first caller computes the value and the others wait for its result (or its exception).
+        With `stale_ttl`, an expired value is still returned for that many extra seconds,
+        while a single background refresh runs (an asyncio task, or the loop's executor for sync functions).
+        Unless a `memcache` mapping is given, data is stored in a namespace of the shared LRU cache,
+        limited by `max_entries` and `max_bytes` on top of the global budget.
+        With `shared`, that namespace is also backed by the cross-worker tier.
+        The returned function has an `invalidate(*args, **kwargs)` attribute to drop the matching entry everywhere,
+        and `peek(*args, **kwargs)` / `prime(data, *args, **kwargs)` to read or fill the cache directly (e.g. for batch loads).
+        """
+        def log_refresh_failure(c_p: str, e: Union[BaseException, None]):
+            if e is not None:
+                logger.warning("Background refresh of %(path)s failed, keeping stale data.", {"path": c_p}, exc_info=e)
 
         def wrapper2(f: Callable[..., T]) -> Callable[..., T]:
+            _memcache: MutableMapping[str, CacheData[T]]
+            if memcache is None:
+                _memcache = shared_memory_cache.namespace(
+                    f"{f.__module__}.{f.__qualname__}", max_entries=max_entries, max_bytes=max_bytes, shared=shared)
+            else:
+                _memcache = memcache
+
+            # In-flight computations, by cache path.
+            _pending: dict[str, asyncio.Task] = {}
+            _sync_pending: dict[str, Future] = {}
+            _sync_lock = threading.Lock()
+
+            def lookup(c_p: str):
+                """Returns (data, fresh), or raises if there is nothing usable in the cache."""
+                cache_data = _memcache[c_p]
+                if cache_data.timeout <= time() and isinstance(_memcache, CacheNamespace):
+                    cache_data = _memcache.get_shared(c_p) or cache_data
+                if cache_data.timeout > time():
+                    return cache_data.data, True
+                elif cache_data.timeout + stale_ttl > time():
+                    return cache_data.data, False
+                else:
+                    raise Exception('Cache expired')
+
+            async def compute(c_p: str, *args, **kwargs) -> T:
+                data = await f(*args, **kwargs)
+                _memcache[c_p] = CacheData(data=data, timeout=int(time()) + timeout)
+                return data
+
+            def start(c_p: str, *args, **kwargs) -> asyncio.Task:
+                if c_p not in _pending:
+                    task = asyncio.ensure_future(compute(c_p, *args, **kwargs))
+                    _pending[c_p] = task
+                    task.add_done_callback(lambda _: _pending.pop(c_p, None))
+                return _pending[c_p]
+
             async def wrapper(*args, **kwargs) -> T:
                 c_p = cache_path(*args, **kwargs)
                 try:
-                    cache_data = _memcache[c_p]
-                    if cache_data.timeout > time():
-                        return cache_data.data
-                    else:
-                        raise Exception('Cache expired')
+                    data, fresh = lookup(c_p)
+                    if not fresh and c_p not in _pending:
+                        start(c_p, *args, **kwargs).add_done_callback(
+                            lambda t: log_refresh_failure(c_p, None if t.cancelled() else t.exception()))
+                    return data
                 except Exception:
-                    data = await f(*args, **kwargs)
-                    _memcache[c_p] = CacheData(data=data, timeout=int(time()) + timeout)
+                    if not single_flight:
+                        return await compute(c_p, *args, **kwargs)
+                    # Shield so that a cancelled caller doesn't cancel the computation for everyone else.
+                    return await asyncio.shield(start(c_p, *args, **kwargs))
+
+            def sync_compute(c_p: str, *args, **kwargs) -> T:
+                data = f(*args, **kwargs)
+                _memcache[c_p] = CacheData(data=data, timeout=int(time()) + timeout)
+                return data
+
+            def sync_lead(flight: Future, c_p: str, *args, **kwargs) -> T:
+                try:
+                    data = sync_compute(c_p, *args, **kwargs)
+                    flight.set_result(data)
                     return data
+                except Exception as e:
+                    flight.set_exception(e)
+                    raise
+                finally:
+                    with _sync_lock:
+                        _sync_pending.pop(c_p, None)
+
+            def sync_refresh(flight: Future, c_p: str, *args, **kwargs):
+                try:
+                    sync_lead(flight, c_p, *args, **kwargs)
+                except Exception as e:
+                    log_refresh_failure(c_p, e)
 
             def sync_wrapper(*args, **kwargs) -> T:
                 c_p = cache_path(*args, **kwargs)
                 try:
-                    cache_data = _memcache[c_p]
-                    if cache_data.timeout > time():
-                        return cache_data.data
-                    else:
-                        raise Exception('Cache expired')
-                except Exception:
-                    data = f(*args, **kwargs)
-                    _memcache[c_p] = CacheData(data=data, timeout=int(time()) + timeout)
+                    data, fresh = lookup(c_p)
+                    if not fresh:
+                        # Without a running loop there is nowhere to refresh in the background, so treat it as a miss.
+                        loop = asyncio.get_running_loop()
+                        with _sync_lock:
+                            if c_p not in _sync_pending:
+                                flight = _sync_pending[c_p] = Future()
+                                loop.run_in_executor(None, lambda: sync_refresh(flight, c_p, *args, **kwargs))
                     return data
+                except Exception:
+                    if not single_flight:
+                        return sync_compute(c_p, *args, **kwargs)
+                    with _sync_lock:
+                        flight = _sync_pending.get(c_p)
+                        leader = flight is None
+                        if leader:
+                            flight = _sync_pending[c_p] = Future()
+                    if not leader:
+                        return flight.result()
+                    return sync_lead(flight, c_p, *args, **kwargs)
+
+            def invalidate(*args, **kwargs):
+                c_p = cache_path(*args, **kwargs)
+                if isinstance(_memcache, CacheNamespace):
+                    _memcache.invalidate(c_p)
+                else:
+                    _memcache.pop(c_p, None)
+
+            def peek(*args, **kwargs) -> Optional[T]:
+                """The cached data if it is fresh, None otherwise. Never computes anything."""
+                try:
+                    data, fresh = lookup(cache_path(*args, **kwargs))
+                except Exception:
+                    return None
+                return data if fresh else None
+
+            def prime(data: T, *args, **kwargs):
+                _memcache[cache_path(*args, **kwargs)] = CacheData(data=data, timeout=int(time()) + timeout)
 
-            return wrapper if asyncio.iscoroutinefunction(f) else sync_wrapper
+            cached = wrapper if asyncio.iscoroutinefunction(f) else sync_wrapper
+            cached.invalidate = invalidate
+            cached.peek = peek
+            cached.prime = prime
+            return cached
         return wrapper2
@@ -1,9 +1,27 @@
 import json
-from typing import Dict, Sequence
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
 
 
 class BriqData:
-    briqs: Sequence
+    """
+    Geometry of a set, stored column-wise so that exporters can work on whole arrays:
+    - positions: int32, shape (n, 3)
+    - colors: uint32, as 0xRRGGBB
+    - materials: the material as an integer (e.g. 0x1), uint16 unless some don't fit
+    - any_color: bool, whether the briq is an 'any color' placeholder (for booklets)
+    """
+    positions: np.ndarray
+    colors: np.ndarray
+    materials: np.ndarray
+    any_color: np.ndarray
+
+    def __init__(self):
+        self.load_briqs([])
+
+    def __len__(self):
+        return len(self.positions)
 
     def load_file(self, filename):
         filedata = None
@@ -13,19 +31,89 @@ class BriqData:
         return self
 
     def load(self, jsonData: Dict):
-        self.briqs = jsonData['briqs']
+        return self.load_briqs(jsonData['briqs'])
+
+    def load_briqs(self, briqs: Sequence):
+        """
+        Load from the list of {"pos": [x, y, z], "data": {"color": "#rrggbb", "material": "0x1"}}
+        used by set metadata and decoded transactions.
+        """
+        positions = np.array([briq['pos'] for briq in briqs], dtype=np.int32).reshape(-1, 3)
+        rgb = np.frombuffer(bytes.fromhex(''.join(briq['data']['color'][1:7] for briq in briqs)), dtype=np.uint8).reshape(-1, 3)
+        colors = (rgb.astype(np.uint32) << np.array([16, 8, 0], dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+        names, materials = np.unique(np.array([briq['data']['material'] for briq in briqs], dtype=str), return_inverse=True)
+        values = [int(name, 16) for name in names]
+        dtype = np.uint16 if max(values, default=0) <= np.iinfo(np.uint16).max else np.uint64
+        any_color = np.array(['any_color' in briq['data'] for briq in briqs], dtype=bool)
+        return self.load_arrays(positions, colors, np.array(values, dtype=dtype)[materials.reshape(-1)], any_color)
+
+    def load_arrays(self, positions: np.ndarray, colors: np.ndarray, materials: np.ndarray, any_color: Optional[np.ndarray] = None):
+        self.positions = np.asarray(positions, dtype=np.int32).reshape(-1, 3)
+        self.colors = np.asarray(colors, dtype=np.uint32)
+        self.materials = np.asarray(materials)
+        self.any_color = np.zeros(len(self.positions), dtype=bool) if any_color is None else np.asarray(any_color, dtype=bool)
         return self
 
+    def select(self, which: Union[np.ndarray, slice]) -> 'BriqData':
+        """The subset of briqs given by a mask or indices."""
+        return BriqData().load_arrays(self.positions[which], self.colors[which], self.materials[which], self.any_color[which])
+
+    def color_strings(self) -> list[str]:
+        return [f'#{color:06x}' for color in self.colors.tolist()]
+
+    def material_strings(self) -> list[str]:
+        return [hex(material) for material in self.materials.tolist()]
+
+    @property
+    def briqs(self) -> list[dict]:
+        """Back to the list of dicts format (colors come out lowercase)."""
+        return [
+            {'pos': pos, 'data': {'color': color, 'material': material, **({'any_color': True} if any_color else {})}}
+            for pos, color, material, any_color in zip(
+                self.positions.tolist(), self.color_strings(), self.material_strings(), self.any_color.tolist()
+            )
+        ]
+
+    @briqs.setter
+    def briqs(self, briqs: Sequence):
+        self.load_briqs(briqs)
+
     def to_vox(self, filename: str):
         from .vox import to_vox
         writer = to_vox(self)
         writer.filename = filename
         return writer
 
-    def to_gltf(self, separate_any_color: bool = False):
+    def to_gltf(self, separate_any_color: bool = False, greedy: bool = False, cull_hidden: bool = True, quantize: bool = False):
+        """
+        greedy merges coplanar faces into larger rectangles, which makes for much smaller files
+        (at the cost of T-junctions in the mesh).
+        cull_hidden removes faces hidden by neighbouring opaque briqs of any colour.
+        quantize stores positions as int16, which requires viewers to support KHR_mesh_quantization.
+        """
         from .gltf import to_gltf
-        return to_gltf(self.briqs, separate_any_color)
+        return to_gltf(self, separate_any_color, greedy, cull_hidden, quantize)
+
+    def to_glb(self, separate_any_color: bool = False, greedy: bool = False, cull_hidden: bool = True, quantize: bool = False) -> bytes:
+        """Same as to_gltf, as the bytes of a GLB file."""
+        from .gltf import to_glb
+        return to_glb(self, separate_any_color, greedy, cull_hidden, quantize)
+
+    def to_lod_glb(self, level: int, quantize: bool = False) -> bytes:
+        """A coarser version of the model, see briq_api.mesh.lod."""
+        from .lod import to_lod_glb
+        return to_lod_glb(self, level, quantize)
 
     def to_png(self):
         from .png import to_png
-        return to_png(self.briqs)
+        return to_png(self)
+
+    def to_preview(self, max_size: int = 1024):
+        """Shaded isometric view of the set, much nicer than the flat projection of to_png."""
+        from .isometric import to_isometric_image
+        return to_isometric_image(self, max_size)
+
+
+def as_briq_data(briqs: Union[BriqData, Sequence]) -> BriqData:
+    """Exporters take either a BriqData or the list of dicts format."""
+    return briqs if isinstance(briqs, BriqData) else BriqData().load_briqs(briqs)
@@ -1,9 +1,13 @@
-from typing import List, Sequence, Tuple
+import json
+import struct
+from typing import Optional, Sequence, Union
 import numpy as np
 import pygltflib
 
 from dataclasses import dataclass
 
+from .briq import BriqData, as_briq_data
+
 
 @dataclass
 class Material:
@@ -14,99 +18,297 @@ class Material:
 
 @dataclass
 class Primitive:
-    points: List[Tuple[float, float, float]]
-    triangles: List[Tuple[int, int, int]]
+    points: np.ndarray  # float, shape (n, 3)
+    triangles: np.ndarray  # int, shape (n, 3)
     material: Material
 
-def parse_material(mat, col, byMaterial, primitives):
-    outPoints = []
-    outTriangles = []
-    SIZE = 0.5
-    for (index, briqPos) in enumerate(byMaterial[mat][col]):
-        # Bottom: 0 1 5 4
-        # Top: 2 3 7 6
-        outPoints.append([briqPos[0] - SIZE, briqPos[1] - SIZE, briqPos[2] - SIZE])
-        outPoints.append([briqPos[0] - SIZE, briqPos[1] - SIZE, briqPos[2] + SIZE])
-        outPoints.append([briqPos[0] - SIZE, briqPos[1] + SIZE, briqPos[2] - SIZE])
-        outPoints.append([briqPos[0] - SIZE, briqPos[1] + SIZE, briqPos[2] + SIZE])
-        outPoints.append([briqPos[0] + SIZE, briqPos[1] - SIZE, briqPos[2] - SIZE])
-        outPoints.append([briqPos[0] + SIZE, briqPos[1] - SIZE, briqPos[2] + SIZE])
-        outPoints.append([briqPos[0] + SIZE, briqPos[1] + SIZE, briqPos[2] - SIZE])
-        outPoints.append([briqPos[0] + SIZE, briqPos[1] + SIZE, briqPos[2] + SIZE])
-
-        outTriangles.append([index * 8 + 0, index * 8 + 1, index * 8 + 2])
-        outTriangles.append([index * 8 + 2, index * 8 + 1, index * 8 + 3])
-
-        outTriangles.append([index * 8 + 2, index * 8 + 4, index * 8 + 0])
-        outTriangles.append([index * 8 + 6, index * 8 + 4, index * 8 + 2])
-
-        outTriangles.append([index * 8 + 1, index * 8 + 0, index * 8 + 5])
-        outTriangles.append([index * 8 + 5, index * 8 + 0, index * 8 + 4])
-
-        outTriangles.append([index * 8 + 2, index * 8 + 3, index * 8 + 7])
-        outTriangles.append([index * 8 + 2, index * 8 + 7, index * 8 + 6])
-
-        outTriangles.append([index * 8 + 7, index * 8 + 3, index * 8 + 5])
-        outTriangles.append([index * 8 + 5, index * 8 + 3, index * 8 + 1])
-
-        outTriangles.append([index * 8 + 6, index * 8 + 7, index * 8 + 5])
-        outTriangles.append([index * 8 + 4, index * 8 + 6, index * 8 + 5])
+
+SIZE = 0.5
+
+# Corners of a briq, as offsets from its center.
+# Bottom: 0 1 5 4
+# Top: 2 3 7 6
+CUBE_CORNERS = np.array([
+    [-SIZE, -SIZE, -SIZE],
+    [-SIZE, -SIZE, +SIZE],
+    [-SIZE, +SIZE, -SIZE],
+    [-SIZE, +SIZE, +SIZE],
+    [+SIZE, -SIZE, -SIZE],
+    [+SIZE, -SIZE, +SIZE],
+    [+SIZE, +SIZE, -SIZE],
+    [+SIZE, +SIZE, +SIZE],
+])
+
+CUBE_TRIANGLES = np.array([
+    [0, 1, 2], [2, 1, 3],
+    [2, 4, 0], [6, 4, 2],
+    [1, 0, 5], [5, 0, 4],
+    [2, 3, 7], [2, 7, 6],
+    [7, 3, 5], [5, 3, 1],
+    [6, 7, 5], [4, 6, 5],
+])
+
+
+# Outward normal of each pair of triangles in CUBE_TRIANGLES.
+FACE_DIRECTIONS = np.array([
+    [-1, 0, 0],
+    [0, 0, -1],
+    [0, -1, 0],
+    [0, 1, 0],
+    [0, 0, 1],
+    [1, 0, 0],
+])
+
+# Briqs of these materials can be seen through, so they don't hide their neighbours' faces.
+TRANSPARENT_MATERIALS = {"0x3"}
+
+# Two triangles of a quad whose corners go counter-clockwise around its normal.
+QUAD_TRIANGLES = np.array([[0, 1, 2], [0, 2, 3]])
+
+
+def _pack_rows(rows: np.ndarray):
+    """
+    Turn each row of a 2D integer array into a single int64 with the same ordering, so np.unique can work on 1D.
+    Returns None if the values span too large a range to fit.
+    """
+    low = rows.min(axis=0)
+    spans = rows.max(axis=0) - low + 1
+    if np.prod(spans.astype(float)) >= 2 ** 62:
+        return None
+    keys = np.zeros(len(rows), dtype=np.int64)
+    for column in range(rows.shape[1]):
+        keys = keys * int(spans[column]) + (rows[:, column] - low[column])
+    return keys
+
+
+def _unique_rows(rows: np.ndarray, integer: bool, **kwargs):
+    keys = _pack_rows(rows.astype(np.int64)) if integer else None
+    if keys is None:
+        return np.unique(rows, axis=0, **kwargs)
+    return np.unique(keys, **kwargs)
+
+
+class Occupancy:
+    """Set of occupied integer cells, for vectorized lookups of neighbours."""
+
+    def __init__(self, cells: np.ndarray):
+        # Pad by one so that all neighbours of a cell fall in the packed range.
+        self.low = cells.min(axis=0) - 1
+        self.spans = cells.max(axis=0) - self.low + 2
+        self.keys = np.unique(self.pack(cells))
+
+    @staticmethod
+    def of(cells: np.ndarray) -> Optional["Occupancy"]:
+        """None if the cells span too large a range to be packed in an int64."""
+        if not len(cells) or np.prod((cells.max(axis=0) - cells.min(axis=0) + 3).astype(float)) >= 2 ** 62:
+            return None
+        return Occupancy(cells)
+
+    def pack(self, cells: np.ndarray):
+        # Cells outside the box end up in the padding, which is empty.
+        cells = np.clip(cells - self.low, 0, self.spans - 1)
+        return (cells[:, 0] * self.spans[1] + cells[:, 1]) * self.spans[2] + cells[:, 2]
+
+    def contains(self, cells: np.ndarray):
+        return np.isin(self.pack(cells), self.keys)
+
+
+def _opaque_occupancy(byMaterial, occluders: Optional[BriqData] = None) -> Optional[Occupancy]:
+    """Cells of all briqs that hide what's behind them, whatever their colour."""
+    groups = [
+        np.asarray(byMaterial[mat][col], dtype=np.float64).reshape(-1, 3)
+        for mat in byMaterial if mat.split('_')[0] not in TRANSPARENT_MATERIALS for col in byMaterial[mat]
+    ]
+    if occluders is not None:
+        transparent = np.isin(occluders.materials, [int(mat, 16) for mat in TRANSPARENT_MATERIALS])
+        groups.append(np.asarray(occluders.positions[~transparent], dtype=np.float64).reshape(-1, 3))
+    if not groups:
+        return None
+    positions = np.concatenate(groups)
+    # Briqs off the grid don't cover any face exactly, let them be.
+    positions = positions[np.all(positions == np.round(positions), axis=1)]
+    return Occupancy.of(positions.astype(np.int64))
+
+
+def _drop_unused_points(points: np.ndarray, triangles: np.ndarray):
+    used = np.zeros(len(points), dtype=bool)
+    used[triangles] = True
+    remap = np.cumsum(used) - 1
+    return points[used], remap[triangles]
+
+
+def _merge_points(points: np.ndarray, triangles: np.ndarray):
+    """Merge identical points, keeping them in order of first appearance."""
+    # Briqs sit on integer coordinates, so corners are integers once doubled and we can dedup on that.
+    doubled = points * 2
+    _, firstIdx, matchIdx = _unique_rows(doubled, bool(np.all(doubled == np.round(doubled))), return_index=True, return_inverse=True)
+    # np.unique sorts, but points are expected in order of first appearance.
+    order = np.argsort(firstIdx)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return points[firstIdx[order]], rank[matchIdx.reshape(-1)][triangles]
+
+
+def parse_material(mat, col, byMaterial, primitives, opaque: Optional[Occupancy] = None):
+    positions = np.asarray(byMaterial[mat][col], dtype=np.float64)
+    outPoints = (positions[:, None, :] + CUBE_CORNERS[None, :, :]).reshape(-1, 3)
+    outTriangles = ((np.arange(len(positions)) * 8)[:, None, None] + CUBE_TRIANGLES[None, :, :]).reshape(-1, 3)
+
+    if opaque is not None and np.all(positions == np.round(positions)):
+        # Faces against an opaque briq are hidden, whatever the colour of either.
+        neighbours = (positions.astype(np.int64)[:, None, :] + FACE_DIRECTIONS[None, :, :]).reshape(-1, 3)
+        outTriangles = outTriangles[np.repeat(~opaque.contains(neighbours), 2)]
+        if not len(outTriangles):
+            # Entirely buried.
+            return
+
     # Mesh optimisation (NB: this algorithm is rather dumb)
     # - First remove identical points
     # - Then any face that's in the mesh twice must be an 'inner' face, and we can remove it.
-    # NB: because I'm using different primitives for each color, different colors will keep full cubes,
-    # which seems fine enough.
-    firstIdx = {}
-    matchIdx = {}
-    actualPoints = []
-    for i, point in enumerate(outPoints):
-        pt = '_'.join([str(p) for p in point])
-        if pt not in firstIdx:
-            firstIdx[pt] = len(actualPoints)
-            actualPoints.append(point)
-        matchIdx[i] = firstIdx[pt]
-    outTriangles = [tuple([matchIdx[t] for t in triangle]) for triangle in outTriangles]
-    outPoints = actualPoints
-
-    matcha = {}
-    for triangle in outTriangles:
-        pt = '_'.join([str(i) for i in sorted(triangle)])
-        if pt not in matcha:
-            matcha[pt] = 0
-        matcha[pt] += 1
-    out = []
-    for triangle in outTriangles:
-        pt = '_'.join([str(i) for i in sorted(triangle)])
-        if matcha[pt] == 1:
-            out.append(triangle)
-    outTriangles = out
+    # NB: because I'm using different primitives for each color, only the opaque culling above
+    # removes faces between different colors (glass keeps its faces against other glass colors).
+    outPoints, outTriangles = _merge_points(outPoints, outTriangles)
+
+    _, faceIdx, faceCounts = _unique_rows(np.sort(outTriangles, axis=1), True, return_inverse=True, return_counts=True)
+    outTriangles = outTriangles[faceCounts[faceIdx.reshape(-1)] == 1]
+    if opaque is not None:
+        outPoints, outTriangles = _drop_unused_points(outPoints, outTriangles)
+
+    primitives.append(Primitive(outPoints, outTriangles, Material(f"{mat}_{col}", mat.split('_')[0], col.split('_')[0])))
+
+
+def _starts(*columns: np.ndarray, consecutive: np.ndarray):
+    """Where a new run begins in sorted data: any of the columns changes, or the last one isn't consecutive."""
+    starts = np.ones(len(consecutive), dtype=bool)
+    starts[1:] = np.diff(consecutive) != 1
+    for column in columns:
+        starts[1:] |= column[1:] != column[:-1]
+    return starts
+
+
+def greedy_mesh_material(mat, col, byMaterial, primitives, opaque: Optional[Occupancy] = None):
+    """
+    Same as parse_material, but coplanar visible faces are merged into rectangles,
+    which uses far fewer points and triangles on anything with flat surfaces.
+    """
+    positions = np.asarray(byMaterial[mat][col], dtype=np.float64)
+    occupied = Occupancy.of(positions.astype(np.int64)) if np.all(positions == np.round(positions)) else None
+    if occupied is None:
+        return parse_material(mat, col, byMaterial, primitives, opaque)
+    cells = np.unique(positions.astype(np.int64), axis=0)
+
+    quads = []
+    for axis in range(3):
+        # (axis, u, v) is a cyclic permutation, so e_u x e_v points along +axis.
+        u, v = (axis + 1) % 3, (axis + 2) % 3
+        for direction in (-1, 1):
+            neighbours = cells.copy()
+            neighbours[:, axis] += direction
+            hidden = occupied.contains(neighbours)
+            if opaque is not None:
+                hidden |= opaque.contains(neighbours)
+            faces = cells[~hidden]
+            if not len(faces):
+                continue
+            layer, fu, fv = faces[:, axis], faces[:, u], faces[:, v]
+            # Merge faces into runs along u...
+            order = np.lexsort((fu, fv, layer))
+            layer, fu, fv = layer[order], fu[order], fv[order]
+            run_starts = np.flatnonzero(_starts(layer, fv, consecutive=fu))
+            run_ends = np.append(run_starts[1:], len(fu)) - 1
+            layer, fv, u0, u1 = layer[run_starts], fv[run_starts], fu[run_starts], fu[run_ends]
+            # ...then stack identical runs of consecutive rows along v.
+            order = np.lexsort((fv, u1, u0, layer))
+            layer, fv, u0, u1 = layer[order], fv[order], u0[order], u1[order]
+            rect_starts = np.flatnonzero(_starts(layer, u0, u1, consecutive=fv))
+            rect_ends = np.append(rect_starts[1:], len(fv)) - 1
+            layer, u0, u1, v0, v1 = layer[rect_starts], u0[rect_starts], u1[rect_starts], fv[rect_starts], fv[rect_ends]
+
+            corners = np.empty((len(layer), 4, 3))
+            corners[:, :, axis] = (layer + direction * SIZE)[:, None]
+            corners[:, :, u] = np.stack([u0 - SIZE, u1 + SIZE, u1 + SIZE, u0 - SIZE], axis=1)
+            corners[:, :, v] = np.stack([v0 - SIZE, v0 - SIZE, v1 + SIZE, v1 + SIZE], axis=1)
+            quads.append((corners, direction))
+
+    if not quads:
+        # Entirely buried.
+        return
+    outPoints = np.concatenate([corners.reshape(-1, 3) for corners, _ in quads])
+    outTriangles = []
+    offset = 0
+    for corners, direction in quads:
+        base = offset + np.arange(len(corners))[:, None] * 4
+        quad_triangles = QUAD_TRIANGLES if direction > 0 else QUAD_TRIANGLES[:, ::-1]
+        outTriangles.append((base[:, None, :] + quad_triangles[None, :, :]).reshape(-1, 3))
+        offset += len(corners) * 4
+    outPoints, outTriangles = _merge_points(outPoints, np.concatenate(outTriangles))
 
     primitives.append(Primitive(outPoints, outTriangles, Material(f"{mat}_{col}", mat.split('_')[0], col.split('_')[0])))
 
 
-def to_primitives(briqs: Sequence, separate_any_color: bool = False):
+def to_primitives(
+    briqs: Union[BriqData, Sequence], separate_any_color: bool = False, greedy: bool = False, cull_hidden: bool = True,
+    occluders: Optional[BriqData] = None
+):
+    """
+    cull_hidden removes faces covered by an opaque briq of any material or colour,
+    otherwise only faces between briqs of the same material and colour are.
+    occluders are briqs that aren't part of the mesh but still hide faces (with cull_hidden), e.g. the level below.
+    """
+    data = as_briq_data(briqs)
+    anyColor = data.any_color.astype(np.int64) if separate_any_color else np.zeros(len(data), dtype=np.int64)
+    _, materialIdx = np.unique(data.materials, return_inverse=True)
+    materialKeys = materialIdx.reshape(-1) * 2 + anyColor
+    groupKeys = (materialKeys << 25) + (data.colors.astype(np.int64) << 1) + anyColor
+
+    # Group by material then color, both in order of first appearance.
+    uniqueMaterials, materialFirst = np.unique(materialKeys, return_index=True)
+    _, groupFirst, groupIdx = np.unique(groupKeys, return_index=True, return_inverse=True)
+    groupOrder = np.lexsort((groupFirst, materialFirst[np.searchsorted(uniqueMaterials, materialKeys[groupFirst])]))
+    briqOrder = np.argsort(groupIdx.reshape(-1), kind='stable')
+    groupPositions = np.split(data.positions[briqOrder], np.cumsum(np.bincount(groupIdx.reshape(-1)))[:-1])
+
     byMaterial = {}
+    for group in groupOrder:
+        briq = groupFirst[group]
+        suffix = '_any' if anyColor[briq] else ''
+        material = hex(int(data.materials[briq])) + suffix
+        color = f'#{int(data.colors[briq]):06x}' + suffix
+        byMaterial.setdefault(material, {})[color] = groupPositions[group]
 
-    for briq in briqs:
-        material = briq['data']['material']
-        color = briq['data']['color']
-        if separate_any_color and 'any_color' in briq['data']:
-            material = material + '_any'
-            color = color + '_any'
-        if material not in byMaterial:
-            byMaterial[material] = {color: []}
-        if color not in byMaterial[material]:
-            byMaterial[material][color] = []
-        byMaterial[material][color].append(briq['pos'])
+    opaque = _opaque_occupancy(byMaterial, occluders) if cull_hidden else None
 
     primitives = []
     for mat in byMaterial:
         for col in byMaterial[mat]:
-            parse_material(mat, col, byMaterial, primitives)
+            if greedy:
+                greedy_mesh_material(mat, col, byMaterial, primitives, opaque)
+            else:
+                parse_material(mat, col, byMaterial, primitives, opaque)
 
     return primitives
 
 
+def merge_primitives(primitiveLists: Sequence[Sequence[Primitive]]) -> list[Primitive]:
+    """
+    Concatenate meshes of the same material & colour, e.g. to put together separately meshed parts of a set.
+    Faces between the parts aren't removed.
+    """
+    byName: dict[str, list[Primitive]] = {}
+    for primitives in primitiveLists:
+        for prim in primitives:
+            byName.setdefault(prim.material.name, []).append(prim)
+    merged = []
+    for prims in byName.values():
+        offsets = np.cumsum([0] + [len(prim.points) for prim in prims[:-1]])
+        merged.append(Primitive(
+            np.concatenate([prim.points for prim in prims]),
+            np.concatenate([prim.triangles + offset for prim, offset in zip(prims, offsets)]),
+            prims[0].material,
+        ))
+    return merged
+
+
 def srgb2lin(s):
     """GLTF uses linear-space vertex colors, which won't give the result we want."""
     if s <= 0.0404482362771082:
@@ -116,105 +318,175 @@ def srgb2lin(s):
     return lin
 
 
-def to_gltf(briqs: Sequence, separate_any_color: bool = False):
-    prims = to_primitives(briqs, separate_any_color)
+def _material(material: Material) -> dict:
+    rgbaCol = [srgb2lin(int(material.color[i:i + 2], 16) / 255) for i in (1, 3, 5)]
+    if material.material == "0x3":
+        return {
+            "name": material.name,
+            "pbrMetallicRoughness": {"baseColorFactor": rgbaCol + [0.7], "metallicFactor": 0.5, "roughnessFactor": 0.1},
+            "alphaMode": "BLEND",
+        }
+    elif material.material == "0x4":
+        return {
+            "name": material.name,
+            "pbrMetallicRoughness": {"baseColorFactor": rgbaCol + [1.0], "metallicFactor": 0.5, "roughnessFactor": 0.15},
+        }
+    elif material.material == "0x5":
+        return {
+            "name": material.name,
+            "pbrMetallicRoughness": {"baseColorFactor": rgbaCol + [1.0], "metallicFactor": 0.0, "roughnessFactor": 0.05},
+            "emissiveFactor": rgbaCol,
+        }
+    return {
+        "name": material.name,
+        "pbrMetallicRoughness": {"baseColorFactor": rgbaCol + [1], "metallicFactor": 0.0, "roughnessFactor": 0.2},
+    }
+
+
+# Node scale when quantizing: positions are stored doubled so that briq corners are integers.
+QUANTIZATION_SCALE = SIZE
+
+
+def _indices(triangles: np.ndarray, count: int):
+    """Indices in the smallest type that can hold them."""
+    if count <= np.iinfo(np.uint16).max:
+        return np.ascontiguousarray(triangles, dtype=np.uint16).reshape(-1), pygltflib.UNSIGNED_SHORT
+    return np.ascontiguousarray(triangles, dtype=np.uint32).reshape(-1), pygltflib.UNSIGNED_INT
+
+
+def _positions(points: np.ndarray, quantize: bool):
+    """
+    Positions and their accessor fields. When quantizing, they are scaled by 1 / QUANTIZATION_SCALE,
+    and stored as int16 (KHR_mesh_quantization) if they fit.
+    """
+    if not quantize:
+        points = np.ascontiguousarray(points, dtype=np.float32)
+        return points, {"componentType": pygltflib.FLOAT}, points.max(axis=0).tolist(), points.min(axis=0).tolist()
+    scaled = points / QUANTIZATION_SCALE
+    limits = np.iinfo(np.int16)
+    if not len(scaled) or not np.all(scaled == np.round(scaled)) or scaled.min() < limits.min or scaled.max() > limits.max:
+        return _positions(scaled, False)
+    # Vertex attributes must be 4-byte aligned, so pad each vertex to 4 components.
+    padded = np.zeros((len(scaled), 4), dtype=np.int16)
+    padded[:, :3] = scaled
+    fields = {"componentType": pygltflib.SHORT, "byteStride": padded.itemsize * 4}
+    return padded, fields, padded[:, :3].max(axis=0).tolist(), padded[:, :3].min(axis=0).tolist()
 
+
+def _assemble(prims: Sequence[Primitive], quantize: bool = False):
+    """
+    Returns the glTF JSON for the primitives, and the arrays making up the binary buffer, in order.
+    Sizes are all known upfront, so the buffer can be written in one go without concatenating.
+    """
     primitives = []
     accessors = []
     bufferViews = []
-    materials = []
-
-    blobs = b""
+    chunks = []
     totalBufferOffset = 0
+    quantized = False
+
+    def add_view(array: np.ndarray, target: int, byteStride: Optional[int] = None):
+        nonlocal totalBufferOffset
+        bufferViews.append({"buffer": 0, "byteOffset": totalBufferOffset, "byteLength": array.nbytes, "target": target})
+        if byteStride is not None:
+            bufferViews[-1]["byteStride"] = byteStride
+        chunks.append(array)
+        totalBufferOffset += array.nbytes
+        # Keep the next view aligned for any component type.
+        if totalBufferOffset % 4:
+            chunks.append(np.zeros(-totalBufferOffset % 4, dtype=np.uint8))
+            totalBufferOffset += chunks[-1].nbytes
 
     for (i, primitive) in enumerate(prims):
+        triangles, indexType = _indices(primitive.triangles, len(primitive.points))
+        points, fields, pointsMax, pointsMin = _positions(primitive.points, quantize)
+        quantized |= fields["componentType"] == pygltflib.SHORT
+        primitives.append({"attributes": {"POSITION": i * 2 + 1}, "indices": i * 2, "material": i})
+        accessors.append({
+            "bufferView": i * 2,
+            "componentType": indexType,
+            "count": triangles.size,
+            "type": pygltflib.SCALAR,
+            "max": [int(triangles.max())],
+            "min": [int(triangles.min())],
+        })
+        accessors.append({
+            "bufferView": i * 2 + 1,
+            "componentType": fields["componentType"],
+            "count": len(points),
+            "type": pygltflib.VEC3,
+            "max": pointsMax,
+            "min": pointsMin,
+        })
+        add_view(triangles, pygltflib.ELEMENT_ARRAY_BUFFER)
+        add_view(points, pygltflib.ARRAY_BUFFER, fields.get("byteStride"))
 
-        rgbaCol = [srgb2lin(int(primitive.material.color[i:i + 2], 16) / 255) for i in (1, 3, 5)]
-        if primitive.material.material == "0x3":
-            materials.append(pygltflib.Material(
-                name=primitive.material.name,
-                pbrMetallicRoughness=pygltflib.PbrMetallicRoughness(baseColorFactor=rgbaCol + [0.7], metallicFactor=0.5, roughnessFactor=0.1),
-                alphaMode="BLEND",
-            ))
-        elif primitive.material.material == "0x4":
-            materials.append(pygltflib.Material(
-                name=primitive.material.name,
-                pbrMetallicRoughness=pygltflib.PbrMetallicRoughness(
-                    baseColorFactor=rgbaCol + [1.0],
-                    metallicFactor=0.5,
-                    roughnessFactor=0.15,
-                ),
-            ))
-        elif primitive.material.material == "0x5":
-            materials.append(pygltflib.Material(
-                name=primitive.material.name,
-                pbrMetallicRoughness=pygltflib.PbrMetallicRoughness(
-                    baseColorFactor=rgbaCol + [1.0],
-                    metallicFactor=0.0, roughnessFactor=0.05
-                ),
-                emissiveFactor=rgbaCol,
-            ))
-        else:
-            materials.append(pygltflib.Material(
-                name=primitive.material.name,
-                pbrMetallicRoughness=pygltflib.PbrMetallicRoughness(baseColorFactor=rgbaCol + [1], metallicFactor=0.0, roughnessFactor=0.2),
-                alphaCutoff=None,
-            ))
-
-        points = np.array(primitive.points, dtype="float32")
-        triangles = np.array(primitive.triangles, dtype="uint32")
-        triangles_binary_blob = triangles.flatten().tobytes()
-        points_binary_blob = points.tobytes()
-        primitives.append(pygltflib.Primitive(
-            attributes=pygltflib.Attributes(POSITION=i * 2 + 1),
-            indices=i * 2,
-            material=i
-        ))
-        accessors.append(pygltflib.Accessor(
-            bufferView=i * 2,
-            componentType=pygltflib.UNSIGNED_INT,
-            count=triangles.size,
-            type=pygltflib.SCALAR,
-            max=[int(triangles.max())],
-            min=[int(triangles.min())],
-        ))
-        accessors.append(pygltflib.Accessor(
-            bufferView=i * 2 + 1,
-            componentType=pygltflib.FLOAT,
-            count=len(points),
-            type=pygltflib.VEC3,
-            max=points.max(axis=0).tolist(),
-            min=points.min(axis=0).tolist(),
-        ))
-        bufferViews.append(pygltflib.BufferView(
-            buffer=0,
-            byteOffset=totalBufferOffset,
-            byteLength=len(triangles_binary_blob),
-            target=pygltflib.ELEMENT_ARRAY_BUFFER,
-        ))
-        totalBufferOffset += len(triangles_binary_blob)
-        bufferViews.append(pygltflib.BufferView(
-            buffer=0,
-            byteOffset=totalBufferOffset,
-            byteLength=len(points_binary_blob),
-            target=pygltflib.ARRAY_BUFFER,
-        ))
-        totalBufferOffset += len(points_binary_blob)
-        blobs += triangles_binary_blob + points_binary_blob
-
-    gltf = pygltflib.GLTF2(
-        scene=0,
-        scenes=[pygltflib.Scene(nodes=[0])],
-        nodes=[pygltflib.Node(mesh=0)],
-        meshes=[pygltflib.Mesh(primitives=primitives)],
-        materials=materials,
-        accessors=accessors,
-        bufferViews=bufferViews,
-        buffers=[
-            pygltflib.Buffer(
-                byteLength=totalBufferOffset
-            )
-        ],
-    )
-    gltf.set_binary_blob(blobs)
-    return gltf
+    gltf = {
+        "asset": {"version": "2.0"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0, "scale": [QUANTIZATION_SCALE] * 3} if quantize else {"mesh": 0}],
+        "meshes": [{"primitives": primitives}],
+        "materials": [_material(primitive.material) for primitive in prims],
+        "accessors": accessors,
+        "bufferViews": bufferViews,
+    }
+    if quantized:
+        gltf["extensionsUsed"] = gltf["extensionsRequired"] = ["KHR_mesh_quantization"]
+    if totalBufferOffset:
+        gltf["buffers"] = [{"byteLength": totalBufferOffset}]
+    return gltf, chunks
+
+
+def _write_chunks(out: bytearray, offset: int, chunks: Sequence[np.ndarray]):
+    view = memoryview(out)
+    for chunk in chunks:
+        view[offset:offset + chunk.nbytes] = memoryview(chunk).cast('B')
+        offset += chunk.nbytes
+
+
+def to_gltf(
+    briqs: Union[BriqData, Sequence], separate_any_color: bool = False, greedy: bool = False,
+    cull_hidden: bool = True, quantize: bool = False
+):
+    """
+    quantize stores positions as int16 (KHR_mesh_quantization), which needs support from the viewer
+    but makes for much smaller files.
+    """
+    gltf, chunks = _assemble(to_primitives(briqs, separate_any_color, greedy, cull_hidden), quantize)
+    blob = bytearray(sum(chunk.nbytes for chunk in chunks))
+    _write_chunks(blob, 0, chunks)
+    out = pygltflib.GLTF2.from_dict(gltf)
+    out.set_binary_blob(bytes(blob))
+    return out
+
+
+def to_glb(
+    briqs: Union[BriqData, Sequence], separate_any_color: bool = False, greedy: bool = False,
+    cull_hidden: bool = True, quantize: bool = False
+) -> bytes:
+    """
+    Same as to_gltf, but writes the GLB file directly, which skips building pygltflib objects
+    and copying the buffer around when serializing them.
+    """
+    return primitives_to_glb(to_primitives(briqs, separate_any_color, greedy, cull_hidden), quantize)
+
+
+def primitives_to_glb(prims: Sequence[Primitive], quantize: bool = False) -> bytes:
+    gltf, chunks = _assemble(prims, quantize)
+    jsonChunk = json.dumps(gltf, separators=(',', ':')).encode()
+    # Chunks are 4-byte aligned, JSON is padded with spaces and binary data with zeros.
+    jsonChunk += b' ' * (-len(jsonChunk) % 4)
+    binLength = sum(chunk.nbytes for chunk in chunks)
+    binLength += -binLength % 4
+    totalLength = 12 + 8 + len(jsonChunk) + (8 + binLength if binLength else 0)
+
+    out = bytearray(totalLength)
+    struct.pack_into('<4sII', out, 0, b'glTF', 2, totalLength)
+    struct.pack_into('<I4s', out, 12, len(jsonChunk), b'JSON')
+    out[20:20 + len(jsonChunk)] = jsonChunk
+    if binLength:
+        offset = 20 + len(jsonChunk)
+        struct.pack_into('<I4s', out, offset, binLength, b'BIN\0')
+        _write_chunks(out, offset + 8, chunks)
+    return bytes(out)
@@ -0,0 +1,128 @@
+from typing import Sequence, Union
+import numpy as np
+from PIL import Image
+
+from .briq import BriqData, as_briq_data
+from .gltf import Occupancy
+from .lod import downsample
+
+# Visible faces when looking down the (-1, -1, -1) direction: +x, +y (top), +z.
+FACE_NORMALS = np.array([
+    [1, 0, 0],
+    [0, 1, 0],
+    [0, 0, 1],
+])
+
+# Simple shading, as if lit from above and slightly from the left.
+FACE_SHADES = np.array([0.8, 1.0, 0.62])
+
+# Keep memory in check: about this many (face, pixel) pairs are rasterized at most.
+MAX_FRAGMENTS = 8_000_000
+
+
+def _project(points: np.ndarray, k: int):
+    """
+    2:1 'pixel-art' isometric projection, with k pixels per half unit vertically.
+    Integer positions land on integer pixels, so all faces of a kind share the same pixel footprint.
+    """
+    sx = 2 * k * (points[..., 0] - points[..., 2])
+    sy = k * (points[..., 0] + points[..., 2]) - 2 * k * points[..., 1]
+    return np.stack([sx, sy], axis=-1)
+
+
+def _face_footprint(face: int, k: int):
+    """
+    Pixels covered by the face of the briq at the origin, as (dx, dy) offsets from its projected center,
+    with the depth (x + y + z, larger is closer) of the face at each of those pixels.
+    Edges are half-open, so that faces of neighbouring briqs tile without gaps or overlap.
+    """
+    dy, dx = np.mgrid[-2 * k:2 * k, -2 * k:2 * k]
+    # Pixel centers.
+    sx, sy = dx + 0.5, dy + 0.5
+    if face == 0:
+        X = np.full(sx.shape, 0.5)
+        Z = X - sx / (2 * k)
+        Y = (k * (X + Z) - sy) / (2 * k)
+        u, v = Y, Z
+    elif face == 1:
+        Y = np.full(sx.shape, 0.5)
+        X = (sx / (2 * k) + (sy + 2 * k * Y) / k) / 2
+        Z = X - sx / (2 * k)
+        u, v = X, Z
+    else:
+        Z = np.full(sx.shape, 0.5)
+        X = Z + sx / (2 * k)
+        Y = (k * (X + Z) - sy) / (2 * k)
+        u, v = X, Y
+    inside = (u >= -0.5) & (u < 0.5) & (v >= -0.5) & (v < 0.5)
+    return dx[inside], dy[inside], (X + Y + Z)[inside]
+
+
+def _rows_in(rows: np.ndarray, table: np.ndarray) -> np.ndarray:
+    """Which rows are also rows of the table, for cells too spread out to be packed in an int64."""
+    _, inverse = np.unique(np.concatenate([table, rows]), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    return np.isin(inverse[len(table):], inverse[:len(table)])
+
+
+def _extent(positions: np.ndarray) -> int:
+    """Size of the image at the smallest scale, in pixels."""
+    centers = _project(positions, 1)
+    return max(int((centers[:, 0].max() - centers[:, 0].min())), int(centers[:, 1].max() - centers[:, 1].min())) + 4
+
+
+def to_isometric_image(briqs: Union[BriqData, Sequence], max_size: int = 1024, max_scale: int = 16):
+    """
+    Depth-buffered isometric render of the briqs, on a transparent background.
+    Briqs are drawn as shaded cubes, the image fits in max_size x max_size.
+    Sets too large for that are drawn with coarser briqs, as for LOD models.
+    """
+    data = full = as_briq_data(briqs)
+    if not len(data):
+        raise ValueError("Nothing to render")
+    factor = 1
+    while _extent(data.positions.astype(np.int64)) > max_size and len(data) > 1:
+        factor *= 2
+        data = downsample(full, factor)
+    positions = data.positions.astype(np.int64)
+    colors = ((data.colors[:, None] >> np.array([16, 8, 0], dtype=np.uint32)) & 0xff).astype(np.uint8)
+
+    # Only faces that aren't against another briq can be seen.
+    occupancy = Occupancy.of(positions)
+    if occupancy is not None:
+        faces = [np.flatnonzero(~occupancy.contains(positions + normal)) for normal in FACE_NORMALS]
+    else:
+        faces = [np.flatnonzero(~_rows_in(positions + normal, positions)) for normal in FACE_NORMALS]
+
+    # Pick the scale: fit in the image, and don't rasterize too many pixels.
+    extent = _extent(positions)
+    k = max(1, min(max_scale, max_size // extent, int(np.sqrt(MAX_FRAGMENTS / (4 * max(1, sum(len(f) for f in faces)))))))
+
+    centers = _project(positions, k)
+    origin = centers.min(axis=0) - 2 * k
+    width, height = (centers.max(axis=0) + 2 * k - origin).tolist()
+
+    pixels = []
+    depths = []
+    shades = []
+    for face, briq_indices in enumerate(faces):
+        dx, dy, depth = _face_footprint(face, k)
+        screen = centers[briq_indices] - origin
+        pixels.append((((screen[:, 1:2] + dy[None, :]) * width) + screen[:, 0:1] + dx[None, :]).reshape(-1))
+        depths.append((positions[briq_indices].sum(axis=1)[:, None] + depth[None, :]).reshape(-1))
+        shades.append(np.repeat(briq_indices * 3 + face, len(dx)))
+    pixels = np.concatenate(pixels)
+    depths = np.concatenate(depths)
+    shades = np.concatenate(shades)
+
+    # Z-buffer: for each pixel, keep the closest fragment.
+    order = np.lexsort((depths, pixels))
+    pixels, shades = pixels[order], shades[order]
+    closest = np.ones(len(pixels), dtype=bool)
+    closest[:-1] = pixels[1:] != pixels[:-1]
+    pixels, shades = pixels[closest], shades[closest]
+
+    rgba = np.zeros((height * width, 4), dtype=np.uint8)
+    rgba[pixels, :3] = np.round(colors[shades // 3] * FACE_SHADES[shades % 3][:, None])
+    rgba[pixels, 3] = 255
+    return Image.fromarray(rgba.reshape(height, width, 4), 'RGBA')
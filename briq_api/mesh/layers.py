@@ -0,0 +1,71 @@
+"""
+Layer by layer export, for booklets: step_{i}.glb shows the set up to level i, step_level_{i}.glb only level i.
+
+Briqs are sorted by level once, and each level is meshed once: the steps are put together
+from the meshes of the levels they contain rather than meshed from scratch.
+"""
+
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .briq import BriqData
+from .gltf import Primitive, merge_primitives, primitives_to_glb, to_primitives
+
+
+@dataclass
+class Level:
+    # The briqs of the level.
+    briqs: BriqData
+    # What the level adds to the previous step: briqs under the ground come with the first level.
+    added: BriqData
+    # The level just below, which hides the bottom faces of this one in the steps.
+    below: Optional[BriqData]
+
+
+@dataclass
+class LevelMesh:
+    # The level on its own.
+    level: list[Primitive]
+    # What the level adds to the previous step's mesh.
+    added: list[Primitive]
+
+
+def split_levels(data: BriqData) -> list[Level]:
+    """Steps go up one level at a time from y = 0, until the first empty level."""
+    y = data.positions[:, 1].astype(np.int64)
+    order = np.argsort(y, kind='stable')
+    y = y[order]
+    nbLevels = 0
+    present = np.unique(y[y >= 0])
+    while nbLevels < len(present) and present[nbLevels] == nbLevels:
+        nbLevels += 1
+
+    starts = np.searchsorted(y, np.arange(nbLevels), side='left')
+    ends = np.searchsorted(y, np.arange(nbLevels), side='right')
+    levels = []
+    for i in range(nbLevels):
+        briqs = data.select(order[starts[i]:ends[i]])
+        levels.append(Level(
+            briqs=briqs,
+            added=data.select(order[:ends[i]]) if i == 0 else briqs,
+            below=levels[-1].briqs if levels else None,
+        ))
+    return levels
+
+
+def mesh_level(level: Level, separate_any_color: bool = True) -> LevelMesh:
+    return LevelMesh(
+        level=to_primitives(level.briqs, separate_any_color),
+        added=to_primitives(level.added, separate_any_color, occluders=level.below),
+    )
+
+
+def layered_glbs(meshes: Sequence[LevelMesh]) -> tuple[list[bytes], list[bytes]]:
+    """
+    The step GLBs and the level GLBs.
+    Steps keep the faces between levels that face up, as those are visible until the next level is added.
+    """
+    steps = [primitives_to_glb(merge_primitives([mesh.added for mesh in meshes[:i + 1]])) for i in range(len(meshes))]
+    return steps, [primitives_to_glb(mesh.level) for mesh in meshes]
@@ -0,0 +1,51 @@
+"""
+Level-of-detail variants of the model, for thumbnails and small screens.
+
+Sets are downsampled on the grid: each block of factor³ briqs becomes a single, bigger briq
+with the most common colour & material of the block. The coarse set is then meshed greedily,
+which on top of having fewer briqs leaves much larger faces to merge.
+"""
+
+from typing import Sequence, Union
+
+import numpy as np
+
+from .briq import BriqData, as_briq_data
+from .gltf import primitives_to_glb, to_primitives
+
+# Downsampling factor of each level of detail, level 0 being the full model.
+LOD_FACTORS = {1: 2, 2: 4}
+
+
+def downsample(briqs: Union[BriqData, Sequence], factor: int) -> BriqData:
+    """The set on a grid factor times coarser: a cell is filled if any of its briqs is."""
+    data = as_briq_data(briqs)
+    cells = np.floor_divide(data.positions, factor)
+    _, cellIdx = np.unique(cells, axis=0, return_inverse=True)
+    cellIdx = cellIdx.reshape(-1)
+    _, materialIdx = np.unique(data.materials, return_inverse=True)
+    kinds = (materialIdx.reshape(-1).astype(np.int64) << 25) + (data.colors.astype(np.int64) << 1) + data.any_color
+
+    # Count briqs of each kind in each cell, and keep one briq of the most common kind (ties go to the first briq).
+    _, firstOfPair, pairIdx, pairCounts = np.unique(
+        np.stack([cellIdx, kinds], axis=1), axis=0, return_index=True, return_inverse=True, return_counts=True
+    )
+    pairCells = cellIdx[firstOfPair]
+    order = np.lexsort((firstOfPair, -pairCounts, pairCells))
+    winners = firstOfPair[order][np.diff(pairCells[order], prepend=-1) != 0]
+    winners.sort()
+
+    return BriqData().load_arrays(cells[winners], data.colors[winners], data.materials[winners], data.any_color[winners])
+
+
+def to_lod_primitives(briqs: Union[BriqData, Sequence], level: int):
+    factor = LOD_FACTORS[level]
+    primitives = to_primitives(downsample(briqs, factor), greedy=True)
+    for primitive in primitives:
+        # Back to the size of the full model: cell c covers briqs c * factor to c * factor + factor - 1.
+        primitive.points = primitive.points * factor + (factor - 1) / 2
+    return primitives
+
+
+def to_lod_glb(briqs: Union[BriqData, Sequence], level: int, quantize: bool = False) -> bytes:
+    return primitives_to_glb(to_lod_primitives(briqs, level), quantize)
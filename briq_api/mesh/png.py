@@ -1,45 +1,29 @@
-from typing import Sequence
+from typing import Sequence, Union
+import numpy as np
 from PIL import Image
 
+from .briq import BriqData, as_briq_data
 
-# Throws in case of errors
-def to_png(briqs: Sequence):
-    multiplier = 8
-
-    x0 = x1 = None
-    y0 = y1 = None
-    z0 = z1 = None
 
-    for briq in briqs:
-        if x0 is None or briq['pos'][0] < x0:
-            x0 = briq['pos'][0]
-        if y0 is None or briq['pos'][1] < y0:
-            y0 = briq['pos'][1]
-        if z0 is None or briq['pos'][2] < z0:
-            z0 = briq['pos'][2]
-        if x1 is None or briq['pos'][0] > x1:
-            x1 = briq['pos'][0]
-        if y1 is None or briq['pos'][1] > y1:
-            y1 = briq['pos'][1]
-        if z1 is None or briq['pos'][2] > z1:
-            z1 = briq['pos'][2]
+# Throws in case of errors
+def to_png(briqs: Union[BriqData, Sequence]):
+    data = as_briq_data(briqs)
+    positions = data.positions.astype(np.int64)
+    colors = ((data.colors[:, None] >> np.array([16, 8, 0], dtype=np.uint32)) & 0xff).astype(np.uint8)
 
-    sizes = [x1 - x0, y1 - y0, z1 - z0]
+    lows = positions.min(axis=0)
+    sizes = (positions.max(axis=0) - lows).tolist()
 
     if max(sizes) > 2000:
         raise ValueError("Size would result in an image that's too large")
 
     # Find the best projection
     x_axis = 0
-    x0 = x0
     y_axis = 1
-    y0 = y0
     if sizes[0] < sizes[1] and sizes[0] < sizes[2]:
         x_axis = 2
-        x0 = z0
     if sizes[1] < sizes[0] and sizes[1] < sizes[2]:
         y_axis = 2
-        y0 = z0
 
     if max(sizes) > 500:
         multiplier = 1
@@ -54,14 +38,18 @@ def to_png(briqs: Sequence):
     else:
         multiplier = 32
 
-    image = Image.new('RGBA', (sizes[x_axis] + 1, sizes[y_axis] + 1))
+    x = positions[:, x_axis] - lows[x_axis]
+    # y axis is flipped
+    y = sizes[y_axis] - (positions[:, y_axis] - lows[y_axis])
+
+    # Later briqs are drawn over earlier ones: keep the last briq of each pixel.
+    pixels = y * (sizes[x_axis] + 1) + x
+    _, last = np.unique(pixels[::-1], return_index=True)
+    last = len(pixels) - 1 - last
 
-    pixelMap = image.load()
-    for briq in briqs:
-        col = briq['data']['color']
-        x = briq['pos'][x_axis]
-        y = briq['pos'][y_axis]
-        # y axis is flipped
-        pixelMap[x - x0, sizes[y_axis] - (y - y0)] = (*[int(col[1 + i*2 : 1 + (i+1) * 2], 16) for i in [0, 1, 2]], 255)
+    rgba = np.zeros((sizes[y_axis] + 1, sizes[x_axis] + 1, 4), dtype=np.uint8)
+    rgba[y[last], x[last], :3] = colors[last]
+    rgba[y[last], x[last], 3] = 255
+    image = Image.fromarray(rgba, 'RGBA')
     image = image.resize((image.width * multiplier, image.height * multiplier), Image.Resampling.NEAREST)
     return image
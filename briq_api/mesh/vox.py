@@ -1,101 +1,148 @@
-from pyvox.parser import VoxParser
-from pyvox.writer import VoxWriter
-from pyvox.models import Vox, Model, Voxel, Size, Color, Material
+import struct
+from dataclasses import dataclass, field
+from typing import Optional, Sequence, Union
+
+import numpy as np
 
 import logging
 logger = logging.getLogger(__name__)
 
-from briq_api.mesh.briq import BriqData
+from briq_api.mesh.briq import BriqData, as_briq_data
+
+# Vox models are limited to 256 voxels along each axis, larger sets are split into several models.
+MAX_MODEL_SIZE = 256
+# Palette index 0 means 'empty'.
+MAX_COLORS = 255
 
 
-def create_material(index: int, material: str):
+def create_material(material: str) -> dict[str, str]:
     if material == '0x3':
-        return Material(id=index, type=b'_glass', weight=1.0, props={
-            'ior': 0.04,
-            'alpha': 0.7,
-        })
+        return {'_type': '_glass', '_weight': '1.0', '_ior': '0.04', '_alpha': '0.7'}
     elif material == '0x4':
-        return Material(id=index, type=b'_metal', weight=0.5, props={
-            'rough': 0.15,
-            'metal': 0.5  # picked up from the weight but Magica sets it also.
-        })
+        # metal is picked up from the weight but Magica sets it also.
+        return {'_type': '_metal', '_weight': '0.5', '_rough': '0.15', '_metal': '0.5'}
     elif material == '0x5':
-        return Material(id=index, type=b'_emit', weight=0.5, props={
-            'emit': 1.0,
-            'flux': 2  # range 0-4
-        })
+        # flux ranges from 0 to 4.
+        return {'_type': '_emit', '_weight': '0.5', '_emit': '1.0', '_flux': '2'}
     else:
-        return Material(id=index, type=b'_diffuse', weight=1.0, props={})
-
-
-def to_vox(briqData: BriqData):
-    voxels = []
-    colors = []
-    materials = []
-    colorSet = {}
-    x0 = None
-    y0 = None
-    z0 = None
-    x1 = None
-    y1 = None
-    z1 = None
-    # Vox is Y-up, so we need to rotate coordinates
-    for briq in briqData.briqs:
-        col = briq['data']['color']
-        mat = briq['data']['material']
-        key = f'{col}{mat}'
-        if key not in colorSet:
-            colorSet[key] = len(colors) + 1
-            rgbaCol = [int(col[i:i + 2], 16) for i in (1, 3, 5)]
-            colors.append(Color(*rgbaCol, a=255))
-            materials.append(mat)
-        if x0 is None or briq["pos"][0] < x0:
-            x0 = briq["pos"][0]
-        if y0 is None or briq["pos"][2] < y0:
-            y0 = briq["pos"][2]
-        if z0 is None or briq["pos"][1] < z0:
-            z0 = briq["pos"][1]
-        if x1 is None or briq["pos"][0] > x1:
-            x1 = briq["pos"][0]
-        if y1 is None or briq["pos"][2] > y1:
-            y1 = briq["pos"][2]
-        if z1 is None or briq["pos"][1] > z1:
-            z1 = briq["pos"][1]
-    if len(briqData.briqs) == 0:
-        x0 = x1 = z0 = z1 = y0 = y1 = 0
-    x1 += 1
-    y1 += 1
-    z1 += 1
-    x1 -= x0
-    y1 -= y0
-    z1 -= z0
-
-    # Vox cannot support more than 255 colors or more than 255*255*255 so for now, clamp to that.
-    # For now, we prefer truncating the model over failing to export.
-    MAX_VALUE = 255
-    if len(colors) > MAX_VALUE:
-        logger.info("Too many colors, set will be truncated.")
-    if x1 - x0 > MAX_VALUE or y1 - y0 > MAX_VALUE or z1 - z0 > MAX_VALUE:
-        logger.info(f"Some briqs are outside the range ({x1}/{y1}/{z1}), set will be truncated.")
-
-    for briq in briqData.briqs:
-        x = x1 - 1 - briq["pos"][0] + x0
-        y = briq["pos"][2] - y0
-        z = briq["pos"][1] - z0
-        if x > MAX_VALUE or y > MAX_VALUE or z > MAX_VALUE:
-            continue
-        col = briq['data']['color']
-        mat = briq['data']['material']
-        key = f'{col}{mat}'
-        voxels.append(Voxel(x, y, z, c=min(255, colorSet[key])))
-
-    voxMaterials = []
-    for i, mat in enumerate(materials):
-        voxMaterials.append(create_material(i + 1, mat))
-
-    vox = Vox(
-        models=[Model(size=Size(x=min(MAX_VALUE, x1), y=min(MAX_VALUE, y1), z=min(MAX_VALUE, z1)), voxels=voxels)],
-        palette=colors[0:255],
-        materials=voxMaterials
-    )
-    return VoxWriter("temp.vox", vox)
+        return {'_type': '_diffuse', '_weight': '1.0'}
+
+
+@dataclass
+class VoxModel:
+    size: tuple[int, int, int]
+    # uint8, shape (n, 4): x, y, z and palette index of each voxel.
+    voxels: np.ndarray
+    # Where the model sits in the scene, in voxels.
+    offset: tuple[int, int, int] = (0, 0, 0)
+
+
+@dataclass
+class VoxFile:
+    """A MagicaVoxel .vox file, serialized straight from arrays."""
+    models: list[VoxModel]
+    # uint8, shape (n, 4): RGBA of palette indices 1 to n.
+    palette: np.ndarray
+    materials: list[dict[str, str]] = field(default_factory=list)
+    filename: Optional[str] = None
+
+    def to_bytes(self) -> bytes:
+        chunks = []
+        for model in self.models:
+            chunks.append(_chunk(b'SIZE', struct.pack('<3i', *model.size)))
+            voxels = np.ascontiguousarray(model.voxels, dtype=np.uint8)
+            chunks.append(_chunk(b'XYZI', struct.pack('<i', len(voxels)) + voxels.tobytes()))
+        chunks += self._scene_graph()
+        palette = np.zeros((256, 4), dtype=np.uint8)
+        palette[:min(len(self.palette), MAX_COLORS)] = self.palette[:MAX_COLORS]
+        chunks.append(_chunk(b'RGBA', palette.tobytes()))
+        for i, material in enumerate(self.materials):
+            chunks.append(_chunk(b'MATL', struct.pack('<i', i + 1) + _dict(material)))
+        children = b''.join(chunks)
+        return b'VOX ' + struct.pack('<i', 150) + b'MAIN' + struct.pack('<ii', 0, len(children)) + children
+
+    def write(self):
+        with open(self.filename, 'wb') as f:
+            f.write(self.to_bytes())
+
+    def _scene_graph(self) -> list[bytes]:
+        """Root transform -> group -> one transform & shape per model, so the models are laid out as in the set."""
+        chunks = [
+            _chunk(b'nTRN', struct.pack('<ii', 0, 0) + struct.pack('<4i', 1, -1, -1, 1) + _dict({})),
+            _chunk(b'nGRP', struct.pack(f'<iii{len(self.models)}i', 1, 0, len(self.models), *[2 + i * 2 for i in range(len(self.models))])),
+        ]
+        for i, model in enumerate(self.models):
+            # Models are positioned by their center.
+            translation = [offset + size // 2 for offset, size in zip(model.offset, model.size)]
+            frame = _dict({'_t': ' '.join(str(t) for t in translation)})
+            chunks.append(_chunk(b'nTRN', struct.pack('<ii', 2 + i * 2, 0) + struct.pack('<4i', 3 + i * 2, -1, 0, 1) + frame))
+            chunks.append(_chunk(b'nSHP', struct.pack('<ii', 3 + i * 2, 0) + struct.pack('<2i', 1, i) + _dict({})))
+        return chunks
+
+
+def _chunk(id: bytes, content: bytes) -> bytes:
+    return id + struct.pack('<ii', len(content), 0) + content
+
+
+def _string(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack('<i', len(data)) + data
+
+
+def _dict(values: dict[str, str]) -> bytes:
+    return struct.pack('<i', len(values)) + b''.join(_string(key) + _string(value) for key, value in values.items())
+
+
+def to_vox(briqs: Union[BriqData, Sequence]):
+    data = as_briq_data(briqs)
+    positions = data.positions.astype(np.int64)
+    colors = ((data.colors[:, None] >> np.array([16, 8, 0], dtype=np.uint32)) & 0xff).astype(np.uint8)
+    materialValues, materials = np.unique(data.materials, return_inverse=True)
+
+    # One palette entry per color & material, in order of first appearance.
+    keys = data.colors.astype(np.int64) * len(materialValues) + materials.reshape(-1)
+    _, first, entries = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    paletteIndex = rank[entries.reshape(-1)] + 1
+    if len(first) > MAX_COLORS:
+        logger.info("Too many colors, some will be merged.")
+    paletteIndex = np.minimum(paletteIndex, MAX_COLORS)
+
+    palette = np.full((len(first), 4), 255, dtype=np.uint8)
+    palette[:, :3] = colors[first[order]]
+    voxMaterials = [create_material(hex(int(data.materials[briq]))) for briq in first[order][:MAX_COLORS]]
+
+    if not len(positions):
+        return VoxFile(models=[VoxModel(size=(1, 1, 1), voxels=np.zeros((0, 4), dtype=np.uint8))], palette=palette, materials=voxMaterials)
+
+    # Vox is Z-up, so we need to rotate coordinates (which also mirrors x).
+    cells = np.stack([
+        positions[:, 0].max() - positions[:, 0],
+        positions[:, 2] - positions[:, 2].min(),
+        positions[:, 1] - positions[:, 1].min(),
+    ], axis=1)
+
+    # Split into blocks that fit in a model each.
+    blocks = cells // MAX_MODEL_SIZE
+    _, blockIdx = np.unique(blocks, axis=0, return_inverse=True)
+    blockIdx = blockIdx.reshape(-1)
+    order = np.argsort(blockIdx, kind='stable')
+    starts = np.flatnonzero(np.diff(blockIdx[order], prepend=-1))
+    if len(starts) > 1:
+        logger.info("Set is larger than %(size)s voxels, splitting it into %(models)s models.", {
+            "size": MAX_MODEL_SIZE, "models": len(starts)
+        })
+
+    models = []
+    for indices in np.split(order, starts[1:]):
+        block = cells[indices]
+        low = block.min(axis=0)
+        voxels = np.empty((len(indices), 4), dtype=np.uint8)
+        voxels[:, :3] = block - low
+        voxels[:, 3] = paletteIndex[indices]
+        size = block.max(axis=0) - low + 1
+        models.append(VoxModel(size=tuple(size.tolist()), voxels=voxels, offset=tuple(low.tolist())))
+
+    return VoxFile(models=models, palette=palette, materials=voxMaterials)
@@ -0,0 +1,140 @@
+"""
+Generation of models and previews off the request path.
+
+Meshing a large set takes seconds of CPU, which would stall every other request of the worker
+if done in the event loop (or in a thread, because of the GIL). Jobs run in a small process pool instead:
+- concurrent requests for the same thing share a single job,
+- once too many jobs are in flight, new ones are refused with QueueFullException rather than piling up.
+
+The job functions live here and only depend on briq_api.mesh, so the pool processes stay light.
+"""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, TypeVar
+
+from PIL import Image
+
+from briq_api.config import MODEL_QUEUE_SIZE, MODEL_WORKERS, QUANTIZE_MODELS
+from briq_api.mesh.briq import BriqData
+from briq_api.mesh.layers import Level, LevelMesh, layered_glbs, mesh_level
+from briq_api.mesh.lod import LOD_FACTORS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Coarser versions of the GLB model, stored next to it as e.g. {token_id}.lod1.glb.
+LOD_MODEL_KINDS = {f"lod{level}.glb": level for level in LOD_FACTORS}
+
+
+class QueueFullException(Exception):
+    pass
+
+
+class ModelExecutor:
+    def __init__(self, max_workers: int, max_queued: int):
+        self.max_workers = max_workers
+        # Jobs waiting for a process, on top of those running.
+        self.max_queued = max_queued
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._jobs: dict[str, asyncio.Future] = {}
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Don't fork: the server has threads (storage IO, the invalidation bus) which may hold locks.
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    @property
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    async def run(self, key: str, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Run fn(*args) in the pool, or wait for the job already running under that key.
+        fn and args must be picklable, i.e. fn must be a module-level function.
+        """
+        job = self._jobs.get(key)
+        if job is None:
+            if len(self._jobs) >= self.max_workers + self.max_queued:
+                raise QueueFullException(f"Too many models being generated, refusing {key}")
+            job = asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+            self._jobs[key] = job
+            job.add_done_callback(lambda done: self._jobs.pop(key) if self._jobs.get(key) is done else None)
+        try:
+            # Shielded, so that one client going away doesn't cancel the job for everyone else.
+            return await asyncio.shield(job)
+        except BrokenProcessPool:
+            # A process died (e.g. OOM), start afresh for the next jobs.
+            logger.error("Model generation pool broke while running %(key)s", {"key": key})
+            self._pool = None
+            raise
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+model_executor = ModelExecutor(max_workers=MODEL_WORKERS, max_queued=MODEL_QUEUE_SIZE)
+
+
+def render_model(metadata: dict, kind: str) -> bytes:
+    briqData = BriqData().load(metadata)
+    if kind == "glb" or kind == "gltf":
+        return briqData.to_glb(quantize=QUANTIZE_MODELS)
+    elif kind == "vox":
+        return briqData.to_vox("").to_bytes()
+    elif kind in LOD_MODEL_KINDS:
+        return briqData.to_lod_glb(LOD_MODEL_KINDS[kind], quantize=QUANTIZE_MODELS)
+    else:
+        raise Exception("Unknown model type " + kind)
+
+
+def render_preview(metadata: dict) -> bytes:
+    image_data_stream = io.BytesIO()
+    BriqData().load(metadata).to_preview().save(image_data_stream, format='PNG')
+    return image_data_stream.getvalue()
+
+
+def render_small_preview(preview: bytes) -> bytes:
+    resized_image = Image.open(io.BytesIO(preview)).resize((375, 375)).convert('RGB')
+    image_data_stream = io.BytesIO()
+    resized_image.save(image_data_stream, format='jpeg', quality=80)
+    return image_data_stream.getvalue()
+
+
+def render_set(metadata: dict, preview: Optional[bytes]) -> dict[str, bytes]:
+    """
+    Everything served for a set, by kind: glb, vox, the LOD models, png (unless a preview is given) and small_jpg.
+    Kinds that fail are left out, the API will try again on demand.
+    """
+    outputs = {}
+    for kind in ("glb", "vox", *LOD_MODEL_KINDS):
+        try:
+            outputs[kind] = render_model(metadata, kind)
+        except Exception as e:
+            logger.warning("Could not render %(kind)s model", {"kind": kind}, exc_info=e)
+    if preview is None:
+        try:
+            preview = outputs["png"] = render_preview(metadata)
+        except Exception as e:
+            logger.warning("Could not render preview", exc_info=e)
+    if preview is not None:
+        outputs["small_jpg"] = render_small_preview(preview)
+    return outputs
+
+
+def render_levels(levels: list[Level]) -> list[LevelMesh]:
+    """Mesh a batch of booklet levels, see briq_api.mesh.layers."""
+    return [mesh_level(level) for level in levels]
+
+
+def render_layered_glbs(meshes: list[LevelMesh]) -> tuple[list[bytes], list[bytes]]:
+    return layered_glbs(meshes)
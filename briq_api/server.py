@@ -6,6 +6,8 @@ import logging
 import time
 
 from .stores import setup_stores
+from .invalidation import invalidation_bus
+from .model_executor import model_executor
 from .api.routes.router import router as api_router
 from .mock_chain.router import router as mock_chain_router
 
@@ -54,3 +56,10 @@ def health():
 @app.on_event("startup")
 def startup_event():
     setup_stores(os.getenv("LOCAL"), os.getenv("USE_MOCK_CHAIN"))
+    invalidation_bus.start()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    invalidation_bus.stop()
+    model_executor.shutdown()
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+
+from briq_api.model_executor import ModelExecutor, render_set
+from briq_api.set_identifier import SetRID
+from briq_api.storage.file.file_client import FileClient
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueue:
+    """
+    Renders the models and previews of newly indexed sets in the background,
+    so that the API almost never has to on the request path (where the first visitor pays for it).
+    If the queue is full, sets are skipped: the API still renders them on demand.
+    """
+
+    def __init__(self, storage: FileClient, workers: int, max_size: int):
+        self.storage = storage
+        self.workers = workers
+        # One task per process, so jobs never wait in the executor.
+        self.executor = ModelExecutor(max_workers=workers, max_queued=0)
+        self.queue: asyncio.Queue[tuple[SetRID, dict]] = asyncio.Queue(maxsize=max_size)
+        self.tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.executor.shutdown()
+
+    def enqueue(self, rid: SetRID, metadata: dict) -> bool:
+        try:
+            self.queue.put_nowait((rid, metadata))
+            return True
+        except asyncio.QueueFull:
+            logger.warning("Render queue is full, %(rid)s will be rendered on demand", {"rid": rid.json()})
+            return False
+
+    async def _work(self):
+        while True:
+            rid, metadata = await self.queue.get()
+            try:
+                await self.render(rid, metadata)
+            except Exception as e:
+                logger.error("Could not render set %(rid)s ahead of time", {"rid": rid.json()}, exc_info=e)
+            finally:
+                self.queue.task_done()
+
+    async def render(self, rid: SetRID, metadata: dict):
+        # Keep the preview uploaded by the owner if there is one, only the thumbnail is made from it.
+        preview = await self.storage.aload_set_preview(rid) if await self.storage.ahas_set_preview(rid) else None
+        outputs = await self.executor.run(f"{rid.chain_id}_{rid.token_id}", render_set, metadata, preview)
+        for kind, data in outputs.items():
+            if kind == "png":
+                await self.storage.astore_set_preview(rid, data)
+            elif kind == "small_jpg":
+                await self.storage.astore_set_small_preview(rid, data)
+            else:
+                await self.storage.astore_set_model(rid, kind, data)
+        logger.info("Rendered %(kinds)s for set %(rid)s", {"kinds": ", ".join(outputs), "rid": rid.json()})
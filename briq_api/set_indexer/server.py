@@ -4,8 +4,9 @@ import math
 import os
 from typing import Union
 from briq_api.chain.networks import MAINNET
-from briq_api.config import ENV
+from briq_api.config import ENV, PRERENDER_QUEUE_SIZE, PRERENDER_WORKERS
 from briq_api.set_indexer.config import NETWORK
+from briq_api.set_indexer.render_queue import RenderQueue
 from briq_api.set_indexer.set_indexer import SetIndexer, StorableSetData
 from briq_api.stores import file_storage, setup_stores
 
@@ -112,19 +113,25 @@ async def store_new_set(request: NewSetStorageRequest):
 
 
 pending_task: Union[asyncio.Task, None] = None
+render_queue: Union[RenderQueue, None] = None
 
 
 @app.on_event("startup")
 def startup_event():
     global set_indexer
     global pending_task
+    global render_queue
 
     setup_stores(os.getenv("LOCAL") or False, False)
 
-    set_indexer[NETWORK.id] = SetIndexer(NETWORK.id, file_storage)
+    if PRERENDER_WORKERS > 0:
+        render_queue = RenderQueue(file_storage, PRERENDER_WORKERS, PRERENDER_QUEUE_SIZE)
+        render_queue.start()
+
+    set_indexer[NETWORK.id] = SetIndexer(NETWORK.id, file_storage, render_queue)
     # In test, add mainnet processing.
     if ENV == 'test':
-        set_indexer[MAINNET.id] = SetIndexer(MAINNET.id, file_storage)
+        set_indexer[MAINNET.id] = SetIndexer(MAINNET.id, file_storage, render_queue)
     pending_task = asyncio.create_task(process_pending_sets())
 
 
@@ -143,3 +150,5 @@ async def process_pending_sets():
 def shutdown_event():
     if pending_task:
         pending_task.cancel()
+    if render_queue:
+        render_queue.stop()
@@ -12,10 +12,11 @@ This is achieved by regularly running an async task in the server, for simplicit
 from dataclasses import dataclass
 import logging
 from time import time
-from typing import Any, Dict, Union
+from typing import Any, Dict, Optional, Union
 import requests
 from briq_api.chain.networks import get_network_metadata
 from briq_api.set_indexer.create_set_metadata import create_set_metadata
+from briq_api.set_indexer.render_queue import RenderQueue
 from briq_api.storage.file.file_client import FileClient
 
 from briq_api.config import ENV
@@ -36,14 +37,17 @@ class SetIndexer:
     network: str
     pending: Dict[str, Union[StorableSetData, None]] = {}
     storage: FileClient
+    render_queue: Optional[RenderQueue]
 
     def __init__(
         self,
         network: str,
         storage: FileClient,
+        render_queue: Optional[RenderQueue] = None,
     ):
         self.network = network
         self.storage = storage
+        self.render_queue = render_queue
 
     def add_set_to_pending(self, token_id: str, data: Union[StorableSetData, None] = None):
         self.pending[token_id] = data
@@ -159,5 +163,9 @@ class SetIndexer:
 
 
     def _store_set(self, data: StorableSetData, token_id: str):
-        self.storage.store_set_metadata(SetRID(chain_id=self.network, token_id=token_id), self._get_storage_data(data, token_id))
+        rid = SetRID(chain_id=self.network, token_id=token_id)
+        metadata = self._get_storage_data(data, token_id)
+        self.storage.store_set_metadata(rid, metadata)
         logger.info('Stored new set %(token)s', {"token": token_id})
+        if self.render_queue is not None:
+            self.render_queue.enqueue(rid, metadata)
@@ -0,0 +1,109 @@
+"""
+Cache tier shared between the worker processes of a node.
+
+gunicorn runs several uvicorn workers, each with its own in-memory caches.
+This tier stores pickled entries as files in a directory that all workers can read,
+ideally on a tmpfs such as /dev/shm, so a value fetched by one worker is served to the others
+without hitting GCS again.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import struct
+from time import time
+from typing import Any, Optional
+from uuid import uuid1
+
+logger = logging.getLogger(__name__)
+
+# Each file starts with its expiry timestamp.
+_HEADER = struct.Struct('<d')
+
+
+class SharedCache:
+    def __init__(self, path: str, max_bytes: int, max_age: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Bytes written since the last sweep, to amortize the cost of enforcing the budget.
+        self._written = 0
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+
+    def _file(self, namespace: str, key: str) -> str:
+        return os.path.join(self.path, namespace, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Returns the cached value, or None if there isn't one (or it can't be read)."""
+        path = self._file(namespace, key)
+        try:
+            with open(path, 'rb') as f:
+                (expires_at,) = _HEADER.unpack(f.read(_HEADER.size))
+                if expires_at <= time():
+                    os.remove(path)
+                    return None
+                value = pickle.loads(f.read())
+            # Bump the modification time so sweeping evicts the least recently used files first.
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Could not read shared cache entry %(key)s", {"key": key}, exc_info=e)
+            return None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[int] = None):
+        path = self._file(namespace, key)
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(blob) > self.max_bytes // 4:
+                return
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            # Write then rename, so that readers never see a partial file.
+            tmp_path = f"{path}.{uuid1().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(_HEADER.pack(time() + min(ttl or self.max_age, self.max_age)))
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("Could not write shared cache entry %(key)s", {"key": key}, exc_info=e)
+            return
+        self._written += len(blob)
+        if self._written > self.max_bytes // 10:
+            self.sweep()
+
+    def delete(self, namespace: str, key: str):
+        try:
+            os.remove(self._file(namespace, key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self, namespace: str):
+        shutil.rmtree(os.path.join(self.path, namespace), ignore_errors=True)
+
+    def sweep(self):
+        """Drop the least recently used files until the tier is back under 80% of its budget."""
+        self._written = 0
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes * 0.8:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,268 @@
+import base64
+import hashlib
+import logging
+import os
+import re
+from typing import Optional
+from uuid import uuid1
+
+from ..file_client import SET_STORAGE_PREFIX, STREAM_CHUNK_SIZE, FileInfo, FileStorageBackend, content_md5, file_md5, read_chunks
+
+logger = logging.getLogger(__name__)
+
+# Binary assets that don't change once written: set previews & models, and booklet steps.
+# They must only be rewritten through this backend, which tells the other nodes to drop their copy.
+# Theme assets (covers, logos, splash screens...) get replaced in the bucket directly, so they aren't cached.
+CACHED_PATHS = re.compile(
+    rf"({re.escape(SET_STORAGE_PREFIX)}.+|genesis_themes/[^/]+/[^/]+/step_(level_)?\d+)\.(png|jpg|glb|gltf|vox)"
+)
+# Invalidation bus namespace for files that were overwritten, keyed by "{etag}:{path}".
+INVALIDATION_NAMESPACE = 'disk_cache'
+# The ETag of each cached file is kept next to it, so that it isn't hashed on every request.
+ETAG_SUFFIX = '.md5'
+
+
+class CachingStorage(FileStorageBackend):
+    """
+    Read-through local disk cache in front of another backend.
+    Only immutable binary assets are cached (see CACHED_PATHS): anything else goes straight to the underlying backend.
+    The cache folder is capped in size, the least recently used files get evicted first.
+    Writes update the local copy, and with an invalidation bus, evict the copies of other nodes.
+    Without a path nothing is cached, but writes still evict the copies of other nodes.
+    """
+    def __init__(self, backend: FileStorageBackend, path: Optional[str], max_bytes: int) -> None:
+        self.backend = backend
+        self.path = path
+        self.max_bytes = max_bytes
+        # Approximate (other workers may share the folder), corrected whenever we sweep.
+        self.current_bytes = 0
+        self.invalidation_bus = None
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self.sweep()
+
+    def connect_invalidation(self, bus):
+        """Publish writes to, and evict files overwritten elsewhere from, the invalidation bus (see briq_api.invalidation)."""
+        self.invalidation_bus = bus
+        bus.subscribe(self._on_invalidation)
+
+    def _on_invalidation(self, namespace: str, key: Optional[str]):
+        if namespace != INVALIDATION_NAMESPACE or key is None:
+            return
+        etag, path = key.split(":", 1) if ":" in key else (None, key)
+        # Workers of the same node share the folder, and the writer's copy is already the new version.
+        if self._is_cached(path) and self._local_etag(self._local_path(path)) != etag:
+            self.evict(path)
+
+    def evict(self, path: str):
+        local_path = self._local_path(path)
+        for evicted in (local_path, local_path + ETAG_SUFFIX):
+            try:
+                os.remove(evicted)
+            except FileNotFoundError:
+                pass
+
+    def _local_path(self, path: str):
+        key = hashlib.sha1(path.encode()).hexdigest()
+        return os.path.join(self.path, key[:2], key + os.path.splitext(path)[1])
+
+    def _is_cached(self, path: str):
+        return self.path is not None and CACHED_PATHS.fullmatch(path) is not None
+
+    def _store_local(self, path: str, data: bytes, etag: str):
+        local_path = self._local_path(path)
+        try:
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            # Write then rename so that concurrent readers never see a partial file.
+            tmp_path = f"{local_path}.{uuid1().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, local_path)
+            self._store_etag(local_path, etag)
+        except OSError as e:
+            logger.warning("Could not write %(path)s to the disk cache", {"path": path}, exc_info=e)
+            return
+        self.current_bytes += len(data)
+        if self.current_bytes > self.max_bytes:
+            self.sweep()
+
+    def _store_etag(self, local_path: str, etag: str):
+        tmp_path = f"{local_path}.{uuid1().hex}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(etag)
+            os.replace(tmp_path, local_path + ETAG_SUFFIX)
+        except OSError as e:
+            # It will be computed again from the file when needed.
+            logger.warning("Could not write the ETag of %(path)s to the disk cache", {"path": local_path}, exc_info=e)
+
+    def sweep(self):
+        """Evict the least recently used files until we're back under 80% of the budget."""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                # ETags are tiny and go along with their file.
+                if not name.endswith(ETAG_SUFFIX):
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+                    total += stat.st_size
+        if total > self.max_bytes:
+            files.sort()
+            for _, size, local_path in files:
+                if total <= self.max_bytes * 0.8:
+                    break
+                for evicted in (local_path, local_path + ETAG_SUFFIX):
+                    try:
+                        os.remove(evicted)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+        self.current_bytes = total
+
+    # Bytes stuff
+
+    def store_bytes(self, path: str, data: bytes):
+        self.backend.store_bytes(path, data)
+        if CACHED_PATHS.fullmatch(path) is None:
+            return
+        etag = content_md5(data)
+        if self._is_cached(path):
+            self._store_local(path, data, etag)
+        if self.invalidation_bus is not None:
+            self.invalidation_bus.publish(INVALIDATION_NAMESPACE, f"{etag}:{path}")
+
+    def load_bytes(self, path: str):
+        if not self._is_cached(path):
+            return self.backend.load_bytes(path)
+        local_path = self._local_path(path)
+        try:
+            with open(local_path, "rb") as f:
+                data = f.read()
+            # Bump the modification time, which is what eviction goes by.
+            os.utime(local_path)
+            return data
+        except FileNotFoundError:
+            pass
+        data = self.backend.load_bytes(path)
+        self._store_local(path, data, content_md5(data))
+        return data
+
+    def open_stream(self, path: str, chunk_size: int = STREAM_CHUNK_SIZE, start: int = 0, end: Optional[int] = None):
+        if not self._is_cached(path):
+            yield from self.backend.open_stream(path, chunk_size, start, end)
+            return
+        local_path = self._local_path(path)
+        f = self._open_local(local_path)
+        if f is not None:
+            yield from self._read_local(f, chunk_size, start, end)
+        elif start != 0 or end is not None:
+            # Partial reads don't fill the cache.
+            yield from self.backend.open_stream(path, chunk_size, start, end)
+        else:
+            yield from self._fill(local_path, self.backend.open_stream(path, chunk_size))
+
+    def open_stream_with_info(self, path: str, chunk_size: int = STREAM_CHUNK_SIZE, start: int = 0, end: Optional[int] = None):
+        if not self._is_cached(path):
+            return self.backend.open_stream_with_info(path, chunk_size, start, end)
+        local_path = self._local_path(path)
+        f = self._open_local(local_path)
+        if f is not None:
+            try:
+                info = self._local_info(local_path, os.fstat(f.fileno()).st_size)
+            except BaseException:
+                f.close()
+                raise
+            return info, self._read_local(f, chunk_size, start, end)
+        info, chunks = self.backend.open_stream_with_info(path, chunk_size, start, end)
+        if start != 0 or end is not None:
+            # Partial reads don't fill the cache.
+            return info, chunks
+        return info, self._fill(local_path, chunks)
+
+    def _open_local(self, local_path: str):
+        try:
+            f = open(local_path, "rb")
+        except FileNotFoundError:
+            return None
+        # Bump the modification time, which is what eviction goes by.
+        os.utime(local_path)
+        return f
+
+    @staticmethod
+    def _read_local(f, chunk_size: int, start: int, end: Optional[int]):
+        with f:
+            yield from read_chunks(f, chunk_size, start, end)
+
+    def _fill(self, local_path: str, chunks):
+        """Fill the cache with a file as it's streamed, the file only gets moved in place once complete."""
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        tmp_path = f"{local_path}.{uuid1().hex}.tmp"
+        size = 0
+        md5 = hashlib.md5(usedforsecurity=False)
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    md5.update(chunk)
+                    size += len(chunk)
+                    yield chunk
+            os.replace(tmp_path, local_path)
+            self._store_etag(local_path, base64.b64encode(md5.digest()).decode())
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.current_bytes += size
+        if self.current_bytes > self.max_bytes:
+            self.sweep()
+
+    def _local_etag(self, local_path: str) -> Optional[str]:
+        try:
+            with open(local_path + ETAG_SUFFIX) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _local_info(self, local_path: str, size: int):
+        etag = self._local_etag(local_path)
+        if etag is None:
+            # Only happens if the ETag couldn't be written along with the file: hash it once.
+            with open(local_path, "rb") as f:
+                etag = file_md5(f)
+            self._store_etag(local_path, etag)
+        return FileInfo(size=size, etag=etag)
+
+    def get_info(self, path: str):
+        if self._is_cached(path):
+            # The ETag is a hash of the content, so it matches what the backend would say.
+            local_path = self._local_path(path)
+            try:
+                return self._local_info(local_path, os.stat(local_path).st_size)
+            except FileNotFoundError:
+                pass
+        return self.backend.get_info(path)
+
+    # Everything else is passed through.
+
+    def store_json(self, path, data):
+        return self.backend.store_json(path, data)
+
+    def load_json(self, path):
+        return self.backend.load_json(path)
+
+    def has_json(self, path):
+        return self.backend.has_json(path)
+
+    def list_paths(self, path: str):
+        return self.backend.list_paths(path)
+
+    def has_path(self, path: str):
+        if self._is_cached(path) and os.path.exists(self._local_path(path)):
+            return True
+        return self.backend.has_path(path)
+
+    def backup_file(self, path: str):
+        return self.backend.backup_file(path)
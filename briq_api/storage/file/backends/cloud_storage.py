@@ -3,14 +3,17 @@ import json
 import logging
 from random import randint
 from time import time
+from typing import Optional
 from uuid import uuid1
 
 # Imports the Google Cloud client library
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
 # Imported by other files
 from google.cloud.exceptions import NotFound as NotFoundException
 
-from ..file_client import FileStorageBackend
+from briq_api.config import STORAGE_IO_THREADS
+from ..file_client import STREAM_CHUNK_SIZE, FileInfo, FileStorageBackend
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,10 @@ logger = logging.getLogger(__name__)
 class CloudStorage(FileStorageBackend):
     def __init__(self, bucket) -> None:
         self.storage_client = storage.Client()
+        # The client is shared by all the storage threads (and batch loads), the default pool of 10 connections
+        # would make them queue up and reconnect all the time.
+        pool = HTTPAdapter(pool_connections=STORAGE_IO_THREADS, pool_maxsize=STORAGE_IO_THREADS)
+        self.storage_client._http.mount("https://", pool)
         logger.info("Connecting cloud storage to bucket %s", bucket)
         self.bucket = self.storage_client.bucket(bucket)
 
@@ -64,4 +71,46 @@ class CloudStorage(FileStorageBackend):
 
     def load_bytes(self, path: str):
         logger.debug("Loading data from %s", path)
-        return self.bucket.blob(path).download_as_bytes()
+        try:
+            return self.bucket.blob(path).download_as_bytes()
+        except NotFoundException:
+            raise FileNotFoundError
+
+    def open_stream(self, path: str, chunk_size: int = STREAM_CHUNK_SIZE, start: int = 0, end: Optional[int] = None):
+        yield from self.open_stream_with_info(path, chunk_size, start, end)[1]
+
+    def open_stream_with_info(self, path: str, chunk_size: int = STREAM_CHUNK_SIZE, start: int = 0, end: Optional[int] = None):
+        logger.debug("Streaming data from %s", path)
+        blob = self.bucket.get_blob(path)
+        if blob is None:
+            raise FileNotFoundError
+        return self._info(blob), self._stream_blob(blob, chunk_size, start, end)
+
+    def _stream_blob(self, blob: storage.Blob, chunk_size: int, start: int, end: Optional[int]):
+        """
+        A single request for the whole range, read as it comes.
+        The media link is pinned to the blob's generation, so an overwrite can't mix two versions in the body.
+        """
+        headers = {}
+        if start or end is not None:
+            # NB: HTTP ranges include the last byte.
+            headers["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+        with self.storage_client._http.get(blob.media_link, headers=headers, stream=True, timeout=10) as response:
+            if response.status_code == 404:
+                raise FileNotFoundError
+            if response.status_code == 416:
+                # We were already at the end of the file.
+                return
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size)
+
+    def get_info(self, path: str):
+        blob = self.bucket.get_blob(path)
+        if blob is None:
+            raise FileNotFoundError
+        return self._info(blob)
+
+    @staticmethod
+    def _info(blob: storage.Blob) -> FileInfo:
+        # Composite objects have no MD5, fall back to the generation which changes on every write.
+        return FileInfo(size=blob.size, etag=blob.md5_hash or str(blob.generation))
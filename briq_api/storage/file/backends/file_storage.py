@@ -4,8 +4,9 @@ import logging
 import shutil
 import time
 from pathlib import Path
+from typing import Optional
 from uuid import uuid1
-from ..file_client import FileStorageBackend
+from ..file_client import STREAM_CHUNK_SIZE, FileInfo, FileStorageBackend, content_md5, file_md5, read_chunks
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +20,8 @@ class FileStorage(FileStorageBackend):
         self.path = path
         # Fake slowdown for testing
         self.slowdown = slowdown
+        # ETags by path, with the (size, mtime) of the file they were computed for.
+        self.etags: dict[str, tuple[tuple[int, int], str]] = {}
         try:
             os.makedirs(self.path, exist_ok=True)
         except:
@@ -97,6 +100,8 @@ class FileStorage(FileStorageBackend):
             time.sleep(self.slowdown)
         with open(self.path + path, "wb") as f:
             f.write(data)
+            f.flush()
+            self.etags[path] = (self._version(os.fstat(f.fileno())), content_md5(data))
         return True
 
     def load_bytes(self, path: str):
@@ -106,3 +111,26 @@ class FileStorage(FileStorageBackend):
             time.sleep(self.slowdown)
         with open(self.path + path, "rb") as f:
             return f.read()
+
+    def open_stream(self, path: str, chunk_size: int = STREAM_CHUNK_SIZE, start: int = 0, end: Optional[int] = None):
+        logger.info("Streaming data from %s", path)
+        if self.slowdown:
+            time.sleep(self.slowdown)
+        with open(self.path + path, "rb") as f:
+            yield from read_chunks(f, chunk_size, start, end)
+
+    def get_info(self, path: str):
+        if self.slowdown:
+            time.sleep(self.slowdown)
+        with open(self.path + path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            # Only hash the file again if it changed.
+            version, etag = self.etags.get(path, (None, None))
+            if version != self._version(stat):
+                etag = file_md5(f)
+                self.etags[path] = (self._version(stat), etag)
+            return FileInfo(size=stat.st_size, etag=etag)
+
+    @staticmethod
+    def _version(stat: os.stat_result):
+        return (stat.st_size, stat.st_mtime_ns)
@@ -52,7 +52,10 @@ class LegacyCloudStorage(FileStorageBackend):
     def load_bytes(self, path: str):
         logger.debug("Loading data from %s", path)
         path = path.replace(f'{legacy_chain_id}/', '')
-        return self.bucket.blob(self.path + path).download_as_bytes()
+        try:
+            return self.bucket.blob(self.path + path).download_as_bytes()
+        except NotFoundException:
+            raise FileNotFoundError
 
     def has_path(self, path: str) -> bool:
         raise NotImplementedError()
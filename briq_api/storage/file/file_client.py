@@ -1,6 +1,12 @@
+import asyncio
+import base64
+import hashlib
 import logging
 from abc import ABC, abstractmethod
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, BinaryIO, Callable, Iterator, Optional, TypeVar
+from briq_api.config import STORAGE_BATCH_CONCURRENCY, STORAGE_IO_THREADS
 from briq_api.set_identifier import SetRID
 from ..multi_backend_client import StorageClient
 
@@ -8,6 +14,68 @@ logger = logging.getLogger(__name__)
 
 SET_STORAGE_PREFIX = "sets/"
 
+# The storage clients are blocking, so the async API runs them on a dedicated pool,
+# which lets a worker keep many fetches in flight without stalling the event loop.
+storage_io_executor = ThreadPoolExecutor(max_workers=STORAGE_IO_THREADS, thread_name_prefix="storage_io")
+
+# Size of the chunks when streaming files out of storage.
+STREAM_CHUNK_SIZE = 256 * 1024
+
+T = TypeVar('T')
+
+
+@dataclass
+class FileInfo:
+    size: int
+    # Identifies the content: the base64 MD5 of the file, same as what GCS reports.
+    etag: str
+
+
+class FileStream:
+    """The chunks of a file being streamed, along with the info of the version being read."""
+    def __init__(self, chunks: AsyncIterator[bytes], info: FileInfo, close: Callable[[], Any]):
+        self.chunks = chunks
+        self.info = info
+        self.close = close
+
+    def __aiter__(self):
+        return self.chunks
+
+
+def content_md5(data: bytes) -> str:
+    return base64.b64encode(hashlib.md5(data, usedforsecurity=False).digest()).decode()
+
+
+@dataclass
+class FileData:
+    """The content of a file along with its ETag, hashed once so that it can be kept in memory and served as is."""
+    data: bytes
+    etag: str
+
+    @staticmethod
+    def of(data: bytes) -> 'FileData':
+        return FileData(data=data, etag=content_md5(data))
+
+
+def file_md5(f: BinaryIO) -> str:
+    md5 = hashlib.md5(usedforsecurity=False)
+    while chunk := f.read(STREAM_CHUNK_SIZE):
+        md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode()
+
+
+def read_chunks(f: BinaryIO, chunk_size: int, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """Yield the content of a file object from start to end (excluded) in chunks."""
+    f.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+        if not chunk:
+            return
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+
 
 class FileStorageBackend(ABC):
 
@@ -44,6 +112,119 @@ class FileStorageBackend(ABC):
     def load_bytes(self, path: str) -> bytes:
         pass
 
+    def open_stream(self, path: str, chunk_size: int = STREAM_CHUNK_SIZE, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Yield the content of the file in chunks, without holding all of it in memory.
+        Only the bytes from start to end (excluded) are read, if given.
+        Backends that can't stream just load the whole file.
+        """
+        yield self.load_bytes(path)[start:end]
+
+    def get_info(self, path: str) -> FileInfo:
+        data = self.load_bytes(path)
+        return FileInfo(size=len(data), etag=content_md5(data))
+
+    def open_stream_with_info(
+        self, path: str, chunk_size: int = STREAM_CHUNK_SIZE, start: int = 0, end: Optional[int] = None
+    ) -> tuple[FileInfo, Iterator[bytes]]:
+        """
+        open_stream, along with the info of the version of the file that is read.
+        Backends that can't get both from the same version just ask for the info first.
+        """
+        return self.get_info(path), self.open_stream(path, chunk_size, start, end)
+
+    # Batch API: results are returned in the order of the paths, with None for files that don't exist.
+
+    def _load_many(self, load: Callable[[str], T], paths: list[str], max_concurrency: int) -> list[Optional[T]]:
+        def load_or_none(path: str):
+            try:
+                return load(path)
+            except FileNotFoundError:
+                return None
+        if len(paths) <= 1:
+            return [load_or_none(path) for path in paths]
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(paths)), thread_name_prefix="storage_batch") as executor:
+            return list(executor.map(load_or_none, paths))
+
+    def load_json_many(self, paths: list[str], max_concurrency: int = STORAGE_BATCH_CONCURRENCY) -> list[Optional[dict]]:
+        return self._load_many(self.load_json, paths, max_concurrency)
+
+    def load_bytes_many(self, paths: list[str], max_concurrency: int = STORAGE_BATCH_CONCURRENCY) -> list[Optional[bytes]]:
+        return self._load_many(self.load_bytes, paths, max_concurrency)
+
+    # Async API. Backends can override these with natively async versions.
+
+    async def _run_async(self, f, *args):
+        return await asyncio.get_running_loop().run_in_executor(storage_io_executor, f, *args)
+
+    async def astore_json(self, path: str, data: dict):
+        return await self._run_async(self.store_json, path, data)
+
+    async def aload_json(self, path: str) -> dict:
+        return await self._run_async(self.load_json, path)
+
+    async def ahas_json(self, path: str) -> bool:
+        return await self._run_async(self.has_json, path)
+
+    async def alist_paths(self, path: str) -> list[str]:
+        return await self._run_async(self.list_paths, path)
+
+    async def ahas_path(self, path: str) -> bool:
+        return await self._run_async(self.has_path, path)
+
+    async def abackup_file(self, path: str):
+        return await self._run_async(self.backup_file, path)
+
+    async def astore_bytes(self, path: str, data: bytes):
+        return await self._run_async(self.store_bytes, path, data)
+
+    async def aload_bytes(self, path: str) -> bytes:
+        return await self._run_async(self.load_bytes, path)
+
+    async def aget_info(self, path: str) -> FileInfo:
+        return await self._run_async(self.get_info, path)
+
+    async def aopen_stream(
+        self, path: str, chunk_size: int = STREAM_CHUNK_SIZE, start: int = 0, end: Optional[int] = None
+    ) -> FileStream:
+        """
+        Async version of open_stream_with_info. The first chunk is read before returning,
+        so a missing file raises here rather than halfway through sending a response.
+        """
+        info, stream = await self._run_async(self.open_stream_with_info, path, chunk_size, start, end)
+        first_chunk = await self._run_async(next, stream, None)
+
+        async def chunks():
+            try:
+                chunk = first_chunk
+                while chunk is not None:
+                    yield chunk
+                    chunk = await self._run_async(next, stream, None)
+            finally:
+                close()
+
+        def close():
+            # Closing releases the underlying file or connection, and must happen off the event loop.
+            storage_io_executor.submit(stream.close)
+        return FileStream(chunks(), info, close)
+
+    async def _aload_many(self, aload, paths: list[str], max_concurrency: int) -> list:
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def load_or_none(path: str):
+            async with semaphore:
+                try:
+                    return await aload(path)
+                except FileNotFoundError:
+                    return None
+        return await asyncio.gather(*[load_or_none(path) for path in paths])
+
+    async def aload_json_many(self, paths: list[str], max_concurrency: int = STORAGE_BATCH_CONCURRENCY) -> list[Optional[dict]]:
+        return await self._aload_many(self.aload_json, paths, max_concurrency)
+
+    async def aload_bytes_many(self, paths: list[str], max_concurrency: int = STORAGE_BATCH_CONCURRENCY) -> list[Optional[bytes]]:
+        return await self._aload_many(self.aload_bytes, paths, max_concurrency)
+
 
 class FileClient(StorageClient[FileStorageBackend]):
     """
@@ -64,6 +245,19 @@ class FileClient(StorageClient[FileStorageBackend]):
     def has_set_metadata(self, rid: SetRID) -> bool:
         return self.get_backend(rid.chain_id).has_json(self.set_metadata_path(rid))
 
+    async def astore_set_metadata(self, rid: SetRID, data: dict[str, Any]):
+        await self.get_backend(rid.chain_id).astore_json(self.set_metadata_path(rid), data)
+
+    async def aload_set_metadata(self, rid: SetRID) -> dict[str, Any]:
+        return await self.get_backend(rid.chain_id).aload_json(self.set_metadata_path(rid))
+
+    async def ahas_set_metadata(self, rid: SetRID) -> bool:
+        return await self.get_backend(rid.chain_id).ahas_json(self.set_metadata_path(rid))
+
+    async def aload_set_metadata_many(self, chain_id: str, token_ids: list[str]) -> list[Optional[dict[str, Any]]]:
+        paths = [self.set_metadata_path(SetRID(chain_id=chain_id, token_id=token_id)) for token_id in token_ids]
+        return await self.get_backend(chain_id).aload_json_many(paths)
+
     # Set Preview
     def set_preview_path(self, rid: SetRID):
         return f"{SET_STORAGE_PREFIX}{rid.chain_id}/{rid.token_id}.png"
@@ -74,6 +268,31 @@ class FileClient(StorageClient[FileStorageBackend]):
     def load_set_preview(self, rid: SetRID) -> bytes:
         return self.get_backend(rid.chain_id).load_bytes(self.set_preview_path(rid))
 
+    async def astore_set_preview(self, rid: SetRID, data: bytes):
+        await self.get_backend(rid.chain_id).astore_bytes(self.set_preview_path(rid), data)
+
+    async def aload_set_preview(self, rid: SetRID) -> bytes:
+        return await self.get_backend(rid.chain_id).aload_bytes(self.set_preview_path(rid))
+
+    async def aopen_set_preview_stream(self, rid: SetRID, start: int = 0, end: Optional[int] = None) -> FileStream:
+        return await self.get_backend(rid.chain_id).aopen_stream(self.set_preview_path(rid), start=start, end=end)
+
+    async def aget_set_preview_info(self, rid: SetRID) -> FileInfo:
+        return await self.get_backend(rid.chain_id).aget_info(self.set_preview_path(rid))
+
+    async def ahas_set_preview(self, rid: SetRID) -> bool:
+        return await self.get_backend(rid.chain_id).ahas_path(self.set_preview_path(rid))
+
+    # Set small preview (a JPG thumbnail of the preview)
+    def set_small_preview_path(self, rid: SetRID):
+        return f"{SET_STORAGE_PREFIX}{rid.chain_id}/{rid.token_id}_small.jpg"
+
+    async def astore_set_small_preview(self, rid: SetRID, data: bytes):
+        await self.get_backend(rid.chain_id).astore_bytes(self.set_small_preview_path(rid), data)
+
+    async def aload_set_small_preview(self, rid: SetRID) -> bytes:
+        return await self.get_backend(rid.chain_id).aload_bytes(self.set_small_preview_path(rid))
+
     # Set Model
     def set_model_path(self, rid: SetRID, kind: str):
         return f"{SET_STORAGE_PREFIX}{rid.chain_id}/{rid.token_id}.{kind}"
@@ -83,3 +302,15 @@ class FileClient(StorageClient[FileStorageBackend]):
 
     def load_set_model(self, rid: SetRID, kind: str) -> bytes:
         return self.get_backend(rid.chain_id).load_bytes(self.set_model_path(rid, kind))
+
+    async def astore_set_model(self, rid: SetRID, kind: str, data: bytes):
+        await self.get_backend(rid.chain_id).astore_bytes(self.set_model_path(rid, kind), data)
+
+    async def aload_set_model(self, rid: SetRID, kind: str) -> bytes:
+        return await self.get_backend(rid.chain_id).aload_bytes(self.set_model_path(rid, kind))
+
+    async def aopen_set_model_stream(self, rid: SetRID, kind: str, start: int = 0, end: Optional[int] = None) -> FileStream:
+        return await self.get_backend(rid.chain_id).aopen_stream(self.set_model_path(rid, kind), start=start, end=end)
+
+    async def aget_set_model_info(self, rid: SetRID, kind: str) -> FileInfo:
+        return await self.get_backend(rid.chain_id).aget_info(self.set_model_path(rid, kind))
@@ -1,19 +1,21 @@
 import logging
 import os
 
-from briq_api.config import ENV
+from briq_api.config import CACHE_INVALIDATION_BACKEND, CACHE_INVALIDATION_SOCKET_PATH, DISK_CACHE_MAX_BYTES, DISK_CACHE_PATH, ENV
 
 from .chain.networks import MAINNET, TESTNET, TESTNET_LEGACY
 
 from briq_api.genesis_data.genesis_storage import GenesisStorage
+from briq_api.storage.file.backends.caching_storage import CachingStorage
 from briq_api.storage.file.backends.cloud_storage import CloudStorage
 from briq_api.storage.file.backends.file_storage import FileStorage
 from briq_api.storage.file.backends.legacy_cloud_storage import LegacyCloudStorage
 from briq_api.indexer.storage import mongo_storage, MongoBackend
+from briq_api.invalidation import invalidation_bus, LocalSocketInvalidationBackend, MongoInvalidationBackend
 from .storage.file.file_client import FileClient
 
 from briq_api.indexer.config import INDEXER_ID
-from briq_api.memory_cache import CacheData
+from briq_api.memory_cache import CacheData, CacheNamespace, shared_memory_cache
 from briq_api.storage.file.file_client import FileStorageBackend
 from briq_api.storage.multi_backend_client import StorageClient
 
@@ -22,31 +24,48 @@ logger = logging.getLogger(__name__)
 
 
 class ThemeStorage(StorageClient[FileStorageBackend]):
-    _memcache: dict[str, CacheData[dict[str, str]]] = {}
+    _memcache: CacheNamespace = shared_memory_cache.namespace('theme_storage', shared=True)
 
     def __init__(self) -> None:
         super().__init__()
         # Decorate out of band so I can use self (so I can reset the cache).
         # (this feels kinda horrible, but alternatives have bad tradeoffs as well)
         # Guess I could just not reuse the cache decorator.
-        self.get_booklet_spec = CacheData.memory_cache(lambda chain_id: f'{chain_id}_booklet_spec', timeout=5 * 60, memcache=self._memcache)(self.get_booklet_spec)
+        self.get_booklet_spec = CacheData.memory_cache(
+            lambda chain_id: f'{chain_id}_booklet_spec',
+            timeout=5 * 60,
+            memcache=self._memcache,
+            single_flight=True,
+            stale_ttl=60 * 60,
+        )(self.get_booklet_spec)
 
     @staticmethod
     def booklet_path():
         return "genesis_themes/booklet_spec.json"
 
-    def get_booklet_spec(self, chain_id: str) -> dict[str, str]:
-        return self.get_backend(chain_id).load_json(self.booklet_path())
-
-    def reset_cache(self):
-        self._memcache.clear()
+    async def get_booklet_spec(self, chain_id: str) -> dict[str, str]:
+        return await self.get_backend(chain_id).aload_json(self.booklet_path())
 
+    async def aload_booklet_spec(self, chain_id: str) -> dict[str, str]:
+        """The booklet spec as currently stored, bypassing the cache (which can be stale for an hour): use it to update the spec."""
+        return await self.get_backend(chain_id).aload_json(self.booklet_path())
 
-@CacheData.memory_cache(lambda chain_id, theme_id: f'{chain_id}_{theme_id}_auction_json_data', timeout=5 * 60)
-def get_auction_json_data(chain_id: str, theme_id: str):
+    def reset_cache(self):
+        # This also resets the cache of other instances, if there is an invalidation bus.
+        self._memcache.invalidate()
+
+
+@CacheData.memory_cache(
+    lambda chain_id, theme_id: f'{chain_id}_{theme_id}_auction_json_data',
+    timeout=5 * 60,
+    single_flight=True,
+    stale_ttl=60 * 60,
+    shared=True,
+)
+async def get_auction_json_data(chain_id: str, theme_id: str):
     if theme_id == 'ducks_everywhere':
         try:
-            return file_storage.get_backend(chain_id).load_json(f"auctions/{theme_id}/auction_data.json")
+            return await file_storage.get_backend(chain_id).aload_json(f"auctions/{theme_id}/auction_data.json")
         except Exception:
             # Ignore, we'll just return an empty dict
             return {}
@@ -58,21 +77,30 @@ genesis_storage = GenesisStorage()
 theme_storage = ThemeStorage()
 
 
+disk_caches: list[CachingStorage] = []
+
+
+def with_disk_cache(backend: FileStorageBackend) -> FileStorageBackend:
+    # Even without a disk cache here, writes must evict the copies cached by other instances.
+    disk_caches.append(CachingStorage(backend, DISK_CACHE_PATH or None, DISK_CACHE_MAX_BYTES))
+    return disk_caches[-1]
+
+
 def setup_stores(local: bool, use_mock_chain: bool):
     if not local:
         logger.info("Connecting normally.")
 
-        file_storage.connect_for_chain(TESTNET_LEGACY.id, backend=LegacyCloudStorage(TESTNET_LEGACY.storage_bucket))
+        file_storage.connect_for_chain(TESTNET_LEGACY.id, backend=with_disk_cache(LegacyCloudStorage(TESTNET_LEGACY.storage_bucket)))
 
         # For now, starknet-testnet is connected to the test bucket only in test env.
         if ENV != 'prod':
-            cloud_storage = CloudStorage(os.getenv("CLOUD_STORAGE_BUCKET") or 'briq-bucket-test-1')
+            cloud_storage = with_disk_cache(CloudStorage(os.getenv("CLOUD_STORAGE_BUCKET") or 'briq-bucket-test-1'))
             file_storage.connect_for_chain(TESTNET.id, backend=cloud_storage)
             file_storage.connect_for_chain(MAINNET.id, backend=cloud_storage)
             theme_storage.connect_for_chain(TESTNET.id, backend=cloud_storage)
             theme_storage.connect_for_chain(MAINNET.id, backend=cloud_storage)
         else:
-            cloud_storage = CloudStorage(MAINNET.storage_bucket)
+            cloud_storage = with_disk_cache(CloudStorage(MAINNET.storage_bucket))
             file_storage.connect_for_chain(MAINNET.id, backend=cloud_storage)
             theme_storage.connect_for_chain(MAINNET.id, backend=cloud_storage)
 
@@ -102,3 +130,23 @@ def setup_stores(local: bool, use_mock_chain: bool):
         # Add an artificial slowdown
         mock_storage.slowdown = 0.2
         file_storage.connect_for_chain('mock', mock_storage)
+
+    setup_invalidation()
+
+
+def setup_invalidation():
+    try:
+        if CACHE_INVALIDATION_BACKEND == 'mongo':
+            # Any DB will do, all instances just need to agree.
+            invalidation_bus.connect(MongoInvalidationBackend(mongo_storage.get_backend(MAINNET.id)))
+        elif CACHE_INVALIDATION_BACKEND == 'socket':
+            invalidation_bus.connect(LocalSocketInvalidationBackend(CACHE_INVALIDATION_SOCKET_PATH))
+        else:
+            return
+    except Exception as e:
+        logger.error("Could not set up cache invalidation, caches will only be reset locally.", exc_info=e)
+        return
+    logger.info("Connected cache invalidation bus (%(backend)s).", {"backend": CACHE_INVALIDATION_BACKEND})
+    shared_memory_cache.connect_invalidation(invalidation_bus)
+    for disk_cache in disk_caches:
+        disk_cache.connect_invalidation(invalidation_bus)
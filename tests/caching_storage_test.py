@@ -0,0 +1,101 @@
+import os
+
+from briq_api.invalidation import InvalidationBus
+from briq_api.storage.file.backends.caching_storage import CachingStorage
+from briq_api.storage.file.backends.file_storage import FileStorage
+
+
+def test_caching_storage(tmp_path):
+    backend = FileStorage(str(tmp_path / "remote") + "/")
+    storage = CachingStorage(backend, str(tmp_path / "cache"), max_bytes=250)
+
+    backend.store_bytes("sets/a.png", b"a" * 100)
+    assert storage.load_bytes("sets/a.png") == b"a" * 100
+    # Served from the disk cache from now on.
+    os.remove(str(tmp_path / "remote" / "sets" / "a.png"))
+    assert storage.load_bytes("sets/a.png") == b"a" * 100
+
+    # Not immutable, so not cached.
+    storage.store_json("a.json", {"a": 1})
+    assert not os.path.exists(storage._local_path("a.json"))
+    storage.store_bytes("genesis_themes/theme/cover_prelaunch_high.jpg", b"cover")
+    assert not os.path.exists(storage._local_path("genesis_themes/theme/cover_prelaunch_high.jpg"))
+
+    # Going over budget evicts the least recently used files.
+    os.utime(storage._local_path("sets/a.png"), (0, 0))
+    storage.store_bytes("sets/b.png", b"b" * 100)
+    storage.store_bytes("sets/c.png", b"c" * 100)
+    assert not os.path.exists(storage._local_path("sets/a.png"))
+    assert storage.load_bytes("sets/b.png") == b"b" * 100
+    assert storage.current_bytes <= 200
+
+
+def test_caching_storage_stream(tmp_path):
+    backend = FileStorage(str(tmp_path / "remote") + "/")
+    storage = CachingStorage(backend, str(tmp_path / "cache"), max_bytes=1000)
+
+    backend.store_bytes("sets/a.vox", b"0123456789")
+    assert b"".join(storage.open_stream("sets/a.vox", chunk_size=4)) == b"0123456789"
+    # Streaming filled the cache.
+    os.remove(str(tmp_path / "remote" / "sets" / "a.vox"))
+    assert b"".join(storage.open_stream("sets/a.vox", chunk_size=4)) == b"0123456789"
+
+    # The info comes from the copy that is read.
+    backend.store_bytes("sets/a.vox", b"changed")
+    info, chunks = storage.open_stream_with_info("sets/a.vox", chunk_size=4)
+    assert b"".join(chunks) == b"0123456789"
+    assert info == storage.get_info("sets/a.vox")
+    assert info.size == 10
+
+
+def test_caching_storage_etag(tmp_path):
+    backend = FileStorage(str(tmp_path / "remote") + "/")
+    storage = CachingStorage(backend, str(tmp_path / "cache"), max_bytes=1000)
+
+    backend.store_bytes("sets/a.glb", b"0123456789")
+    backend.store_bytes("sets/b.glb", b"0123456789")
+    assert storage.load_bytes("sets/a.glb") == b"0123456789"
+    assert b"".join(storage.open_stream("sets/b.glb", chunk_size=4)) == b"0123456789"
+    for path in ("sets/a.glb", "sets/b.glb"):
+        assert storage.get_info(path) == backend.get_info(path)
+        # Computed when caching, the file isn't read again.
+        with open(storage._local_path(path), "r+b") as f:
+            f.write(b"X")
+        assert storage.get_info(path) == backend.get_info(path)
+
+
+def test_caching_storage_invalidation(tmp_path):
+    backend = FileStorage(str(tmp_path / "remote") + "/")
+    published = []
+
+    class FakeBackend:
+        def publish(self, message):
+            published.append(message)
+
+    # Two nodes with their own disk cache, another worker of the first node, and a writer without a disk cache.
+    nodes = [CachingStorage(backend, str(tmp_path / f"cache_{i}"), max_bytes=1000) for i in range(2)]
+    same_node = CachingStorage(backend, str(tmp_path / "cache_0"), max_bytes=1000)
+    writer = CachingStorage(backend, None, max_bytes=1000)
+    buses = [InvalidationBus() for _ in range(4)]
+    for storage, bus in zip([*nodes, same_node, writer], buses):
+        bus.connect(FakeBackend())
+        storage.connect_invalidation(bus)
+
+    backend.store_bytes("sets/a.png", b"placeholder")
+    assert all(node.load_bytes("sets/a.png") == b"placeholder" for node in nodes)
+
+    # Overwrites evict the copies of the other nodes.
+    for storage, data in [(nodes[0], b"preview"), (writer, b"new preview")]:
+        published.clear()
+        storage.store_bytes("sets/a.png", data)
+        for bus in buses:
+            bus._on_message(published[0])
+        assert [node.load_bytes("sets/a.png") for node in nodes] == [data, data]
+
+    # The other workers of the writer's node keep the copy it just wrote.
+    published.clear()
+    nodes[0].store_bytes("sets/a.png", b"final preview")
+    os.remove(str(tmp_path / "remote" / "sets" / "a.png"))
+    for bus in buses:
+        bus._on_message(published[0])
+    assert same_node.load_bytes("sets/a.png") == b"final preview"
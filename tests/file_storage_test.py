@@ -0,0 +1,39 @@
+import pytest
+
+from briq_api.storage.file.backends.file_storage import FileStorage
+
+
+@pytest.mark.asyncio
+async def test_load_many(tmp_path):
+    storage = FileStorage(str(tmp_path) + "/")
+    for i in range(20):
+        storage.store_json(f"{i}.json", {"i": i})
+    paths = [f"{i}.json" for i in range(20)] + ["missing.json"]
+
+    expected = [{"i": i} for i in range(20)] + [None]
+    assert storage.load_json_many(paths, max_concurrency=4) == expected
+    assert await storage.aload_json_many(paths, max_concurrency=4) == expected
+
+
+@pytest.mark.asyncio
+async def test_open_stream(tmp_path):
+    storage = FileStorage(str(tmp_path) + "/")
+    storage.store_bytes("a.glb", b"0123456789")
+
+    assert list(storage.open_stream("a.glb", chunk_size=4)) == [b"0123", b"4567", b"89"]
+    assert [chunk async for chunk in await storage.aopen_stream("a.glb", chunk_size=4)] == [b"0123", b"4567", b"89"]
+    # Missing files must fail before any response gets sent.
+    with pytest.raises(FileNotFoundError):
+        await storage.aopen_stream("missing.glb")
+
+
+def test_get_info(tmp_path):
+    storage = FileStorage(str(tmp_path) + "/")
+    storage.store_bytes("a.glb", b"0123456789")
+    info = storage.get_info("a.glb")
+    assert info.size == 10
+    # Only hashed again when the file changes.
+    assert storage.get_info("a.glb") == info
+    storage.store_bytes("a.glb", b"9876543210")
+    assert storage.get_info("a.glb").etag != info.etag
+    assert FileStorage(str(tmp_path) + "/").get_info("a.glb") == storage.get_info("a.glb")
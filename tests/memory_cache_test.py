@@ -1,4 +1,13 @@
-from briq_api.memory_cache import CacheData
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from briq_api.memory_cache import CacheData, LRUCache, approximate_size
+from briq_api.invalidation import InvalidationBus
+from briq_api.shared_cache import SharedCache
+from briq_api.storage.file.file_client import FileData
 
 i = 0
 def get_data(chain_id: str) -> str:
@@ -17,3 +26,200 @@ def test_memory_cache():
     _memcache.clear()
     assert cached_get_data('a') == 'a2'
     assert cached_get_data('a') == 'a2'
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_single_flight():
+    calls = []
+
+    async def slow_get_data(chain_id: str) -> str:
+        calls.append(chain_id)
+        await asyncio.sleep(0.05)
+        return chain_id + str(len(calls))
+
+    cached_get_data = CacheData.memory_cache(lambda chain_id: f'{chain_id}', timeout=5 * 60, single_flight=True)(slow_get_data)
+
+    results = await asyncio.gather(*[cached_get_data('a') for _ in range(10)])
+    assert results == ['a1'] * 10
+    assert len(calls) == 1
+
+
+def test_memory_cache_single_flight_sync():
+    calls = []
+
+    def slow_get_data(chain_id: str) -> str:
+        calls.append(chain_id)
+        time.sleep(0.05)
+        return chain_id + str(len(calls))
+
+    cached_get_data = CacheData.memory_cache(lambda chain_id: f'{chain_id}', timeout=5 * 60, single_flight=True)(slow_get_data)
+
+    with ThreadPoolExecutor(10) as pool:
+        results = list(pool.map(cached_get_data, ['a'] * 10))
+    assert results == ['a1'] * 10
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_stale_while_revalidate():
+    _memcache = {}
+    calls = []
+
+    async def slow_get_data(chain_id: str) -> str:
+        calls.append(chain_id)
+        await asyncio.sleep(0.05)
+        return chain_id + str(len(calls))
+
+    cached_get_data = CacheData.memory_cache(lambda chain_id: chain_id, timeout=5 * 60, memcache=_memcache, stale_ttl=60)(slow_get_data)
+
+    assert await cached_get_data('a') == 'a1'
+    # Expire the entry, it should still be served while a refresh happens in the background.
+    _memcache['a'].timeout = int(time.time()) - 1
+    assert await cached_get_data('a') == 'a1'
+    assert await cached_get_data('a') == 'a1'
+    await asyncio.sleep(0.1)
+    assert await cached_get_data('a') == 'a2'
+    assert len(calls) == 2
+
+    # Past the stale TTL, this is a regular miss.
+    _memcache['a'].timeout = int(time.time()) - 61
+    assert await cached_get_data('a') == 'a3'
+
+
+def test_lru_cache_budget():
+    lru = LRUCache(max_entries=3, max_bytes=100)
+    a = lru.namespace('a')
+    b = lru.namespace('b', max_bytes=30)
+
+    a['1'] = b'x' * 10
+    a['2'] = b'x' * 10
+    b['1'] = b'x' * 10
+    # Touch a/1 so a/2 is the least recently used entry.
+    assert a['1'] == b'x' * 10
+    a['3'] = b'x' * 10
+    assert '2' not in a
+    assert set(a) == {'1', '3'} and set(b) == {'1'}
+
+    # Namespace quota only evicts from that namespace.
+    b['2'] = b'x' * 25
+    assert set(b) == {'2'}
+    assert set(a) == {'1', '3'}
+    assert lru.bytes == 45
+
+    # Global byte budget.
+    a['4'] = b'x' * 60
+    assert set(a) == {'3', '4'} and set(b) == {'2'}
+    assert lru.bytes == 95
+
+    # Values over budget are simply not cached.
+    a['5'] = b'x' * 200
+    assert '5' not in a
+
+
+def test_approximate_size():
+    assert approximate_size([b"a" * 10] * 3) == 56 + 3 * 18
+    # Big containers are sampled, which is exact for uniform items.
+    briqs = [{"pos": [1, 2, 3], "color": "#ffaa00"} for _ in range(10000)]
+    assert approximate_size(briqs) == 56 + 10000 * (approximate_size(briqs[0]) + 8)
+    # Dataclasses, e.g. files kept with their ETag, go by their fields.
+    assert approximate_size(FileData.of(b"a" * 1000)) > 1000
+
+
+def test_lru_cache_ttl():
+    lru = LRUCache(max_entries=10, max_bytes=100)
+    ns = lru.namespace('ttl', ttl=60)
+    ns['a'] = b'a'
+    assert ns['a'] == b'a'
+    ns._entries['a'].expires_at = time.time() - 1
+    assert 'a' not in ns
+    assert lru.entries == 0
+
+
+def test_lru_cache_shared_tier(tmp_path):
+    shared = SharedCache(str(tmp_path), max_bytes=1000, max_age=60)
+    # Two LRU caches standing in for two workers.
+    worker_a = LRUCache(max_entries=10, max_bytes=1000, shared=shared).namespace('ns', shared=True)
+    worker_b = LRUCache(max_entries=10, max_bytes=1000, shared=shared).namespace('ns', shared=True)
+
+    worker_a['key'] = CacheData(data={'a': 1}, timeout=0)
+    assert worker_b['key'].data == {'a': 1}
+
+    worker_a.clear()
+    assert 'key' not in worker_a
+    worker_b.clear()
+    assert 'key' not in worker_b
+
+
+def test_memory_cache_stale_local_checks_shared_tier(tmp_path):
+    shared = SharedCache(str(tmp_path), max_bytes=1000, max_age=60)
+    worker_a = LRUCache(max_entries=10, max_bytes=1000, shared=shared).namespace('ns', shared=True)
+    worker_b = LRUCache(max_entries=10, max_bytes=1000, shared=shared).namespace('ns', shared=True)
+    calls = []
+
+    @CacheData.memory_cache(lambda key: key, timeout=60, memcache=worker_b)
+    def load(key):
+        calls.append(key)
+        return 'loaded'
+
+    worker_b['key'] = CacheData(data='expired', timeout=0)
+    # Another worker refreshed it in the meantime.
+    worker_a['key'] = CacheData(data='fresh', timeout=int(time.time()) + 60)
+    assert load('key') == 'fresh'
+    assert calls == []
+    assert worker_b._entries['key'].value.data == 'fresh'
+
+
+def test_lru_cache_invalidation():
+    bus = InvalidationBus()
+    published = []
+
+    class FakeBackend:
+        def publish(self, message):
+            published.append(message)
+
+    bus.connect(FakeBackend())
+    # Two LRU caches standing in for two workers, only one of which is connected to the bus.
+    worker_a = LRUCache(max_entries=10, max_bytes=1000)
+    worker_a.connect_invalidation(bus)
+    worker_b = LRUCache(max_entries=10, max_bytes=1000)
+    worker_a.namespace('ns')['key'] = b'a'
+    worker_b.namespace('ns')['key'] = b'b'
+
+    worker_a.namespace('ns').invalidate('key')
+    assert 'key' not in worker_a.namespace('ns')
+    assert published == [{'origin': bus.origin, 'namespace': 'ns', 'key': 'key'}]
+
+    # Deliver the message to the other worker.
+    other_bus = InvalidationBus()
+    worker_b.connect_invalidation(other_bus)
+    other_bus._on_message(published[0])
+    assert 'key' not in worker_b.namespace('ns')
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_peek_and_prime():
+    calls = []
+
+    async def get_data_async(chain_id: str) -> str:
+        calls.append(chain_id)
+        return chain_id
+
+    cached_get_data = CacheData.memory_cache(lambda chain_id: f'{chain_id}', timeout=5 * 60, memcache={})(get_data_async)
+    assert cached_get_data.peek('a') is None
+    cached_get_data.prime('primed', 'a')
+    assert cached_get_data.peek('a') == 'primed'
+    assert await cached_get_data('a') == 'primed'
+    assert calls == []
+
+
+def test_lru_cache_invalidation_shared_tier(tmp_path):
+    shared = SharedCache(str(tmp_path), max_bytes=1000, max_age=60)
+    lru = LRUCache(max_entries=10, max_bytes=1000, shared=shared)
+    # Over the namespace quota: only in the shared tier.
+    namespace = lru.namespace('ns', max_bytes=10, shared=True)
+    namespace['key'] = b'x' * 100
+    assert shared.get('ns', 'key') == b'x' * 100
+
+    lru._on_invalidation('ns', 'key')
+    assert shared.get('ns', 'key') is None
+    namespace.invalidate('missing')
@@ -1,10 +1,12 @@
 import json
+import numpy as np
 import pytest
 import pygltflib
 
-from pyvox.writer import VoxWriter
-
 from briq_api.mesh.briq import BriqData
+from briq_api.mesh.gltf import to_primitives
+from briq_api.mesh.layers import layered_glbs, mesh_level, split_levels
+from briq_api.mesh.lod import downsample
 
 def test_briq_to_gltf(briq_data):
     briq = BriqData().load(json.loads(briq_data))
@@ -17,11 +19,184 @@ def test_briq_to_vox(briq_data):
     voxFile = briq.to_vox("test.vox")
     voxFile.to_bytes()
     # Not truncated
-    assert len(voxFile.vox.models[0].voxels) == 3
+    assert len(voxFile.models[0].voxels) == 3
 
 def test_large_briq_to_vox(too_large_for_vox_briq_data):
     briq = BriqData().load(json.loads(too_large_for_vox_briq_data))
     voxFile = briq.to_vox("test.vox")
-    voxFile.to_bytes()
-    # Truncated
-    assert len(voxFile.vox.models[0].voxels) == 256
+    data = voxFile.to_bytes()
+    # Split into models of at most 256 voxels along each axis, rather than truncated.
+    assert [len(model.voxels) for model in voxFile.models] == [256, 44]
+    assert [model.offset for model in voxFile.models] == [(0, 0, 0), (256, 0, 0)]
+    assert data[:4] == b'VOX ' and data.count(b'XYZI') == 2
+
+
+def test_inner_faces_removed():
+    briqs = [
+        {"pos": [0, 0, 0], "data": {"material": "0x1", "color": "#c5ac73"}},
+        {"pos": [1, 0, 0], "data": {"material": "0x1", "color": "#c5ac73"}},
+    ]
+    [primitive] = to_primitives(briqs)
+    # Shared corners are merged and the two faces touching each other are gone.
+    assert primitive.points.shape == (12, 3)
+    assert primitive.triangles.shape == (20, 3)
+    assert primitive.points[primitive.triangles].min() == -0.5
+
+
+def test_greedy_meshing():
+    wall = [{"pos": [x, y, 0], "data": {"material": "0x1", "color": "#c5ac73"}} for x in range(10) for y in range(5)]
+    [primitive] = to_primitives(wall, greedy=True)
+    # A box is 6 rectangles.
+    assert primitive.points.shape == (8, 3)
+    assert primitive.triangles.shape == (12, 3)
+    # Faces point outwards: the signed volume is that of the wall.
+    triangles = primitive.points[primitive.triangles]
+    assert abs(np.einsum('ij,ij->i', triangles[:, 0], np.cross(triangles[:, 1], triangles[:, 2])).sum() / 6 - 50) < 1e-6
+    BriqData().load({"briqs": wall}).to_gltf(greedy=True).save_to_bytes()
+
+
+def test_hidden_faces_culled_across_colors():
+    colors = ["#ff0000", "#00ff00"]
+    cube = [
+        {"pos": [x, y, z], "data": {"material": "0x1", "color": colors[(x + y + z) % 2]}}
+        for x in range(3) for y in range(3) for z in range(3)
+    ]
+    for greedy in (False, True):
+        primitives = to_primitives(cube, greedy=greedy)
+        # Only the outside of the cube is left.
+        triangles = [p.points[p.triangles] for p in primitives]
+        area = sum(np.linalg.norm(np.cross(t[:, 1] - t[:, 0], t[:, 2] - t[:, 0]), axis=1).sum() / 2 for t in triangles)
+        assert abs(area - 6 * 9) < 1e-6
+    # Glass doesn't hide the faces behind it, but opaque briqs hide glass faces.
+    glass = [
+        {"pos": [0, 0, 0], "data": {"material": "0x1", "color": "#ff0000"}},
+        {"pos": [1, 0, 0], "data": {"material": "0x3", "color": "#ffffff"}},
+    ]
+    assert [len(p.triangles) for p in to_primitives(glass)] == [12, 10]
+
+
+def test_buried_color_group():
+    cube = [
+        {"pos": [x, y, z], "data": {"material": "0x1", "color": "#0000ff" if (x, y, z) == (1, 1, 1) else "#ff0000"}}
+        for x in range(3) for y in range(3) for z in range(3)
+    ]
+    for greedy in (False, True):
+        assert [p.material.color for p in to_primitives(cube, greedy=greedy)] == ["#ff0000"]
+    assert BriqData().load_briqs(cube).to_glb()[:4] == b'glTF'
+
+
+def test_briq_to_glb(briq_data):
+    briq = BriqData().load(json.loads(briq_data))
+    glb = briq.to_glb()
+    parsed = pygltflib.GLTF2.load_from_bytes(glb)
+    reference = briq.to_gltf()
+    assert parsed.binary_blob() == reference.binary_blob()
+    assert len(parsed.meshes[0].primitives) == len(reference.meshes[0].primitives)
+    assert parsed.accessors[1].max == reference.accessors[1].max
+
+
+def test_quantized_glb(briq_data):
+    briq = BriqData().load(json.loads(briq_data))
+    gltf = pygltflib.GLTF2.load_from_bytes(briq.to_glb(quantize=True))
+    assert gltf.extensionsRequired == ["KHR_mesh_quantization"]
+    indices, positions = gltf.accessors[0], gltf.accessors[1]
+    assert indices.componentType == pygltflib.UNSIGNED_SHORT
+    assert positions.componentType == pygltflib.SHORT
+    # Stored doubled, the node scales them back.
+    assert np.array(positions.max) * gltf.nodes[0].scale == pytest.approx(briq.to_gltf().accessors[1].max)
+
+
+def test_briq_to_png():
+    briqs = [
+        {"pos": [0, 0, 0], "data": {"material": "0x1", "color": "#ff0000"}},
+        {"pos": [0, 0, 1], "data": {"material": "0x1", "color": "#00ff00"}},
+        {"pos": [1, 1, 0], "data": {"material": "0x1", "color": "#0000ff"}},
+    ]
+    image = BriqData().load({"briqs": briqs}).to_png()
+    assert image.size == (64, 64)
+    # Projected along z, the last briq drawn wins. The y axis is flipped.
+    assert image.getpixel((0, 63)) == (0, 255, 0, 255)
+    assert image.getpixel((63, 0)) == (0, 0, 255, 255)
+    assert image.getpixel((63, 63)) == (0, 0, 0, 0)
+
+
+def test_briq_to_preview():
+    cube = [{"pos": [x, y, z], "data": {"material": "0x1", "color": "#c5ac73"}} for x in range(4) for y in range(4) for z in range(4)]
+    image = BriqData().load({"briqs": cube}).to_preview(max_size=256)
+    assert max(image.size) <= 256
+    pixels = np.asarray(image)
+    # The top is lit, the sides are shaded, and the cube is drawn without holes.
+    top, side = pixels[image.height // 4, image.width // 2], pixels[image.height * 3 // 4, image.width // 4]
+    assert tuple(top) == (0xc5, 0xac, 0x73, 255)
+    assert side[3] == 255 and side[0] < top[0]
+    opaque = pixels[:, :, 3] > 0
+    assert opaque[image.height // 2].sum() == image.width
+    # Sets larger than the image are drawn with coarser briqs.
+    spread = [{"pos": pos, "data": {"material": "0x1", "color": "#c5ac73"}} for pos in ([0, 0, 0], [6000, 0, 0], [0, 0, 6000])]
+    assert max(BriqData().load({"briqs": spread}).to_preview(max_size=256).size) <= 256
+
+
+def test_briq_data_columns(briq_data):
+    briq = BriqData().load(json.loads(briq_data))
+    assert briq.positions.dtype == np.int32 and briq.positions.shape == (len(briq), 3)
+    assert briq.colors.dtype == np.uint32 and briq.materials.dtype == np.uint16
+    # Round-trips to the JSON format.
+    assert BriqData().load({"briqs": briq.briqs}).briqs == briq.briqs
+    assert briq.select(briq.positions[:, 1] == briq.positions[0, 1]).briqs[0] == briq.briqs[0]
+    # Exporters take either.
+    assert to_primitives(briq)[0].triangles.tolist() == to_primitives(briq.briqs)[0].triangles.tolist()
+
+
+def test_layered_glbs():
+    colors = ["#ff0000", "#00ff00"]
+    briqs = [
+        {"pos": [x, y, z], "data": {"material": "0x1", "color": colors[(x + y + z) % 2]}}
+        for x in range(3) for y in range(-1, 3) for z in range(3)
+    ]
+    # Level 4 isn't reached, level 3 is missing.
+    briqs.append({"pos": [0, 4, 0], "data": {"material": "0x1", "color": "#ff0000"}})
+    levels = split_levels(BriqData().load_briqs(briqs))
+    # Briqs under the ground come with the first step.
+    assert [len(level.briqs) for level in levels] == [9, 9, 9]
+    assert [len(level.added) for level in levels] == [18, 9, 9]
+    steps, level_glbs = layered_glbs([mesh_level(level) for level in levels])
+    assert len(steps) == len(level_glbs) == 3
+
+    def area(glb):
+        gltf = pygltflib.GLTF2.load_from_bytes(glb)
+        blob = gltf.binary_blob()
+        total = 0
+        for mesh in gltf.meshes:
+            for prim in mesh.primitives:
+                views = [gltf.bufferViews[gltf.accessors[i].bufferView] for i in (prim.indices, prim.attributes.POSITION)]
+                dtype = np.uint16 if gltf.accessors[prim.indices].componentType == pygltflib.UNSIGNED_SHORT else np.uint32
+                indices = np.frombuffer(blob, dtype, count=gltf.accessors[prim.indices].count, offset=views[0].byteOffset)
+                count = gltf.accessors[prim.attributes.POSITION].count
+                points = np.frombuffer(blob, np.float32, count=count * 3, offset=views[1].byteOffset).reshape(-1, 3)
+                t = points[indices.reshape(-1, 3)]
+                total += np.linalg.norm(np.cross(t[:, 1] - t[:, 0], t[:, 2] - t[:, 0]), axis=1).sum() / 2
+        return total
+    # Each step is a 3x3 tower, plus the tops of the levels below that are covered in later steps.
+    assert [area(glb) for glb in steps] == pytest.approx([4 * 6 + 18, 4 * 9 + 18 + 9, 4 * 12 + 18 + 18])
+    assert [area(glb) for glb in level_glbs] == pytest.approx([4 * 3 + 18] * 3)
+
+
+def test_lod_glb(briq_data):
+    briqs = [
+        {"pos": [0, 0, 0], "data": {"material": "0x1", "color": "#ff0000"}},
+        {"pos": [1, 0, 0], "data": {"material": "0x1", "color": "#00ff00"}},
+        {"pos": [1, 1, 1], "data": {"material": "0x1", "color": "#00ff00"}},
+        {"pos": [-1, 0, 0], "data": {"material": "0x3", "color": "#0000ff"}},
+    ]
+    # One briq per 2x2x2 block, of the most common colour.
+    assert downsample(briqs, 2).briqs == [
+        {"pos": [0, 0, 0], "data": {"color": "#00ff00", "material": "0x1"}},
+        {"pos": [-1, 0, 0], "data": {"color": "#0000ff", "material": "0x3"}},
+    ]
+    # Same size as the full model.
+    gltf = pygltflib.GLTF2.load_from_bytes(BriqData().load_briqs(briqs).to_lod_glb(1))
+    assert [gltf.accessors[1].min, gltf.accessors[1].max] == [[-0.5, -0.5, -0.5], [1.5, 1.5, 1.5]]
+    assert [gltf.accessors[3].min, gltf.accessors[3].max] == [[-2.5, -0.5, -0.5], [-0.5, 1.5, 1.5]]
+
+    briq = BriqData().load(json.loads(briq_data))
+    assert len(briq.to_glb()) > len(briq.to_lod_glb(1)) >= len(briq.to_lod_glb(2))
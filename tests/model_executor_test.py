@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+import pytest
+
+from briq_api.model_executor import ModelExecutor, QueueFullException, render_model
+
+
+@pytest.mark.asyncio
+async def test_model_executor():
+    executor = ModelExecutor(max_workers=1, max_queued=0)
+    try:
+        # Same key: one job, shared.
+        jobs = [asyncio.ensure_future(executor.run("a", time.sleep, 0.5)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert executor.pending == 1
+        # Another key doesn't fit.
+        with pytest.raises(QueueFullException):
+            await executor.run("b", time.sleep, 0)
+        await asyncio.gather(*jobs)
+        assert executor.pending == 0
+
+        briqs = [{"pos": [0, 0, 0], "data": {"material": "0x1", "color": "#c5ac73"}}]
+        glb = await executor.run("b", render_model, {"briqs": briqs}, "glb")
+        assert glb[:4] == b'glTF'
+    finally:
+        executor.shutdown()
@@ -0,0 +1,109 @@
+import logging
+
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+import pytest
+
+from briq_api.api.routes.common import ExceptionWrapperRoute, bytes_response, info_head_response, parse_range, stream_response
+from briq_api.storage.file.backends.file_storage import FileStorage
+from briq_api.storage.file.file_client import FileData
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == (0, 10)
+    assert parse_range("bytes=90-", 100) == (90, 100)
+    assert parse_range("bytes=-10", 100) == (90, 100)
+    assert parse_range("bytes=50-500", 100) == (50, 100)
+    # Unsupported or invalid, send everything.
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("bytes=9-1", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    with pytest.raises(HTTPException):
+        parse_range("bytes=100-", 100)
+
+
+def test_range_responses(tmp_path):
+    storage = FileStorage(str(tmp_path) + "/")
+    storage.store_bytes("a.glb", b"0123456789")
+    app = FastAPI()
+
+    @app.get("/bytes")
+    async def get_bytes(request: Request):
+        return bytes_response(request, b"0123456789", "model/gltf-binary", {})
+
+    @app.get("/stream")
+    async def get_stream(request: Request):
+        return await stream_response(
+            request,
+            lambda start, end: storage.aopen_stream("a.glb", 4, start, end),
+            lambda: storage.aget_info("a.glb"),
+            "model/gltf-binary",
+            {}
+        )
+
+    client = TestClient(app)
+    for url in ["/bytes", "/stream"]:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.content == b"0123456789"
+        assert response.headers["accept-ranges"] == "bytes"
+
+        response = client.get(url, headers={"Range": "bytes=2-6"})
+        assert response.status_code == 206
+        assert response.content == b"23456"
+        assert response.headers["content-range"] == "bytes 2-6/10"
+
+        assert client.get(url, headers={"Range": "bytes=20-"}).status_code == 416
+
+
+def test_conditional_requests(tmp_path):
+    storage = FileStorage(str(tmp_path) + "/")
+    storage.store_bytes("a.glb", b"0123456789")
+    router = APIRouter(route_class=ExceptionWrapperRoute(logging.getLogger(__name__)))
+    fetched = []
+
+    @router.get("/json")
+    async def get_json():
+        return {"a": 1}
+
+    @router.head("/bytes")
+    @router.get("/bytes")
+    async def get_bytes(request: Request):
+        if request.method == "HEAD":
+            return info_head_response(request, await storage.aget_info("a.glb"), "model/gltf-binary", {})
+        fetched.append(request.url.path)
+        return bytes_response(request, await storage.aload_bytes("a.glb"), "model/gltf-binary", {})
+
+    @router.head("/stream")
+    @router.get("/stream")
+    async def get_stream(request: Request):
+        async def open_stream(start, end):
+            fetched.append(request.url.path)
+            return await storage.aopen_stream("a.glb", 4, start, end)
+        return await stream_response(request, open_stream, lambda: storage.aget_info("a.glb"), "model/gltf-binary", {})
+
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    for url in ["/json", "/stream"]:
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+        assert client.get(url, headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+        assert client.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+    # Only the requests that didn't match fetched the content.
+    assert len(fetched) == 2
+
+    # HEAD only needs the metadata.
+    for url in ["/bytes", "/stream"]:
+        response = client.head(url)
+        assert response.status_code == 200
+        assert response.headers["content-length"] == "10"
+        assert response.headers["etag"] == etag
+        assert client.head(url, headers={"If-None-Match": etag}).status_code == 304
+    assert len(fetched) == 2
+    # Streamed files and the same bytes from memory agree on the ETag.
+    assert etag == bytes_response(Request({"type": "http", "headers": []}), b"0123456789", "model/gltf-binary", {}).headers["etag"]
+    file = FileData.of(b"0123456789")
+    assert etag == bytes_response(Request({"type": "http", "headers": []}), file.data, "model/gltf-binary", {}, file.etag).headers["etag"]
@@ -0,0 +1,29 @@
+import pytest
+
+from briq_api.set_identifier import SetRID
+from briq_api.set_indexer.render_queue import RenderQueue
+from briq_api.storage.file.backends.file_storage import FileStorage
+from briq_api.storage.file.file_client import FileClient
+
+
+@pytest.mark.asyncio
+async def test_render_queue(tmp_path):
+    storage = FileClient()
+    storage.connect(FileStorage(str(tmp_path) + "/"))
+    rid = SetRID(chain_id="starknet-testnet", token_id="0xcafe")
+    metadata = {"briqs": [{"pos": [x, 0, 0], "data": {"material": "0x1", "color": "#c5ac73"}} for x in range(3)]}
+
+    queue = RenderQueue(storage, workers=1, max_size=1)
+    queue.start()
+    try:
+        assert queue.enqueue(rid, metadata)
+        # Over capacity, left to the API.
+        assert not queue.enqueue(SetRID(chain_id="starknet-testnet", token_id="0xbeef"), metadata)
+        await queue.queue.join()
+    finally:
+        queue.stop()
+
+    assert storage.load_set_model(rid, "glb")[:4] == b"glTF"
+    assert storage.load_set_model(rid, "lod1.glb")[:4] == b"glTF"
+    assert storage.load_set_preview(rid)[1:4] == b"PNG"
+    assert (await storage.aload_set_small_preview(rid))[:2] == b"\xff\xd8"